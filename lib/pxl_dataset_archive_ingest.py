@@ -0,0 +1,223 @@
+import collections
+import concurrent.futures
+import functools
+import os
+import tarfile
+import time
+import zipfile
+
+import pandas as pd
+
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_format_exception import PXL_dataset_format_exception
+from .pxl_dataset_parallel import chunked, default_worker_count, map_chunks
+from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_writer import PXL_dataset_write_report, _run_write_chunk
+from .pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest, _split_key
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_archive_ingest(object):
+    """
+    Streams the members of a zip or tar archive, as downloaded from Kaggle, straight into the save layout of a dataset,
+    without extracting the archive first, so every byte is written to disk once.
+    The split of a member is the folder that starts with the value of a PXL_dataset_split, at the first level below the
+    single folders that wrap the whole archive. Inside a split:
+        Object detection    images and YOLO .txt label files, also in images/ and labels/ subfolders
+        Segmentation        images, and masks in a subfolder whose name starts with one of MASK_FOLDERS
+        Classification      images in a folder per label
+    Zip members are read and written with one archive handle per task, tar members are read in archive order, as
+    compressed tar files can only be read sequentially. Members that are copied as they are are written on a thread
+    pool, members that are transcoded on a process pool.
+    With a PXL_dataset_codec the images, but not the masks, are saved in its format.
+    """
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tif', '.tiff')
+    MASK_FOLDERS = ('mask', 'segment', 'label', 'annot', 'gt')
+    EXTENSION_FORMATS = {'.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp'}
+
+    def __init__(self, max_workers: int = None, chunk_size: int = 64, codec: PXL_dataset_codec = None):
+        """
+        Initialize the ingest with the number of threads, the number of members per task and the codec of the images.
+        """
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.last_write_report = PXL_dataset_write_report()
+        self.box_tables = None
+
+    def ingest(self, archive_path: str, dataset_type: PXL_dataset_types, save_directory: str):
+        """
+        Write the members of the archive into save_directory for the dataset type and return the df_map of the saved dataset.
+        For object detection the boxes of every split are kept in box_tables.
+        Raises a PXL_dataset_format_exception when no member is in a split folder.
+        """
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        elif tarfile.is_tarfile(archive_path):
+            with tarfile.open(archive_path) as archive:
+                names = [member.name for member in archive.getmembers() if member.isfile()]
+        else:
+            raise PXL_value_exception("{} is not a zip or tar archive.".format(archive_path))
+        targets = self.plan(names, dataset_type, save_directory)
+        if not targets:
+            raise PXL_dataset_format_exception("No split folders found in {}.".format(archive_path))
+        for target in {os.path.dirname(target) for _, target, _ in targets.values()}:
+            os.makedirs(target, exist_ok=True)
+        start = time.perf_counter()
+        if zipfile.is_zipfile(archive_path):
+            extract = functools.partial(_extract_zip_chunk, archive_path)
+            self.last_write_report = PXL_dataset_write_report()
+            for kind, executor_class in (("bytes", concurrent.futures.ThreadPoolExecutor), ("transcode", concurrent.futures.ProcessPoolExecutor)):
+                tasks = [(name, kind, target, codec) for name, (task_kind, target, codec) in targets.items() if task_kind == kind]
+                for chunk_report in map_chunks(extract, chunked(tasks, self.chunk_size), executor_class, self.max_workers):
+                    self.last_write_report.add(chunk_report)
+        else:
+            with tarfile.open(archive_path) as archive:
+                transcodes = any(kind == "transcode" for kind, _, _ in targets.values())
+                self.last_write_report = self._write_tar_tasks(self._tar_tasks(archive, targets), transcodes)
+        self.last_write_report.seconds = time.perf_counter() - start
+        return self._df_map(targets, dataset_type)
+
+    def plan(self, names, dataset_type: PXL_dataset_types, save_directory: str):
+        """
+        Return a map from the archive member names to the (kind, target path, codec) of the members that belong to the dataset.
+        The kind is 'bytes' for members that are copied as they are, with codec None, and 'transcode' for images that are
+        converted with the codec: the codec of the ingest, or lossless PNG for masks and for segmentation images without one.
+        """
+        split_depth = _split_depth([name.split("/") for name in names])
+        targets = {}
+        for name in names:
+            parts = name.split("/")
+            if len(parts) <= split_depth + 1 or parts[-1].startswith("."):
+                continue
+            key = _split_key(parts[split_depth])
+            if key is None:
+                continue
+            folders = parts[split_depth + 1:-1]
+            filename = parts[-1]
+            stem, extension = os.path.splitext(filename)
+            extension = extension.lower()
+            split_directory = "{}{}/".format(save_directory, key)
+            if dataset_type == PXL_dataset_types.Object_Detection:
+                if extension == ".txt":
+                    targets[name] = ("bytes", split_directory + filename, None)
+                elif extension in self.IMAGE_EXTENSIONS:
+                    targets[name] = self._image_target(split_directory + filename, extension, self.codec)
+            elif dataset_type == PXL_dataset_types.Segmentation:
+                if extension in self.IMAGE_EXTENSIONS:
+                    is_mask = any(folder.lower().startswith(self.MASK_FOLDERS) for folder in folders)
+                    folder = "segmented" if is_mask else "image"
+                    codec = PXL_dataset_codec('png') if is_mask or self.codec is None else self.codec
+                    targets[name] = self._image_target("{}{}/{}".format(split_directory, folder, filename), extension, codec)
+            elif dataset_type == PXL_dataset_types.Classification:
+                if extension in self.IMAGE_EXTENSIONS and folders:
+                    targets[name] = self._image_target("{}{}/{}".format(split_directory, folders[-1], filename), extension, self.codec)
+            else:
+                raise PXL_value_exception("Dataset type not implemented yet")
+        return targets
+
+    def _image_target(self, target: str, extension: str, codec: PXL_dataset_codec = None):
+        """
+        Private method that returns the (kind, target path, codec) of an image: copied as it is without a codec or when the
+        extension matches the codec, or else transcoded with the codec to a target with the extension of the codec.
+        """
+        if codec is None or codec.matches(self.EXTENSION_FORMATS.get(extension)):
+            return ("bytes", target, None)
+        return ("transcode", codec.target_path(target), codec)
+
+    def _tar_tasks(self, archive, targets: map):
+        """
+        Private method that reads the planned members of a tar archive in archive order and yields the writer tasks
+        with their codec.
+        """
+        for member in archive:
+            if member.name in targets:
+                kind, target, codec = targets[member.name]
+                with archive.extractfile(member) as file:
+                    yield (kind, file.read(), target, codec)
+
+    def _write_tar_tasks(self, tasks, transcodes: bool):
+        """
+        Private method that writes the tasks read from a tar archive in chunks of one kind and codec: 'bytes' chunks on
+        a thread pool and 'transcode' chunks on a process pool, with a bounded number of chunks in flight.
+        """
+        report = PXL_dataset_write_report()
+        max_workers = self.max_workers or default_worker_count()
+        pending = collections.deque()
+        threads = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        processes = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) if transcodes else None
+        try:
+            for chunk in chunked(tasks, self.chunk_size):
+                groups = {}
+                for kind, data, target, codec in chunk:
+                    groups.setdefault((kind, codec.key if codec else None), (codec, []))[1].append((kind, data, target))
+                for (kind, _), (codec, group_tasks) in groups.items():
+                    executor = threads if kind == "bytes" else processes
+                    pending.append(executor.submit(_run_write_chunk, group_tasks, codec))
+                while len(pending) > max_workers * 2:
+                    report.add(pending.popleft().result())
+            while pending:
+                report.add(pending.popleft().result())
+        finally:
+            threads.shutdown()
+            if processes is not None:
+                processes.shutdown()
+        return report
+
+    def _df_map(self, targets: map, dataset_type: PXL_dataset_types):
+        """
+        Private method that builds the df_map of the written files, pairing images with their labels or masks by name.
+        """
+        self.box_tables = {} if dataset_type == PXL_dataset_types.Object_Detection else None
+        splits = {}
+        for _, target, _ in targets.values():
+            key = target.split("/")[-3] if dataset_type != PXL_dataset_types.Object_Detection else target.split("/")[-2]
+            splits.setdefault(key, []).append(target)
+        df_map = {}
+        for key, paths in splits.items():
+            paths.sort()
+            if dataset_type == PXL_dataset_types.Object_Detection:
+                label_paths = {os.path.splitext(path)[0] for path in paths if path.endswith(".txt")}
+                images = [path for path in paths if not path.endswith(".txt")]
+                labels = [os.path.splitext(path)[0] + ".txt" if os.path.splitext(path)[0] in label_paths else None for path in images]
+                self.box_tables[key] = PXL_dataset_yolo_ingest(self.max_workers).parse_labels(labels)
+                df_map[key] = pd.DataFrame({'image': images})
+            elif dataset_type == PXL_dataset_types.Segmentation:
+                masks = {os.path.splitext(path.split("/")[-1])[0]: path for path in paths if path.split("/")[-2] == "segmented"}
+                images = [path for path in paths if path.split("/")[-2] == "image" and os.path.splitext(path.split("/")[-1])[0] in masks]
+                df_map[key] = pd.DataFrame({'image': images, 'segmentation_image': [masks[os.path.splitext(path.split("/")[-1])[0]] for path in images]})
+            else:
+                df_map[key] = pd.DataFrame({'image': paths, 'label': [path.split("/")[-2] for path in paths]})
+        return df_map
+
+
+def _split_depth(split_names):
+    """
+    Private function that returns the depth of the split folders: the deepest level of the chain of single folders
+    that wrap the archive at which a folder starts with a split prefix.
+    """
+    depth = 0
+    while all(len(parts) > depth + 1 for parts in split_names) and len({parts[depth] for parts in split_names}) == 1:
+        depth += 1
+    for candidate in range(depth, -1, -1):
+        if any(len(parts) > candidate + 1 and _split_key(parts[candidate]) is not None for parts in split_names):
+            return candidate
+    return depth
+
+
+def _extract_zip_chunk(archive_path: str, tasks):
+    """
+    Private function that reads a chunk of (name, kind, target, codec) members from its own handle on a zip archive
+    and writes them to their targets.
+    """
+    report = PXL_dataset_write_report()
+    with zipfile.ZipFile(archive_path) as archive:
+        for name, kind, target, codec in tasks:
+            try:
+                data = archive.read(name)
+            except (OSError, KeyError, zipfile.BadZipFile) as error:
+                report.failures.append((target, "{}: {}".format(type(error).__name__, error)))
+                continue
+            report.add(_run_write_chunk([(kind, data, target)], codec))
+    return report
@@ -0,0 +1,92 @@
+import collections
+import concurrent.futures
+
+import cv2
+import numpy as np
+
+from .pxl_dataset_parallel import chunked, default_worker_count
+from .pxl_dataset_shard_reader import imread
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_batch_iterator(object):
+    """
+    Iterable over the batches of one split. The samples are read and resized on a thread pool, as OpenCV releases
+    the GIL while decoding, and at most prefetch batches, the one that is collated included, are read at a time.
+    The dataset classes give the function that reads one sample and the function that stacks the samples of a batch.
+    """
+    def __init__(self, read_sample, collate, positions, batch_size: int = 32, prefetch: int = 2, max_workers: int = None, drop_last: bool = False):
+        """
+        Initialize the iterator with the functions to read a sample by position and to collate a batch, and the positions in batch order.
+        """
+        if batch_size < 1:
+            raise PXL_value_exception("The batch size must be at least 1.")
+        self.read_sample = read_sample
+        self.collate = collate
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.batch_size = batch_size
+        self.prefetch = max(1, prefetch)
+        self.max_workers = max_workers
+        self.drop_last = drop_last
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.positions) // self.batch_size
+        return -(-len(self.positions) // self.batch_size)
+
+    def __iter__(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers or default_worker_count())
+        pending = collections.deque()
+        try:
+            for batch_positions in chunked(self.positions[:len(self) * self.batch_size].tolist(), self.batch_size):
+                if len(pending) >= self.prefetch:
+                    yield self._collate(*pending.popleft())
+                pending.append((batch_positions, [executor.submit(self.read_sample, position) for position in batch_positions]))
+            while pending:
+                yield self._collate(*pending.popleft())
+        finally:
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+            executor.shutdown(wait=True)
+
+    def _collate(self, batch_positions, futures):
+        """
+        Private method that waits for the samples of a batch and stacks them.
+        """
+        return self.collate(np.array(batch_positions, dtype=np.int64), [future.result() for future in futures])
+
+
+def read_image(path: str, image_size: tuple = None):
+    """
+    Read an image as an RGB uint8 array, resized to image_size (width, height) when given.
+    """
+    image = imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise FileNotFoundError("Image {} could not be read.".format(path))
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if image_size is not None and (image.shape[1], image.shape[0]) != tuple(image_size):
+        image = cv2.resize(image, tuple(image_size), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def read_mask(path: str, image_size: tuple = None):
+    """
+    Read a segmentation mask as a single channel uint8 array, resized with nearest neighbour interpolation to keep the mask values.
+    """
+    mask = imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise FileNotFoundError("Segmentation image {} could not be read.".format(path))
+    if image_size is not None and (mask.shape[1], mask.shape[0]) != tuple(image_size):
+        mask = cv2.resize(mask, tuple(image_size), interpolation=cv2.INTER_NEAREST)
+    return mask
+
+
+def stack_arrays(arrays, name: str = "images"):
+    """
+    Stack equally sized arrays into one batch array. Raises a PXL_value_exception when the sizes differ.
+    """
+    shapes = {array.shape for array in arrays}
+    if len(shapes) > 1:
+        raise PXL_value_exception("The {} of a batch have different sizes {}, give an image_size to resize them.".format(name, sorted(shapes)))
+    return np.stack(arrays)
@@ -0,0 +1,265 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .pxl_dataset_manifest import PXL_dataset_manifest
+from .pxl_dataset_object_detection import PXL_object_detection_dataset
+from .pxl_dataset_segmentation import PXL_segmentation_dataset
+from .pxl_dataset_synthetic import PXL_dataset_synthetic
+from .pxl_dataset_types import PXL_dataset_types
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_benchmark(object):
+    """
+    Offline benchmark suite that times the main entry points of the library on synthetic datasets of several sizes.
+    Every run happens in a fresh worker process, so the peak RSS of one run is not influenced by the others.
+    The results are plain dicts with the duration, the throughput in images per second and the peak RSS in bytes,
+    and can be written as JSON to track them across versions.
+    Run it from the folder that contains the library with: python -m <library>.lib.pxl_dataset_benchmark --help
+    """
+    BENCHMARKS = (
+        "load_from_save_dir",
+        "load_from_save_dir_manifest",
+        "save_dataset",
+        "export_dataset_in_COCO_format",
+        "export_dataset",
+        "convert_to_object_detection_dataset",
+        "replace_object_files",
+        "print_dataset_information"
+    )
+
+    def __init__(self, work_directory: str = None, sizes: tuple = (100, 1000), image_size: tuple = (640, 480), boxes_per_image: int = 5, num_classes: int = 3, repeat: int = 1):
+        """
+        Initialize the suite with the directory for the generated datasets, the dataset sizes in images,
+        the (width, height) of the images, the number of boxes per image and the number of runs per benchmark.
+        """
+        self.work_directory = work_directory or tempfile.mkdtemp(prefix="pxl_benchmark_") + "/"
+        self.sizes = sizes
+        self.image_size = image_size
+        self.boxes_per_image = boxes_per_image
+        self.num_classes = num_classes
+        self.repeat = repeat
+
+    def run(self, benchmarks=None):
+        """
+        Run the given benchmarks, or all of them, for every dataset size and return a list with a result dict per run.
+        """
+        benchmarks = benchmarks or self.BENCHMARKS
+        unknown = [name for name in benchmarks if name not in self.BENCHMARKS]
+        if unknown:
+            raise PXL_value_exception("Unknown benchmarks {}. The options are {}".format(unknown, list(self.BENCHMARKS)))
+        environment = self._environment()
+        results = []
+        for size in self.sizes:
+            directories = self.generate(size)
+            for name in benchmarks:
+                for run in range(self.repeat):
+                    run_directory = "{}runs/{}_{}_{}/".format(self.work_directory, name, size, run)
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                        measurement = executor.submit(_run_benchmark, name, directories, run_directory).result()
+                    shutil.rmtree(run_directory, ignore_errors=True)
+                    result = {
+                        "benchmark": name,
+                        "num_images": size,
+                        "image_size": list(self.image_size),
+                        "boxes_per_image": self.boxes_per_image,
+                        "run": run
+                    }
+                    result.update(measurement)
+                    result["images_per_second"] = size / result["seconds"] if result["seconds"] > 0 else None
+                    result.update(environment)
+                    results.append(result)
+                    print("{}\t{}\t{:.3f}s\t{:.0f} images/s\t{:.1f} MiB".format(
+                        name, size, result["seconds"], result["images_per_second"] or 0, result["peak_rss_bytes"] / 2**20))
+        return results
+
+    def generate(self, size: int):
+        """
+        Generate the object detection and segmentation datasets of the given size, unless they already exist.
+        Returns a dict with the directory of each dataset.
+        """
+        generator = PXL_dataset_synthetic(self.image_size, self.boxes_per_image, self.num_classes)
+        directories = {}
+        for dataset_type, generate in (("object_detection", generator.generate_object_detection), ("segmentation", generator.generate_segmentation)):
+            directory = "{}{}_{}x{}_{}/{}/".format(self.work_directory, size, self.image_size[0], self.image_size[1], self.boxes_per_image, dataset_type)
+            if not os.path.isdir(directory):
+                partial_directory = directory[:-1] + ".partial/"
+                shutil.rmtree(partial_directory, ignore_errors=True)
+                generate(partial_directory, size)
+                os.rename(partial_directory, directory)
+            directories[dataset_type] = directory
+        return directories
+
+    def write(self, results, path: str):
+        """
+        Write the results as a JSON file.
+        """
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    def _environment(self):
+        """
+        Private method that returns the machine and version information stored with every result.
+        """
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, timeout=10).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+
+
+def _peak_rss_bytes(who):
+    """
+    Private function that returns the peak resident set size in bytes of this process or of its waited children.
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_benchmark(name: str, directories: map, run_directory: str):
+    """
+    Private function that prepares one benchmark in a fresh worker process and times only the entry point itself.
+    """
+    os.makedirs(run_directory, exist_ok=True)
+    function = globals()["_prepare_" + name](directories, run_directory)
+    baseline = _peak_rss_bytes(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "peak_rss_bytes": _peak_rss_bytes(resource.RUSAGE_SELF),
+        "baseline_rss_bytes": baseline,
+        "peak_worker_rss_bytes": _peak_rss_bytes(resource.RUSAGE_CHILDREN)
+    }
+
+
+def _load_object_detection(directory: str):
+    """
+    Private function that loads an object detection dataset through its manifest.
+    """
+    dataset = PXL_object_detection_dataset()
+    dataset.load_from_save_dir(directory)
+    return dataset
+
+
+def _prepare_load_from_save_dir(directories: map, run_directory: str):
+    """
+    Private function for a load without a manifest, so every image header and label file is read.
+    """
+    PXL_dataset_manifest(directories["object_detection"], PXL_dataset_types.Object_Detection).invalidate()
+    return lambda: PXL_object_detection_dataset().load_from_save_dir(directories["object_detection"])
+
+
+def _prepare_load_from_save_dir_manifest(directories: map, run_directory: str):
+    """
+    Private function for a load with an up to date manifest.
+    """
+    _load_object_detection(directories["object_detection"])
+    return lambda: PXL_object_detection_dataset().load_from_save_dir(directories["object_detection"])
+
+
+def _prepare_save_dataset(directories: map, run_directory: str):
+    """
+    Private function for saving a loaded dataset to a new directory through load_from_df_map.
+    """
+    dataset = _load_object_detection(directories["object_detection"])
+    save_directory = run_directory + "saved/"
+    return lambda: PXL_object_detection_dataset().load_from_df_map(dataset.df_map, save_directory, box_tables=dataset.box_tables)
+
+
+def _prepare_export_dataset_in_COCO_format(directories: map, run_directory: str):
+    """
+    Private function for a COCO export of a loaded dataset.
+    """
+    dataset = _load_object_detection(directories["object_detection"])
+    return lambda: dataset.export_dataset_in_COCO_format(run_directory + "coco/")
+
+
+def _prepare_export_dataset(directories: map, run_directory: str):
+    """
+    Private function for a single pass export of a loaded dataset to the YOLO, COCO, VOC and CSV formats.
+    """
+    dataset = _load_object_detection(directories["object_detection"])
+    return lambda: dataset.export_dataset(run_directory + "export/")
+
+
+def _prepare_convert_to_object_detection_dataset(directories: map, run_directory: str):
+    """
+    Private function for converting a loaded segmentation dataset to object detection.
+    """
+    dataset = PXL_segmentation_dataset()
+    dataset.load_from_save_dir(directories["segmentation"])
+    return lambda: dataset.convert_to_object_detection_dataset(run_directory + "converted/")
+
+
+def _prepare_replace_object_files(directories: map, run_directory: str):
+    """
+    Private function for replacing every label file of a copy of the dataset with new ones.
+    """
+    directory = run_directory + "dataset/"
+    shutil.copytree(directories["object_detection"], directory)
+    dataset = _load_object_detection(directory)
+    image_paths = [path for df in dataset.df_map.values() for path in df['image']]
+    PXL_dataset_synthetic(seed=1).generate_label_files(run_directory + "labels/", image_paths)
+    return lambda: dataset.replace_object_files(run_directory + "labels/", run_directory + "backup/")
+
+
+def _prepare_print_dataset_information(directories: map, run_directory: str):
+    """
+    Private function for printing the summary of a loaded dataset.
+    """
+    dataset = _load_object_detection(directories["object_detection"])
+    return dataset.print_dataset_information
+
+
+def main(arguments=None):
+    """
+    Command line entry point of the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the PXL datasets library on synthetic datasets.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="dataset sizes in images")
+    parser.add_argument("--benchmarks", nargs="+", choices=PXL_dataset_benchmark.BENCHMARKS, help="benchmarks to run, all by default")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--boxes-per-image", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per benchmark and size")
+    parser.add_argument("--work-directory", help="directory for the generated datasets, a temporary directory by default")
+    parser.add_argument("--keep", action="store_true", help="keep the generated datasets to reuse them in a next run")
+    parser.add_argument("--output", help="JSON file for the results, printed to stdout by default")
+    arguments = parser.parse_args(arguments)
+
+    work_directory = os.path.join(arguments.work_directory, "") if arguments.work_directory else None
+    benchmark = PXL_dataset_benchmark(work_directory, tuple(arguments.sizes), tuple(arguments.image_size), arguments.boxes_per_image, repeat=arguments.repeat)
+    try:
+        results = benchmark.run(arguments.benchmarks)
+    finally:
+        if not arguments.keep:
+            shutil.rmtree(benchmark.work_directory, ignore_errors=True)
+    if arguments.output:
+        benchmark.write(results, arguments.output)
+    else:
+        print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
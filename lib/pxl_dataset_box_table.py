@@ -0,0 +1,262 @@
+import numpy as np
+
+
+class PXL_dataset_box_table(object):
+    """
+    Columnar store for the bounding boxes of one object detection split.
+    The boxes of image i are the rows offsets[i]:offsets[i+1] of the cx, cy, w, h and class_id columns,
+    where i is the index label of the image in the dataframe of the split.
+    Coordinates are normalised YOLO values (center x, center y, width, height).
+    """
+    def __init__(self, cx, cy, w, h, class_id, offsets):
+        """
+        Initialize the table from its columns. All columns are converted to contiguous arrays.
+        """
+        self.cx = np.ascontiguousarray(cx, dtype=np.float32)
+        self.cy = np.ascontiguousarray(cy, dtype=np.float32)
+        self.w = np.ascontiguousarray(w, dtype=np.float32)
+        self.h = np.ascontiguousarray(h, dtype=np.float32)
+        self.class_id = np.ascontiguousarray(class_id, dtype=np.int32)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def empty(cls, num_images: int = 0):
+        """
+        Create a table with the given number of images and no boxes.
+        """
+        return cls.from_arrays(np.zeros(num_images, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.float32))
+
+    @classmethod
+    def from_arrays(cls, counts, class_ids, boxes):
+        """
+        Create a table from the number of boxes per image, the class of every box and an (N, 4) array of boxes.
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3], class_ids, offsets)
+
+    @classmethod
+    def from_objects(cls, objects_per_image):
+        """
+        Create a table from a list with the objects of every image.
+        The objects of an image are either a list of dicts with 'name' and 'centerNSize' or 'poly' values,
+        or an (n, 5) array with the class followed by the box of every object.
+        """
+        counts = np.zeros(len(objects_per_image), dtype=np.int64)
+        class_ids = []
+        boxes = []
+        for index, objects in enumerate(objects_per_image):
+            if objects is None:
+                continue
+            if isinstance(objects, np.ndarray):
+                objects = objects.reshape(-1, 5)
+                class_ids.append(objects[:, 0].astype(np.int32))
+                boxes.append(objects[:, 1:].astype(np.float32))
+                counts[index] = len(objects)
+                continue
+            image_boxes = []
+            for obj in objects:
+                if "centerNSize" in obj:
+                    image_boxes.append([float(value) for value in obj["centerNSize"]])
+                else:
+                    image_boxes.append(_poly_to_center_and_size([float(value) for point in obj["poly"] for value in point]))
+            class_ids.append(np.array([int(obj.get("name", 0)) for obj in objects], dtype=np.int32))
+            boxes.append(np.array(image_boxes, dtype=np.float32).reshape(-1, 4))
+            counts[index] = len(objects)
+        if not boxes:
+            return cls.from_arrays(counts, np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.float32))
+        return cls.from_arrays(counts, np.concatenate(class_ids), np.concatenate(boxes))
+
+    @classmethod
+    def from_yolo_files(cls, filepaths, missing_ok: bool = False):
+        """
+        Create a table by parsing a YOLO label file for every image.
+        """
+        counts = np.zeros(len(filepaths), dtype=np.int64)
+        class_ids = []
+        boxes = []
+        for index, filepath in enumerate(filepaths):
+            image_class_ids, image_boxes = _read_yolo_file(filepath, missing_ok)
+            counts[index] = len(image_class_ids)
+            class_ids.append(image_class_ids)
+            boxes.append(image_boxes)
+        if not boxes:
+            return cls.empty(0)
+        return cls.from_arrays(counts, np.concatenate(class_ids), np.concatenate(boxes))
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Append the images of several tables into one table.
+        """
+        if not tables:
+            return cls.empty(0)
+        counts = np.concatenate([table.counts() for table in tables])
+        class_ids = np.concatenate([table.class_id for table in tables])
+        boxes = np.concatenate([table.box_array() for table in tables])
+        return cls.from_arrays(counts, class_ids, boxes)
+
+    def __len__(self):
+        """
+        Return the total number of boxes in the table.
+        """
+        return len(self.class_id)
+
+    @property
+    def num_images(self):
+        """
+        Number of images in the table.
+        """
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the columns of the table.
+        """
+        return sum(column.nbytes for column in (self.cx, self.cy, self.w, self.h, self.class_id, self.offsets))
+
+    def counts(self):
+        """
+        Return the number of boxes of every image.
+        """
+        return np.diff(self.offsets)
+
+    def image_ids(self):
+        """
+        Return the image index of every box.
+        """
+        return np.repeat(np.arange(self.num_images, dtype=np.int64), self.counts())
+
+    def box_array(self):
+        """
+        Return all boxes as one (N, 4) array of cx, cy, w, h.
+        """
+        return np.stack((self.cx, self.cy, self.w, self.h), axis=1)
+
+    def boxes(self, index: int):
+        """
+        Return the boxes of one image as an (n, 4) array of cx, cy, w, h.
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return np.stack((self.cx[start:end], self.cy[start:end], self.w[start:end], self.h[start:end]), axis=1)
+
+    def class_ids(self, index: int):
+        """
+        Return the classes of the boxes of one image.
+        """
+        return self.class_id[self.offsets[index]:self.offsets[index + 1]]
+
+    def label_array(self, index: int):
+        """
+        Return the objects of one image as an (n, 5) array with the class followed by the box.
+        """
+        return np.concatenate((self.class_ids(index).astype(np.float32)[:, None], self.boxes(index)), axis=1)
+
+    def objects(self, index: int):
+        """
+        Return the objects of one image as a list of dicts, in the format of the 'objects' column.
+        """
+        return [{"name": str(class_id), "centerNSize": box}
+                for class_id, box in zip(self.class_ids(index).tolist(), self.boxes(index).tolist())]
+
+    def to_objects(self):
+        """
+        Return the objects of every image as a list of lists of dicts.
+        """
+        return [self.objects(index) for index in range(self.num_images)]
+
+    def select(self, indices):
+        """
+        Return a new table with only the given images, in the given order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        counts = self.offsets[indices + 1] - starts
+        box_indices = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum(), dtype=np.int64)
+        return PXL_dataset_box_table.from_arrays(counts, self.class_id[box_indices], self.box_array()[box_indices])
+
+    def replace(self, indices, other):
+        """
+        Return a new table where the boxes of the given images are replaced by the images of another table.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        keep = np.ones(self.num_images, dtype=bool)
+        keep[indices] = False
+        keep_boxes = np.repeat(keep, self.counts())
+        counts = self.counts()
+        counts[indices] = other.counts()
+        image_ids = np.concatenate((self.image_ids()[keep_boxes], indices[other.image_ids()]))
+        order = np.argsort(image_ids, kind='stable')
+        class_ids = np.concatenate((self.class_id[keep_boxes], other.class_id))[order]
+        boxes = np.concatenate((self.box_array()[keep_boxes], other.box_array()))[order]
+        return PXL_dataset_box_table.from_arrays(counts, class_ids, boxes)
+
+
+def _poly_to_center_and_size(values):
+    """
+    Private function to convert a flat list of polygon points to the enclosing center and size box.
+    """
+    xs = values[0::2]
+    ys = values[1::2]
+    x_min, x_max, y_min, y_max = min(xs), max(xs), min(ys), max(ys)
+    return [(x_min + x_max) / 2.0, (y_min + y_max) / 2.0, x_max - x_min, y_max - y_min]
+
+
+def _parse_yolo_text(text: str):
+    """
+    Private function to parse the content of a YOLO label file into class ids and an (n, 4) box array.
+    Polygon lines are reduced to their enclosing box.
+    """
+    values = text.split()
+    num_lines = sum(1 for line in text.splitlines() if line.strip())
+    if len(values) == 5 * num_lines:
+        rows = np.array(values, dtype=np.float32).reshape(-1, 5)
+        return rows[:, 0].astype(np.int32), rows[:, 1:]
+    class_ids = []
+    boxes = []
+    for line in text.splitlines():
+        values = line.split()
+        if not values:
+            continue
+        class_ids.append(int(float(values[0])))
+        if len(values) == 5:
+            boxes.append([float(value) for value in values[1:]])
+        else:
+            boxes.append(_poly_to_center_and_size([float(value) for value in values[1:]]))
+    return np.array(class_ids, dtype=np.int32), np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def _read_yolo_file(filepath: str, missing_ok: bool = False):
+    """
+    Private function to read and parse one YOLO label file. A filepath of None is an image without labels.
+    """
+    if filepath is None:
+        return _parse_yolo_text("")
+    try:
+        with open(filepath, 'r') as file:
+            text = file.read()
+    except FileNotFoundError:
+        if not missing_ok:
+            raise
+        text = ""
+    return _parse_yolo_text(text)
+
+
+def _read_yolo_chunk(filepaths):
+    """
+    Private function to parse a chunk of YOLO label files into the arrays of a box table.
+    Used as a worker task, so it only returns plain arrays.
+    """
+    counts = np.zeros(len(filepaths), dtype=np.int64)
+    class_ids = []
+    boxes = []
+    for index, filepath in enumerate(filepaths):
+        image_class_ids, image_boxes = _read_yolo_file(filepath, missing_ok=True)
+        counts[index] = len(image_class_ids)
+        class_ids.append(image_class_ids)
+        boxes.append(image_boxes)
+    if not boxes:
+        return counts, np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.float32)
+    return counts, np.concatenate(class_ids), np.concatenate(boxes)
@@ -1,10 +1,13 @@
 from .pxl_datasets import PXL_datasets
+from .pxl_dataset_image_cache import PXL_dataset_image_cache
 from .pxl_dataset_loader import PXL_dataset_loader
+from .pxl_dataset_shards import PXL_dataset_shards
 from .pxl_dataset_types import PXL_dataset_types
 from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_statistics import label_counts
 
-import cv2
 import matplotlib.pyplot as plt
+import numpy as np
 
 class PXL_classification_dataset(PXL_datasets):
 
@@ -24,9 +27,15 @@ class PXL_classification_dataset(PXL_datasets):
     
     def load_from_save_dir(self, save_directory: str):
         """
-        Loads the dataset from a specified save directory.
+        Loads the dataset from a specified save directory, with the images in a folder per label,
+        or from a sharded save directory through its shard index.
         """
-        pass
+        self.save_directory = save_directory
+        if PXL_dataset_shards.is_sharded(save_directory):
+            self.df_map = PXL_dataset_shards(save_directory).load_classification()
+        else:
+            self.df_map = self.view(save_directory).to_df_map()
+        return self.df_map
     
     def load_from_df_map(self, df_map:map, save_directory:str, loader:PXL_dataset_loader=PXL_dataset_loader()):
         """
@@ -40,17 +49,38 @@ class PXL_classification_dataset(PXL_datasets):
         """
         super().print_dataset_information()
     
+    def statistics(self, resolutions:bool=False, max_workers:int=None):
+        """
+        Return the statistics of the dataset with the number of images per label and split.
+        """
+        statistics = super().statistics(resolutions, max_workers)
+        statistics.classes = label_counts(self.df_map)
+        return statistics
+
     def display_random_image(self, split:PXL_dataset_split):
         """
         Displays a random image from the dataset for a given dataset split.
+        The image is taken from the shared decoded-image cache.
         """
         df = self.df_map[split.name.lower()]
         row = df.sample(n=1).iloc[0]
-        image = cv2.imread(row['image'])
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = PXL_dataset_image_cache.shared().get(row['image'])
         plt.figure(figsize=(10, 10))
         plt.imshow(image)
         plt.axis('off')
         plt.title(row['image'])
         plt.show()
 
+    def _collate_batch(self, key:str, positions, samples):
+        """
+        Private method that stacks the images of a batch with their labels for iter_batches.
+        The labels are taken from the 'label' column, or from the name of the folder of each image.
+        """
+        df = self.df_map[key]
+        if 'label' in df.columns:
+            labels = df['label'].to_numpy()[positions]
+        else:
+            labels = np.array([df['image'].iat[position].split("/")[-2] for position in positions])
+        batch = super()._collate_batch(key, positions, samples)
+        batch['labels'] = labels
+        return batch
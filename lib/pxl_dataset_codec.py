@@ -0,0 +1,93 @@
+import io
+import os
+
+from PIL import Image
+
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_codec(object):
+    """
+    Target codec of a transcode with its settings:
+        png     compress_level 0 (fastest, largest) to 9 (slowest, smallest), always lossless
+        jpeg    quality 1 to 95, images with transparency are flattened to RGB
+        webp    quality 1 to 100, or lossless, where quality sets the compression effort
+    A codec is a plain object, so it can be sent to worker processes.
+    """
+    FORMATS = {'png': ('PNG', '.png'), 'jpeg': ('JPEG', '.jpg'), 'webp': ('WEBP', '.webp')}
+
+    def __init__(self, image_format: str = 'png', quality: int = 90, compress_level: int = 6, lossless: bool = False):
+        """
+        Initialize the codec with the image format and its settings.
+        """
+        image_format = image_format.lower().replace('jpg', 'jpeg')
+        if image_format not in self.FORMATS:
+            raise PXL_value_exception("Unknown image format '{}'. The options are {}".format(image_format, list(self.FORMATS.keys())))
+        if not 0 <= compress_level <= 9:
+            raise PXL_value_exception("The PNG compress_level must be between 0 and 9.")
+        if image_format == 'jpeg' and not 1 <= quality <= 95:
+            raise PXL_value_exception("The JPEG quality must be between 1 and 95.")
+        if not 1 <= quality <= 100:
+            raise PXL_value_exception("The quality must be between 1 and 100.")
+        self.image_format = image_format
+        self.quality = quality
+        self.compress_level = compress_level
+        self.lossless = lossless
+
+    @property
+    def extension(self):
+        """
+        File extension of the format, with the dot.
+        """
+        return self.FORMATS[self.image_format][1]
+
+    def matches(self, image_format: str):
+        """
+        True when an image in the given format ('png', 'jpeg', 'webp' or None) does not need to be transcoded.
+        """
+        return image_format == self.image_format
+
+    @property
+    def key(self):
+        """
+        String with the format and all settings, which changes whenever the codec would encode an image differently.
+        """
+        return "{}:quality={}:lossless={}:compress_level={}".format(self.image_format, self.quality, int(self.lossless), self.compress_level)
+
+    def target_path(self, path: str):
+        """
+        Return the path with the extension of the format.
+        """
+        return os.path.splitext(path)[0] + self.extension
+
+    def save(self, image, target):
+        """
+        Save a PIL image to a path or file object in the format with the settings of the codec.
+        """
+        if self.image_format == 'png':
+            image.save(target, 'PNG', compress_level=self.compress_level)
+        elif self.image_format == 'jpeg':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            image.save(target, 'JPEG', quality=self.quality)
+        else:
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+            image.save(target, 'WEBP', quality=self.quality, lossless=self.lossless, method=4)
+
+    def encode(self, data: bytes):
+        """
+        Decode encoded image bytes and return them encoded with the codec.
+        """
+        output = io.BytesIO()
+        with Image.open(io.BytesIO(data)) as image:
+            self.save(image, output)
+        return output.getvalue()
+
+    def __repr__(self):
+        if self.image_format == 'png':
+            return "PXL_dataset_codec('png', compress_level={})".format(self.compress_level)
+        if self.image_format == 'webp' and self.lossless:
+            return "PXL_dataset_codec('webp', lossless=True)"
+        return "PXL_dataset_codec('{}', quality={})".format(self.image_format, self.quality)
+
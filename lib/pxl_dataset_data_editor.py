@@ -1,22 +1,42 @@
+import concurrent.futures
 import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageTk
-import cv2
 import pandas as pd
 import numpy as np
 import os
 import shutil
 
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_image_cache import PXL_dataset_image_cache
+from .pxl_dataset_image_probe import PXL_dataset_image_probe
+from .pxl_dataset_writer import write_file_atomic
+
 class PXL_Dataset_Data_Editor:
-    def __init__(self, master, df, save_directory, start_index:int=0):
+    def __init__(self, master, df, save_directory, start_index:int=0, box_table:PXL_dataset_box_table=None, prefetch:int=3, frame_interval:int=16):
         """
         Initialize the main components of the dataset editor GUI.
+        The boxes are taken from the box table when given, otherwise from the 'objects' column of the dataframe.
+        The next prefetch images are decoded and scaled on a background thread, and label files are written on another one.
+        The image is shown once on a canvas and the boxes are canvas items on top of it, slider moves are redrawn
+        at most once every frame_interval milliseconds.
         """
         self.master = master
         self.master.title("Object Detection Dataset Editor")
+        self.master.protocol("WM_DELETE_WINDOW", self.close)
         self.df = df
+        self.box_table = box_table
         self.save_directory = save_directory
         self.current_image_index = start_index
+        self.prefetch = prefetch
+        self.frame_interval = frame_interval
+        self.display_height = self.master.winfo_screenheight() - (self.master.winfo_screenheight()//5)
+        self._loader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._prefetched = {}
+        self._pending_writes = []
+        self._rectangle_items = []
+        self._scheduled_display = None
 
         if not (os.path.exists(self.save_directory)):
             os.mkdir(self.save_directory)
@@ -28,13 +48,13 @@ class PXL_Dataset_Data_Editor:
         
         # Setup image
         image_path = df.iloc[self.current_image_index]["image"]
-        objects = self.df.iloc[self.current_image_index]["objects"]
         self.load_image(image_path)
-        self.photo = ImageTk.PhotoImage(image=Image.fromarray(self.cv_image))
-        self.image_label = tk.Label(master, image=self.photo)
-        self.image_label.grid(row=1, column=1)
+        self.canvas = tk.Canvas(master, highlightthickness=0)
+        self.canvas.grid(row=1, column=1)
+        self.image_item = self.canvas.create_image(0, 0, anchor="nw")
+        self.show_image()
         self.setup_sliders()
-        self.load_objects_as_rectangle(objects)
+        self.load_objects_as_rectangle(self.get_boxes(self.current_image_index))
         self.select_rectangle(0)
         self.update_display()
 
@@ -62,43 +82,70 @@ class PXL_Dataset_Data_Editor:
 
         # Initialize radio buttons and select the first rectangle
         self.setup_radio_buttons()
-
-
+        self._prefetch_images()
 
     def load_image(self, path):
         """
         Load and scale an image from a file path.
+        The size is read from the image header, so the scaled image can be taken from the shared decoded-image cache.
         """
-        self.cv_image = cv2.imread(path)
-        if self.cv_image is None:
-            raise FileNotFoundError("Image file not found.")
-        self.cv_image = cv2.cvtColor(self.cv_image, cv2.COLOR_BGR2RGB)
-        height = self.master.winfo_screenheight() - (self.master.winfo_screenheight()//5)
-        scale_ratio = height / self.cv_image.shape[0]
-        new_width = int(self.cv_image.shape[1] * scale_ratio)
-        self.cv_image = cv2.resize(self.cv_image, (new_width, height))
+        self.cv_image = _load_scaled_image(path, self.display_height)
 
     def next_image(self):
         """
         Load the next image and save the current annotations.
+        The label file is written in the background and the next image is normally already decoded by the prefetcher.
         """
         if self.current_image_index < len(self.df) - 1:
             current_image_path = self.df.iloc[self.current_image_index]["image"]
             save_file_path = "{}{}.txt".format(self.save_directory, current_image_path.split('/')[-1].split(".")[0])
-            self.write_yolo_bounding_boxes_file(save_file_path)
+            self._check_writes()
+            self._pending_writes.append(self._writer.submit(write_file_atomic, save_file_path, self.format_yolo_bounding_boxes()))
             self.current_image_index += 1
-            image_path = self.df.iloc[self.current_image_index]["image"]
-            objects = self.df.iloc[self.current_image_index]["objects"]
-            self.load_image(image_path)
-            self.setup_sliders()
-            self.load_objects_as_rectangle(objects)
-            self.select_rectangle(0)
+            future = self._prefetched.pop(self.current_image_index, None)
+            if future is not None:
+                self.cv_image = future.result()
+            else:
+                self.load_image(self.df.iloc[self.current_image_index]["image"])
+            self._prefetch_images()
+            self.show_image()
+            self.update_sliders()
+            self.load_objects_as_rectangle(self.get_boxes(self.current_image_index))
             self.setup_radio_buttons()
-            self.update_display()
+            self.select_rectangle(0)
+            if not self.rectangles:
+                self.update_display()
+
+    def show_image(self):
+        """
+        Upload the current image to the canvas. This is done once per image, the boxes are drawn on top of it.
+        """
+        height, width = self.cv_image.shape[:2]
+        self.photo = ImageTk.PhotoImage(image=Image.fromarray(self.cv_image))
+        self.canvas.config(width=width, height=height)
+        self.canvas.itemconfig(self.image_item, image=self.photo)
+
+    def close(self):
+        """
+        Wait for the label files that are still being written, stop the background threads and close the window.
+        """
+        if self._scheduled_display is not None:
+            self.master.after_cancel(self._scheduled_display)
+            self._scheduled_display = None
+        for future in self._prefetched.values():
+            future.cancel()
+        self._prefetched.clear()
+        self._loader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self._check_writes()
+        try:
+            self.master.destroy()
+        except tk.TclError:
+            pass
 
     def setup_sliders(self):
         """
-        Set up sliders for adjusting rectangle boundaries.
+        Set up sliders for adjusting rectangle boundaries. The sliders are created once and reused for every image.
         """
         self.slider_top = tk.Scale(self.master, from_=0, to=self.cv_image.shape[0], orient="vertical", width=50, sliderlength=50, showvalue=False)
         self.slider_top.grid(row=1, column=0, sticky="ns")
@@ -116,20 +163,31 @@ class PXL_Dataset_Data_Editor:
         self.slider_right.grid(row=2, column=1, sticky="ew")
         self.slider_right.bind("<Motion>", self.update_active_rectangle)
 
+    def update_sliders(self):
+        """
+        Set the range of the existing sliders to the size of the current image.
+        """
+        height, width = self.cv_image.shape[:2]
+        self.slider_top.config(to=height)
+        self.slider_left.config(to=width)
+        self.slider_bottom.config(to=height)
+        self.slider_right.config(to=width)
+
     def setup_radio_buttons(self):
         """
         Setup radio buttons for selecting active rectangles.
+        Existing radio buttons are reused, only missing ones are created and unused ones are hidden.
         """
-        # Clear existing radio buttons
-        for rb in self.radio_buttons:
-            rb.destroy()
-        self.radio_buttons.clear()
-        # Create new radio buttons
-        for i, rect in enumerate(self.rectangles):
+        for i in range(len(self.radio_buttons), len(self.rectangles)):
             rb = tk.Radiobutton(self.radio_frame, text=str(i + 1), variable=self.active_rectangle_index, value=i,
                                 command=lambda idx=i: self.select_rectangle(idx))
-            rb.pack(side=tk.LEFT, padx=10)
             self.radio_buttons.append(rb)
+        for i, rb in enumerate(self.radio_buttons):
+            if i < len(self.rectangles):
+                if not rb.winfo_ismapped():
+                    rb.pack(side=tk.LEFT, padx=10)
+            else:
+                rb.pack_forget()
 
     def add_rectangle(self):
         """
@@ -169,57 +227,119 @@ class PXL_Dataset_Data_Editor:
     def update_active_rectangle(self, event):
         """
         Update the properties of the active rectangle based on slider positions.
+        The redraw is scheduled, so all slider events within one frame lead to a single redraw.
         """
+        if not self.rectangles:
+            return
         rect = self.rectangles[self.active_rectangle_index.get()]
         rect['top'] = self.slider_top.get()
         rect['left'] = self.slider_left.get()
         rect['bottom'] = self.slider_bottom.get()
         rect['right'] = self.slider_right.get()
-        self.update_display()
+        self.schedule_display()
+
+    def schedule_display(self):
+        """
+        Schedule a redraw of the rectangles after frame_interval milliseconds, unless one is already scheduled.
+        """
+        if self._scheduled_display is None:
+            self._scheduled_display = self.master.after(self.frame_interval, self._scheduled_update_display)
 
     def update_display(self):
         """
-        Update the display with rectangles drawn on the image.
+        Update the display by moving the rectangle items on the canvas. The image itself is not redrawn.
+        Rectangle items are created or deleted only when the number of rectangles changes.
+        """
+        if self._scheduled_display is not None:
+            self.master.after_cancel(self._scheduled_display)
+            self._scheduled_display = None
+        while len(self._rectangle_items) < len(self.rectangles):
+            self._rectangle_items.append(self.canvas.create_rectangle(0, 0, 0, 0, width=2))
+        while len(self._rectangle_items) > len(self.rectangles):
+            self.canvas.delete(self._rectangle_items.pop())
+        active = self.active_rectangle_index.get()
+        for i, (item, rect) in enumerate(zip(self._rectangle_items, self.rectangles)):
+            self.canvas.coords(item, rect['left'], rect['top'], rect['right'], rect['bottom'])
+            self.canvas.itemconfig(item, outline="#808080" if i != active else "#ff0000")
+        if 0 <= active < len(self._rectangle_items):
+            self.canvas.tag_raise(self._rectangle_items[active])
+
+    def _scheduled_update_display(self):
+        """
+        Private method that runs a scheduled redraw.
         """
-        image_copy = self.cv_image.copy()
-        for i, rect in enumerate(self.rectangles):
-            color = (128, 128, 128) if i != self.active_rectangle_index.get() else (255, 0, 0)
-            cv2.rectangle(image_copy, (rect['left'], rect['top']), (rect['right'], rect['bottom']), color, 2)
-        self.photo = ImageTk.PhotoImage(image=Image.fromarray(image_copy))
-        self.image_label.config(image=self.photo)
-        self.image_label.image = self.photo  # prevent garbage-collection
+        self._scheduled_display = None
+        self.update_display()
 
-    def load_objects_as_rectangle(self, objects):
+    def get_boxes(self, position):
+        """
+        Get the boxes of the image at a position in the dataframe as an (n, 4) array of cx, cy, w, h.
         """
-        Load objects from a data structure into rectangles for editing.
+        if self.box_table is not None:
+            return self.box_table.boxes(self.df.index[position])
+        return PXL_dataset_box_table.from_objects([self.df.iloc[position]["objects"]]).boxes(0)
+
+    def load_objects_as_rectangle(self, boxes):
+        """
+        Load boxes from an (n, 4) array of cx, cy, w, h into rectangles for editing.
         """
-        rectangles = []
         image_height, image_width = self.cv_image.shape[:2]
-        for obj in objects:
-            values = []
-            for i in range(1, len(obj["centerNSize"]), 2):
-                values.append(float(obj["centerNSize"][i-1]) * image_width)
-                values.append(float(obj["centerNSize"][i]) * image_height)
-            t = int(values[1]-(values[3]/2))
-            r = int(values[0]+(values[2]/2))
-            l = int(values[0]-(values[2]/2))
-            b = int(values[1]+(values[3]/2))
-            rectangle = {"top": t, "left": l, "bottom": b, "right": r}
-            rectangles.append(rectangle)
-        self.rectangles = rectangles
+        boxes = boxes * np.array([image_width, image_height, image_width, image_height], dtype=np.float32)
+        t = (boxes[:, 1] - boxes[:, 3] / 2).astype(int).tolist()
+        r = (boxes[:, 0] + boxes[:, 2] / 2).astype(int).tolist()
+        l = (boxes[:, 0] - boxes[:, 2] / 2).astype(int).tolist()
+        b = (boxes[:, 1] + boxes[:, 3] / 2).astype(int).tolist()
+        self.rectangles = [{"top": t[i], "left": l[i], "bottom": b[i], "right": r[i]} for i in range(len(boxes))]
+
+    def format_yolo_bounding_boxes(self):
+        """
+        Return the bounding box data in YOLO format as the text of a label file.
+        """
+        image_height, image_width = self.cv_image.shape[:2]
+        lines = []
+        for rectangle in self.rectangles:
+            center_x = float(int((rectangle['right']-rectangle['left'])/2.0) + rectangle['left'])/image_width
+            center_y = float(int((rectangle['bottom']-rectangle['top'])/2.0) + rectangle['top'])/image_height
+            size_x = float(rectangle['right'] - rectangle['left'])/image_width
+            size_y = float(rectangle['bottom'] - rectangle['top'])/image_height
+            lines.append("0 {} {} {} {}\n".format(center_x, center_y, size_x, size_y))
+        return "".join(lines)
 
     def write_yolo_bounding_boxes_file(self, filename:str):
         """
         Write the bounding box data in YOLO format to a file.
         """
-        with open(filename, 'w') as file:
-            for rectangle in self.rectangles:
-                image_height, image_width = self.cv_image.shape[:2]
-                center_x = float(int((rectangle['right']-rectangle['left'])/2.0) + rectangle['left'])/image_width
-                center_y = float(int((rectangle['bottom']-rectangle['top'])/2.0) + rectangle['top'])/image_height
-                size_x = float(rectangle['right'] - rectangle['left'])/image_width
-                size_y = float(rectangle['bottom'] - rectangle['top'])/image_height
-                line = "0 {} {} {} {}\n".format(center_x, center_y, size_x, size_y)
-                file.write(line)
+        write_file_atomic(filename, self.format_yolo_bounding_boxes())
+
+    def _prefetch_images(self):
+        """
+        Private method that starts decoding the next prefetch images on the background thread.
+        """
+        last = min(len(self.df) - 1, self.current_image_index + self.prefetch)
+        for position in range(self.current_image_index + 1, last + 1):
+            if position not in self._prefetched:
+                self._prefetched[position] = self._loader.submit(_load_scaled_image, self.df.iloc[position]["image"], self.display_height)
+
+    def _check_writes(self):
+        """
+        Private method that drops the finished label writes and prints the ones that failed.
+        """
+        pending = []
+        for future in self._pending_writes:
+            if not future.done():
+                pending.append(future)
+            elif future.exception() is not None:
+                print("Label file could not be written: {}".format(future.exception()))
+        self._pending_writes = pending
 
 
+def _load_scaled_image(path:str, height:int):
+    """
+    Private function that loads an image scaled to the given height. Runs on the main or on the prefetch thread.
+    """
+    metadata = PXL_dataset_image_probe().probe(path)
+    if metadata['height'] == 0:
+        raise FileNotFoundError("Image file not found.")
+    scale_ratio = height / metadata['height']
+    new_width = int(metadata['width'] * scale_ratio)
+    return PXL_dataset_image_cache.shared().get(path, (new_width, height))
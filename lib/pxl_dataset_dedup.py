@@ -0,0 +1,314 @@
+import concurrent.futures
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_manifest import _decode_strings, _encode_strings
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import file_stat_key, read_file_bytes
+from .pxl_dataset_split import PXL_dataset_split
+
+
+class PXL_dataset_dedup(object):
+    """
+    Finds exact and near duplicate images within and across the splits of a dataset.
+    Every image gets a BLAKE2 hash of its bytes and a 64 bit DCT perceptual hash of its pixels, computed on a thread pool.
+    The hashes are kept in a cache that is shared by all instances and keyed by path, file size and mtime,
+    and can also be stored in a cache file so later runs only hash new or changed images.
+    Near duplicates are found by comparing the packed hashes in blocks with vectorised XOR and popcount.
+    """
+    HASH_BYTES = 8
+    _cache: dict = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, max_distance: int = 4, cache_path: str = None, max_workers: int = None, chunk_size: int = 256, block_bytes: int = 2**26):
+        """
+        Initialize the engine. Pairs whose perceptual hashes differ in at most max_distance of the 64 bits are near duplicates.
+        """
+        self.max_distance = max_distance
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.block_bytes = block_bytes
+        if cache_path is not None and os.path.exists(cache_path):
+            self._load_cache()
+
+    def hash_images(self, paths):
+        """
+        Return the content hashes, as a list of hex strings, and the perceptual hashes, as an (n, 8) uint8 array of packed bits.
+        Unreadable images get the content hash None and are never reported as duplicates.
+        """
+        content_hashes = []
+        perceptual_hashes = np.zeros((len(paths), self.HASH_BYTES), dtype=np.uint8)
+        position = 0
+        for chunk_hashes in map_chunks(self._hash_chunk, chunked(paths, self.chunk_size), concurrent.futures.ThreadPoolExecutor, self.max_workers):
+            for content, perceptual in chunk_hashes:
+                content_hashes.append(content)
+                perceptual_hashes[position] = perceptual
+                position += 1
+        if self.cache_path is not None:
+            self._save_cache()
+        return content_hashes, perceptual_hashes
+
+    def find(self, df_map: map):
+        """
+        Hash every image of every split of a df_map and return a PXL_dataset_dedup_report with every duplicate pair.
+        """
+        keys = list(df_map.keys())
+        paths = [path for key in keys for path in df_map[key]['image'].tolist()]
+        splits = np.repeat(np.arange(len(keys)), [len(df_map[key]) for key in keys])
+        positions = np.concatenate([np.arange(len(df_map[key])) for key in keys]) if keys else np.zeros(0, dtype=np.int64)
+        content_hashes, perceptual_hashes = self.hash_images(paths)
+        valid = np.array([content is not None for content in content_hashes], dtype=bool)
+        first, second, distances = self.search(perceptual_hashes, valid)
+        exact = np.array([content_hashes[a] == content_hashes[b] for a, b in zip(first.tolist(), second.tolist())], dtype=bool)
+        names = np.array(keys, dtype=object)
+        image_paths = np.array(paths, dtype=object)
+        pairs = pd.DataFrame({
+            'split_a': names[splits[first]],
+            'index_a': positions[first],
+            'image_a': image_paths[first],
+            'split_b': names[splits[second]],
+            'index_b': positions[second],
+            'image_b': image_paths[second],
+            'distance': distances,
+            'exact': exact
+        })
+        return PXL_dataset_dedup_report(pairs, {key: len(df_map[key]) for key in keys})
+
+    def search(self, perceptual_hashes, valid=None):
+        """
+        Return the first and second positions and Hamming distances of every pair of hashes within max_distance, with first < second.
+        The hashes are compared in blocks of rows against all later rows, on a thread pool, as NumPy releases the GIL.
+        """
+        codes = np.ascontiguousarray(perceptual_hashes, dtype=np.uint8).view('>u8').ravel().astype(np.uint64)
+        if valid is None:
+            valid = np.ones(len(codes), dtype=bool)
+        indices = np.flatnonzero(valid)
+        codes = codes[indices]
+        block_rows = max(1, self.block_bytes // max(1, 8 * len(codes)))
+        compare = lambda start: _search_block(codes, start, block_rows, self.max_distance)
+        first, second, distances = [], [], []
+        for block_first, block_second, block_distances in map_chunks(compare, range(0, len(codes), block_rows), concurrent.futures.ThreadPoolExecutor, self.max_workers):
+            first.append(block_first)
+            second.append(block_second)
+            distances.append(block_distances)
+        if not first:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+        return indices[np.concatenate(first)], indices[np.concatenate(second)], np.concatenate(distances)
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Remove all hashes from the shared cache.
+        """
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    def _hash_chunk(self, paths):
+        """
+        Private method that hashes a chunk of images on one worker thread, using the cache.
+        """
+        results = []
+        for path in paths:
+            try:
+                stat_key = file_stat_key(path)
+            except OSError:
+                results.append((None, np.zeros(self.HASH_BYTES, dtype=np.uint8)))
+                continue
+            with self._cache_lock:
+                cached = self._cache.get(path)
+            if cached is not None and cached[0] == stat_key:
+                results.append(cached[1:])
+                continue
+            content, perceptual = _hash_image(path)
+            if content is not None:
+                with self._cache_lock:
+                    self._cache[path] = (stat_key, content, perceptual)
+            results.append((content, perceptual))
+        return results
+
+    def _load_cache(self):
+        """
+        Private method that adds the hashes of a cache file to the shared cache.
+        """
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                paths = _decode_strings(data['path'])
+                contents = _decode_strings(data['content'])
+                stat_keys = data['stat_key']
+                perceptual_hashes = data['perceptual']
+        except (OSError, ValueError, KeyError):
+            return
+        with self._cache_lock:
+            for path, stat_key, content, perceptual in zip(paths, stat_keys.tolist(), contents, perceptual_hashes):
+                self._cache.setdefault(path, (tuple(stat_key[1:]) if stat_key[0] < 0 else tuple(stat_key), content, perceptual))
+
+    def _save_cache(self):
+        """
+        Private method that writes the shared cache atomically to the cache file.
+        Stat keys of plain files are stored as (-1, size, mtime), stat keys of packed files as (offset, length, mtime).
+        """
+        with self._cache_lock:
+            items = list(self._cache.items())
+        stat_keys = np.array([(-1,) + stat_key if len(stat_key) == 2 else stat_key for _, (stat_key, _, _) in items], dtype=np.int64).reshape(-1, 3)
+        temporary_path = self.cache_path + ".tmp"
+        try:
+            with open(temporary_path, 'wb') as file:
+                np.savez(file,
+                         path=_encode_strings([path for path, _ in items]),
+                         content=_encode_strings([content for _, (_, content, _) in items]),
+                         stat_key=stat_keys,
+                         perceptual=np.array([perceptual for _, (_, _, perceptual) in items], dtype=np.uint8).reshape(-1, self.HASH_BYTES))
+            os.replace(temporary_path, self.cache_path)
+        except OSError:
+            pass
+
+
+class PXL_dataset_dedup_report(object):
+    """
+    Result of a duplicate search: one row per duplicate pair with the split, position and image of both images,
+    the Hamming distance of their perceptual hashes and whether their bytes are identical.
+    Pairs across two splits are leakage, as the same image is then used for training and for evaluation.
+    """
+    def __init__(self, pairs, split_sizes: map):
+        """
+        Initialize the report with the pairs dataframe and the number of images of every split.
+        """
+        self.pairs = pairs
+        self.split_sizes = split_sizes
+
+    @property
+    def exact(self):
+        """
+        The pairs with identical bytes.
+        """
+        return self.pairs[self.pairs['exact']]
+
+    @property
+    def near(self):
+        """
+        The pairs with different bytes and similar pixels.
+        """
+        return self.pairs[~self.pairs['exact']]
+
+    @property
+    def leakage(self):
+        """
+        The pairs whose images are in different splits.
+        """
+        return self.pairs[self.pairs['split_a'] != self.pairs['split_b']]
+
+    def summary(self):
+        """
+        Return a dataframe with the number of exact and near duplicate pairs for every combination of splits.
+        """
+        kind = np.where(self.pairs['exact'], 'exact', 'near')
+        return self.pairs.assign(kind=kind).groupby(['split_a', 'split_b', 'kind']).size().unstack(fill_value=0)
+
+    def duplicates_to_remove(self, keep_order=(PXL_dataset_split.Test, PXL_dataset_split.Validation, PXL_dataset_split.Train)):
+        """
+        Return a map with the positions to remove from every split so that one image of every group of duplicates is left.
+        The kept image is in the first split of keep_order, by default the evaluation copy so leaking images leave the train split,
+        and has the lowest position within that split.
+        """
+        keys = list(self.split_sizes.keys())
+        offsets = dict(zip(keys, np.cumsum([0] + [self.split_sizes[key] for key in keys[:-1]]).tolist()))
+        rank = {key: _split_rank(key, keep_order) for key in keys}
+        parent = {}
+        def find(node):
+            root = node
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while node != root:
+                parent[node], node = root, parent[node]
+            return root
+        for split_a, index_a, split_b, index_b in zip(self.pairs['split_a'], self.pairs['index_a'], self.pairs['split_b'], self.pairs['index_b']):
+            node_a = (rank[split_a], offsets[split_a] + int(index_a), split_a, int(index_a))
+            node_b = (rank[split_b], offsets[split_b] + int(index_b), split_b, int(index_b))
+            root_a, root_b = find(node_a), find(node_b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        remove = {key: [] for key in keys}
+        for node in list(parent.keys()):
+            if find(node) != node:
+                remove[node[2]].append(node[3])
+        return {key: np.unique(np.array(positions, dtype=np.int64)) for key, positions in remove.items()}
+
+    def print(self):
+        """
+        Print the number of duplicate pairs and the leakage between the splits.
+        """
+        print("DUPLICATES:")
+        print("\tExact pairs:\t{}".format(int(self.pairs['exact'].sum())))
+        print("\tNear pairs:\t{}".format(int((~self.pairs['exact']).sum())))
+        print("\tLeaking pairs:\t{}".format(len(self.leakage)))
+        if len(self.pairs):
+            print(self.summary())
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __repr__(self):
+        return "PXL_dataset_dedup_report(pairs={}, exact={}, leakage={})".format(len(self.pairs), int(self.pairs['exact'].sum()), len(self.leakage))
+
+
+def perceptual_hash(image):
+    """
+    Return the 64 bit DCT hash of a grayscale image as 8 packed bytes: the image is reduced to 32x32,
+    and every bit tells whether one of the 8x8 lowest frequencies is above their median.
+    """
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    frequencies = cv2.dct(small)[:8, :8].ravel()
+    return np.packbits(frequencies > np.median(frequencies[1:]))
+
+
+POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _popcount(values):
+    """
+    Private function that counts the set bits of every uint64 value.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def _search_block(codes, start: int, block_rows: int, max_distance: int):
+    """
+    Private function that compares a block of hashes with all later hashes and returns the pairs within max_distance.
+    """
+    block = codes[start:start + block_rows]
+    distances = _popcount(block[:, None] ^ codes[None, start:])
+    upper = np.arange(len(block))[:, None] < np.arange(len(codes) - start)[None, :]
+    rows, columns = np.nonzero((distances <= max_distance) & upper)
+    return rows + start, columns + start, distances[rows, columns].astype(np.int8)
+
+
+def _hash_image(path: str):
+    """
+    Private function that returns the content hash and the perceptual hash of one image, or None and zeros when it can not be read.
+    """
+    try:
+        data = read_file_bytes(path)
+    except OSError:
+        return None, np.zeros(PXL_dataset_dedup.HASH_BYTES, dtype=np.uint8)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if image is None:
+        return None, np.zeros(PXL_dataset_dedup.HASH_BYTES, dtype=np.uint8)
+    return hashlib.blake2b(data, digest_size=16).hexdigest(), perceptual_hash(image)
+
+
+def _split_rank(key: str, keep_order):
+    """
+    Private function that returns the position of the split of a df_map key in keep_order, matched by the split prefix.
+    """
+    for rank, split in enumerate(keep_order):
+        if key.lower().startswith(split.value):
+            return rank
+    return len(keep_order)
@@ -0,0 +1,410 @@
+import concurrent.futures
+import functools
+import json
+import os
+import time
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_image_probe import read_image_metadata, sniff_image_format
+from .pxl_dataset_parallel import chunked, default_worker_count, map_chunks
+from .pxl_dataset_shard_reader import read_file_bytes
+from .pxl_dataset_writer import PXL_dataset_write_report, format_yolo_lines, link_file, write_file_atomic
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_export_sink(object):
+    """
+    Baseclass of an output format of a PXL_dataset_export. The export reads every image once and hands each sample
+    to all sinks, so a sink only writes its own annotation files:
+        image_directory   folder of a split where the export writes the images for this sink, None for no images
+        open_split        called before the samples of a split
+        write_sample      called on a worker thread for every sample, returns the number of bytes written
+        close_split       called on a worker thread after the last sample of a split, with a dataframe of all samples
+        close             called once after all splits
+    A sample is a dict with the split, position, image (the source path), file_name, width, height, channels, format
+    and labels, an (n, 5) array of class, cx, cy, w, h.
+    """
+    def __init__(self, save_directory: str):
+        """
+        Initialize the sink with the directory it writes to.
+        """
+        self.save_directory = save_directory
+
+    def image_directory(self, key: str):
+        """
+        Return the folder for the images of a split, or None when this sink does not need the images.
+        """
+        return None
+
+    def open_split(self, key: str):
+        """
+        Create the folders of a split.
+        """
+        directory = self.image_directory(key)
+        os.makedirs(directory or self.save_directory, exist_ok=True)
+
+    def write_sample(self, sample: dict):
+        """
+        Write the files of one sample and return the number of bytes written.
+        """
+        return 0
+
+    def close_split(self, key: str, samples, box_table: PXL_dataset_box_table):
+        """
+        Write the files of a whole split.
+        """
+        pass
+
+    def close(self):
+        """
+        Write the files of the whole export.
+        """
+        pass
+
+
+class PXL_dataset_yolo_sink(PXL_dataset_export_sink):
+    """
+    Writes the Ultralytics YOLO layout: {split}/images/, {split}/labels/ with a .txt file per image and a data.yaml.
+    """
+    YAML_KEYS = {"train": "train", "validation": "val", "test": "test"}
+
+    def __init__(self, save_directory: str):
+        """
+        Initialize the sink with the directory it writes to.
+        """
+        super().__init__(save_directory)
+        self._num_classes = {}
+
+    def image_directory(self, key: str):
+        return "{}{}/images/".format(self.save_directory, key)
+
+    def open_split(self, key: str):
+        super().open_split(key)
+        os.makedirs("{}{}/labels/".format(self.save_directory, key), exist_ok=True)
+
+    def write_sample(self, sample: dict):
+        text = format_yolo_lines(sample['labels'])
+        write_file_atomic("{}{}/labels/{}.txt".format(self.save_directory, sample['split'], os.path.splitext(sample['file_name'])[0]), text)
+        return len(text)
+
+    def close_split(self, key: str, samples, box_table: PXL_dataset_box_table):
+        self._num_classes[key] = int(box_table.class_id.max()) + 1 if len(box_table) else 0
+
+    def close(self):
+        num_classes = max(self._num_classes.values() or [0])
+        lines = ["path: ."]
+        lines += ["{}: {}/images".format(self.YAML_KEYS.get(key, key), key) for key in self._num_classes.keys()]
+        lines += ["nc: {}".format(num_classes), "names: [{}]".format(", ".join("'{}'".format(class_id) for class_id in range(num_classes)))]
+        write_file_atomic(self.save_directory + "data.yaml", "\n".join(lines) + "\n")
+
+
+class PXL_dataset_coco_sink(PXL_dataset_export_sink):
+    """
+    Writes the COCO layout: the images of a split in {split}/ with one dataset.json per split.
+    With compact the JSON is written without any whitespace.
+    """
+    def __init__(self, save_directory: str, compact: bool = False):
+        """
+        Initialize the sink with the directory it writes to and the JSON style.
+        """
+        super().__init__(save_directory)
+        self.compact = compact
+
+    def image_directory(self, key: str):
+        return "{}{}/".format(self.save_directory, key)
+
+    def close_split(self, key: str, samples, box_table: PXL_dataset_box_table):
+        sizes = samples[['width', 'height']].to_numpy(dtype=np.int32)
+        write_coco_json("{}{}/dataset.json".format(self.save_directory, key), samples.index.to_numpy(), samples['file_name'].tolist(), sizes, box_table, self.compact)
+
+
+class PXL_dataset_voc_sink(PXL_dataset_export_sink):
+    """
+    Writes the Pascal VOC layout: {split}/JPEGImages/ and {split}/Annotations/ with an XML file per image,
+    with the boxes in pixels.
+    """
+    def image_directory(self, key: str):
+        return "{}{}/JPEGImages/".format(self.save_directory, key)
+
+    def open_split(self, key: str):
+        super().open_split(key)
+        os.makedirs("{}{}/Annotations/".format(self.save_directory, key), exist_ok=True)
+
+    def write_sample(self, sample: dict):
+        text = format_voc_xml(sample['file_name'], sample['width'], sample['height'], sample['channels'], sample['labels'])
+        write_file_atomic("{}{}/Annotations/{}.xml".format(self.save_directory, sample['split'], os.path.splitext(sample['file_name'])[0]), text)
+        return len(text)
+
+
+class PXL_dataset_manifest_sink(PXL_dataset_export_sink):
+    """
+    Writes one flat table with a row per image of every split: the split, the exported file name, the source image,
+    the width, height, channels and format, and the number of objects. file_format is 'csv' or 'parquet',
+    parquet needs pyarrow or fastparquet.
+    """
+    FILE_FORMATS = ('csv', 'parquet')
+
+    def __init__(self, save_directory: str, file_format: str = 'csv'):
+        """
+        Initialize the sink with the directory it writes to and the file format of the table.
+        """
+        if file_format not in self.FILE_FORMATS:
+            raise PXL_value_exception("Unknown manifest format '{}'. The options are {}".format(file_format, list(self.FILE_FORMATS)))
+        super().__init__(save_directory)
+        self.file_format = file_format
+        self._frames = {}
+
+    def close_split(self, key: str, samples, box_table: PXL_dataset_box_table):
+        frame = samples.assign(num_objects=box_table.counts())
+        frame.insert(0, 'split', key)
+        self._frames[key] = frame
+
+    def close(self):
+        columns = ['split', 'file_name', 'image', 'width', 'height', 'channels', 'format', 'num_objects']
+        df = pd.concat(self._frames.values(), ignore_index=True)[columns] if self._frames else pd.DataFrame(columns=columns)
+        filepath = "{}manifest.{}".format(self.save_directory, self.file_format)
+        if self.file_format == 'csv':
+            df.to_csv(filepath, index=False)
+        else:
+            df.to_parquet(filepath, index=False)
+
+
+class PXL_dataset_export(object):
+    """
+    Single pass export of an object detection dataset to several formats at once. Every image is read once, its size
+    is taken from the bytes in memory, and the sample is handed to every sink. The image itself is written once and
+    hard linked into the image folders of the other sinks, or written again when linking is not possible.
+    The chunks of samples and the split files of the sinks run on one shared thread pool, with at most max_in_flight
+    chunks queued, so at most that many chunks of images are held in memory. The file name, size and format of every
+    image of the current split are kept for the split files, about a hundred bytes per image.
+    Images that cannot be read or written are reported and left out of every sink, with their boxes.
+    With a PXL_dataset_codec the images are first read and transcoded on a process pool, images that are already in its
+    format are passed through, and the exported file names get the extension of the codec.
+    """
+    SINKS = {
+        'yolo': lambda directory, compact: PXL_dataset_yolo_sink(directory),
+        'coco': lambda directory, compact: PXL_dataset_coco_sink(directory, compact),
+        'voc': lambda directory, compact: PXL_dataset_voc_sink(directory),
+        'csv': lambda directory, compact: PXL_dataset_manifest_sink(directory, 'csv'),
+        'parquet': lambda directory, compact: PXL_dataset_manifest_sink(directory, 'parquet')
+    }
+
+    def __init__(self, sinks, max_workers: int = None, chunk_size: int = 64, max_in_flight: int = None, codec: PXL_dataset_codec = None):
+        """
+        Initialize the export with its sinks, the number of workers, the number of samples per task, the maximum of tasks
+        in flight and the codec of the exported images, None to export the images as they are.
+        """
+        self.sinks = list(sinks)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.codec = codec
+
+    @classmethod
+    def from_formats(cls, save_directory: str, formats, compact: bool = False, max_workers: int = None, codec: PXL_dataset_codec = None):
+        """
+        Create an export with a sink per format, each in a subfolder of save_directory named after the format.
+        A format is one of the names in SINKS or a PXL_dataset_export_sink, which is used as it is.
+        """
+        sinks = []
+        for export_format in formats:
+            if isinstance(export_format, PXL_dataset_export_sink):
+                sinks.append(export_format)
+            elif export_format in cls.SINKS:
+                sinks.append(cls.SINKS[export_format]("{}{}/".format(save_directory, export_format), compact))
+            else:
+                raise PXL_value_exception("Unknown export format '{}'. The options are {}".format(export_format, list(cls.SINKS.keys())))
+        return cls(sinks, max_workers, codec=codec)
+
+    def run(self, df_map: map, box_tables: map):
+        """
+        Export every split of the df_map with its box table and return a PXL_dataset_write_report,
+        with a written file per image and the bytes of the images and all annotation files.
+        """
+        start = time.perf_counter()
+        report = PXL_dataset_write_report()
+        process_executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers or default_worker_count()) if self.codec is not None else None
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers or default_worker_count()) as executor:
+                split_futures = []
+                for key, df in df_map.items():
+                    box_table = box_tables[key]
+                    image_directories = []
+                    for sink in self.sinks:
+                        sink.open_split(key)
+                        directory = sink.image_directory(key)
+                        if directory is not None and directory not in image_directories:
+                            image_directories.append(directory)
+                    chunks = chunked(((position, path, None) for position, path in enumerate(df['image'].tolist())), self.chunk_size)
+                    if self.codec is not None:
+                        chunks = map_chunks(functools.partial(_transcode_chunk, codec=self.codec), chunks, concurrent.futures.ProcessPoolExecutor,
+                                            self.max_workers, self.max_in_flight, process_executor)
+                    export = lambda chunk, key=key, box_table=box_table, image_directories=image_directories: self._export_chunk(key, chunk, box_table, image_directories)
+                    samples = []
+                    for chunk_report, chunk_samples in map_chunks(export, chunks, concurrent.futures.ThreadPoolExecutor,
+                                                                  self.max_workers, self.max_in_flight, executor):
+                        report.add(chunk_report)
+                        samples.extend(chunk_samples)
+                    samples = pd.DataFrame(samples, columns=['position', 'file_name', 'image', 'width', 'height', 'channels', 'format'])
+                    positions = samples.pop('position').to_numpy(dtype=np.int64)
+                    samples.index = df.index[positions]
+                    if len(positions) < len(df):
+                        box_table = box_table.select(positions)
+                    for sink in self.sinks:
+                        split_futures.append(executor.submit(sink.close_split, key, samples, box_table))
+                for future in split_futures:
+                    future.result()
+        finally:
+            if process_executor is not None:
+                process_executor.shutdown()
+        for sink in self.sinks:
+            sink.close()
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _export_chunk(self, key: str, chunk, box_table: PXL_dataset_box_table, image_directories):
+        """
+        Private method that reads a chunk of images once, writes them to the image folders and hands the samples to the sinks.
+        A chunk is a list of (position, path, data) rows, where data is None for images that are not read yet, or a tuple
+        of the rows and the report of the transcode stage. Returns the report of the chunk and a
+        (position, file_name, image, width, height, channels, format) tuple per exported sample, failed images are left out.
+        """
+        report = PXL_dataset_write_report()
+        if isinstance(chunk, tuple):
+            chunk, transcode_report = chunk
+            report.add(transcode_report)
+        samples = []
+        for position, path, data in chunk:
+            file_name = path.split("/")[-1] if self.codec is None else self.codec.target_path(path.split("/")[-1])
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                if data is None:
+                    data = read_file_bytes(path)
+                metadata = read_image_metadata(data)
+                report.bytes_written += _write_image(data, [directory + file_name for directory in image_directories])
+                sample = dict(metadata, split=key, position=position, image=path, file_name=file_name, labels=box_table.label_array(position))
+                for sink in self.sinks:
+                    report.bytes_written += sink.write_sample(sample)
+                report.written += 1
+            except Exception as error:
+                report.failures.append((path, "{}: {}".format(type(error).__name__, error)))
+                continue
+            samples.append((position, file_name, path, metadata['width'], metadata['height'], metadata['channels'], metadata['format']))
+        return report, samples
+
+
+def _transcode_chunk(rows, codec: PXL_dataset_codec):
+    """
+    Private function that reads a chunk of images and encodes those that are not in the format of the codec yet, on a worker process.
+    Returns the (position, path, data) rows, with the exception as data for images that failed, and the report of the transcodes.
+    """
+    report = PXL_dataset_write_report()
+    transcoded_rows = []
+    for position, path, _ in rows:
+        try:
+            data = bytes(read_file_bytes(path))
+            if codec.matches(sniff_image_format(data)):
+                report.passed_through += 1
+            else:
+                start = time.perf_counter()
+                encoded = codec.encode(data)
+                report.transcoded += 1
+                report.bytes_saved += len(data) - len(encoded)
+                report.transcode_seconds += time.perf_counter() - start
+                data = encoded
+        except Exception as error:
+            data = error
+        transcoded_rows.append((position, path, data))
+    return transcoded_rows, report
+
+
+def format_voc_xml(file_name: str, width: int, height: int, channels: int, label_array):
+    """
+    Format the Pascal VOC annotation of one image from an (n, 5) array of class, cx, cy, w, h relative to the image.
+    """
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    boxes = label_array[:, 1:].astype(np.float64) * scale
+    corners = np.concatenate((boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2), axis=1)
+    corners = np.clip(np.rint(corners), 0, scale).astype(int).tolist()
+    objects = "".join(
+        "\t<object>\n\t\t<name>{:d}</name>\n\t\t<pose>Unspecified</pose>\n\t\t<truncated>0</truncated>\n\t\t<difficult>0</difficult>\n"
+        "\t\t<bndbox>\n\t\t\t<xmin>{}</xmin>\n\t\t\t<ymin>{}</ymin>\n\t\t\t<xmax>{}</xmax>\n\t\t\t<ymax>{}</ymax>\n\t\t</bndbox>\n\t</object>\n".format(
+            int(class_id), *box) for class_id, box in zip(label_array[:, 0].tolist(), corners))
+    return ("<annotation>\n\t<folder>JPEGImages</folder>\n\t<filename>{}</filename>\n"
+            "\t<size>\n\t\t<width>{}</width>\n\t\t<height>{}</height>\n\t\t<depth>{}</depth>\n\t</size>\n"
+            "\t<segmented>0</segmented>\n{}</annotation>\n").format(escape(file_name), width, height, channels, objects)
+
+
+def write_coco_json(filepath: str, image_ids, filenames, sizes, box_table: PXL_dataset_box_table, compact: bool = False):
+    """
+    Stream the images, annotations and categories of one split to a COCO JSON file.
+    The annotations are computed for the whole split at once from the box table and the (n, 2) width and height array.
+    """
+    separators = (',', ':') if compact else (', ', ': ')
+    newline = "" if compact else "\n"
+    box_image_ids = box_table.image_ids()
+    scale = np.concatenate((sizes, sizes), axis=1).astype(np.float64)[box_image_ids]
+    boxes = box_table.box_array().astype(np.float64) * scale
+    x_min = (boxes[:, 0] - boxes[:, 2] / 2).astype(int).tolist()
+    y_min = (boxes[:, 1] - boxes[:, 3] / 2).astype(int).tolist()
+    w = boxes[:, 2].tolist()
+    h = boxes[:, 3].tolist()
+    class_ids = box_table.class_id.tolist()
+    annotation_image_ids = image_ids[box_image_ids].tolist()
+    category_ids = np.unique(box_table.class_id).tolist() or [0]
+    categories = [{"id": category_id, "name": category_id} for category_id in category_ids]
+    widths = sizes[:, 0].tolist()
+    heights = sizes[:, 1].tolist()
+    image_ids = image_ids.tolist()
+
+    with open(filepath, 'w') as json_file:
+        json_file.write('{' + newline + '"images":[' + newline)
+        _write_json_items(json_file, ({
+            "id": image_ids[i],
+            "width": widths[i],
+            "height": heights[i],
+            "file_name": filenames[i]
+        } for i in range(len(image_ids))), separators, newline)
+        json_file.write('],' + newline + '"annotations":[' + newline)
+        _write_json_items(json_file, ({
+            "id": i,
+            "image_id": annotation_image_ids[i],
+            "category_id": class_ids[i],
+            "bbox": [x_min[i], y_min[i], w[i], h[i]],
+            "area": w[i] * h[i],
+            "iscrowd": 0,
+            "segmentation": []
+        } for i in range(len(class_ids))), separators, newline)
+        json_file.write('],' + newline + '"categories":' + json.dumps(categories, separators=separators) + newline + '}' + newline)
+
+
+def _write_json_items(json_file, items, separators, newline: str, chunk_size: int = 10000):
+    """
+    Private function to write the items of a JSON list in chunks, so the whole list is never held as one string.
+    """
+    first = True
+    for chunk in chunked(items, chunk_size):
+        text = ("," + newline).join(json.dumps(item, separators=separators) for item in chunk)
+        json_file.write(text if first else "," + newline + text)
+        first = False
+    json_file.write(newline)
+
+
+def _write_image(data: bytes, targets):
+    """
+    Private function that writes the image bytes atomically to the first target and hard links the other targets to it,
+    copying it when a link fails. Returns the number of bytes written.
+    """
+    if not targets:
+        return 0
+    write_file_atomic(targets[0], data)
+    bytes_written = len(data)
+    for target in targets[1:]:
+        bytes_written += link_file(targets[0], target)
+    return bytes_written
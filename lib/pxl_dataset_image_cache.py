@@ -0,0 +1,141 @@
+import collections
+import threading
+
+import cv2
+
+from .pxl_dataset_shard_reader import file_stat_key, imread
+
+
+class PXL_dataset_image_cache(object):
+    """
+    Cache of decoded images, keyed by path, requested size and color mode, with least recently used eviction
+    against a budget in bytes. An entry is only used while the mtime of its file is unchanged.
+    The returned arrays are read only, so one decoded image can be shared; copy them before drawing on them.
+    The library uses one shared cache, returned by PXL_dataset_image_cache.shared().
+    """
+    DEFAULT_MAX_BYTES = 512 * 2**20
+    MODES = {"rgb": cv2.IMREAD_COLOR, "bgr": cv2.IMREAD_COLOR, "gray": cv2.IMREAD_GRAYSCALE}
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize an empty cache with a budget of max_bytes for the decoded pixels.
+        """
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the cache that is shared by the whole library.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def get(self, path: str, size: tuple = None, mode: str = "rgb"):
+        """
+        Return the image at path decoded in the given mode ('rgb', 'bgr' or 'gray') and resized to size (width, height) when given.
+        Raises a FileNotFoundError when the image can not be read.
+        """
+        if mode not in self.MODES:
+            raise ValueError("Unknown mode '{}'. The options are {}".format(mode, list(self.MODES)))
+        try:
+            stat_key = file_stat_key(path)
+        except OSError:
+            raise FileNotFoundError("Image {} could not be read.".format(path))
+        key = (path, tuple(size) if size is not None else None, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stat_key:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        image = self._decode(path, size, mode)
+        image.flags.writeable = False
+        with self._lock:
+            self._discard(key)
+            if image.nbytes <= self.max_bytes:
+                self._entries[key] = (stat_key, image)
+                self.bytes += image.nbytes
+                self._evict(self.max_bytes)
+        return image
+
+    def set_max_bytes(self, max_bytes: int):
+        """
+        Change the budget of the cache, evicting the least recently used images when it shrinks.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict(max_bytes)
+
+    def clear(self):
+        """
+        Remove all images from the cache and reset the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        Return a dict with the hits, misses, evictions, hit rate, number of images and bytes in the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "images": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def __repr__(self):
+        stats = self.stats()
+        return "PXL_dataset_image_cache(images={}, bytes={}, max_bytes={}, hits={}, misses={})".format(
+            stats["images"], stats["bytes"], stats["max_bytes"], stats["hits"], stats["misses"])
+
+    def _decode(self, path: str, size: tuple, mode: str):
+        """
+        Private method that decodes and resizes one image.
+        """
+        image = imread(path, self.MODES[mode])
+        if image is None:
+            raise FileNotFoundError("Image {} could not be read.".format(path))
+        if mode == "rgb":
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if size is not None and (image.shape[1], image.shape[0]) != tuple(size):
+            interpolation = cv2.INTER_AREA if size[0] < image.shape[1] else cv2.INTER_LINEAR
+            image = cv2.resize(image, tuple(size), interpolation=interpolation)
+        return image
+
+    def _discard(self, key):
+        """
+        Private method that removes one entry, if present. The lock must be held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1].nbytes
+
+    def _evict(self, max_bytes: int):
+        """
+        Private method that removes the least recently used images until the cache fits in max_bytes. The lock must be held.
+        """
+        while self.bytes > max_bytes and self._entries:
+            _, (_, image) = self._entries.popitem(last=False)
+            self.bytes -= image.nbytes
+            self.evictions += 1
@@ -0,0 +1,228 @@
+import collections
+import concurrent.futures
+import io
+import struct
+import threading
+
+import numpy as np
+from PIL import Image
+
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import file_stat_key, is_shard_path, read_file_bytes
+
+
+class PXL_dataset_image_probe(object):
+    """
+    Reads the width, height, number of channels and format of images from their headers, without decoding the pixels.
+    PNG, JPEG and WebP headers are parsed directly, other formats fall back to the lazy header reader of PIL.
+    Results are kept in a cache that is shared by all probes, keyed by path and only used while the file size and mtime
+    are unchanged, with least recently used eviction beyond MAX_CACHE_ENTRIES images.
+    """
+    HEADER_BYTES = 65536
+    MAX_CACHE_ENTRIES = 100000
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, max_workers: int = None, chunk_size: int = 1024):
+        """
+        Initialize the probe with the number of threads and the number of images per task.
+        """
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def probe(self, path: str):
+        """
+        Return a dict with the width, height, channels and format of one image.
+        Unreadable images get a width, height and channels of 0 and the format None.
+        """
+        try:
+            stat_key = file_stat_key(path)
+        except OSError:
+            return _unreadable()
+        with self._cache_lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == stat_key:
+                self._cache.move_to_end(path)
+                return dict(cached[1])
+        metadata = _read_header(path)
+        with self._cache_lock:
+            self._cache[path] = (stat_key, metadata)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.MAX_CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+        return dict(metadata)
+
+    def probe_all(self, paths):
+        """
+        Probe a list of images on the thread pool and return a list with the metadata dict of every image.
+        """
+        metadata = []
+        for chunk_metadata in map_chunks(self._probe_chunk, chunked(paths, self.chunk_size), concurrent.futures.ThreadPoolExecutor, self.max_workers):
+            metadata.extend(chunk_metadata)
+        return metadata
+
+    def probe_split(self, df, column: str = 'image'):
+        """
+        Return a copy of the dataframe of a split with width, height, channels and format columns for the given image column.
+        """
+        metadata = self.probe_all(df[column].tolist())
+        return df.assign(
+            width=np.array([item['width'] for item in metadata], dtype=np.int32),
+            height=np.array([item['height'] for item in metadata], dtype=np.int32),
+            channels=np.array([item['channels'] for item in metadata], dtype=np.int8),
+            format=[item['format'] for item in metadata]
+        )
+
+    def read_sizes(self, paths):
+        """
+        Return an (n, 2) int32 array with the width and height of every image. Unreadable images get 0 by 0.
+        """
+        metadata = self.probe_all(paths)
+        return np.array([(item['width'], item['height']) for item in metadata], dtype=np.int32).reshape(-1, 2)
+
+    def read_split_sizes(self, df):
+        """
+        Return the (n, 2) width and height array of a split, taken from its width and height columns when present.
+        """
+        if 'width' in df.columns and 'height' in df.columns:
+            return np.stack((df['width'].to_numpy(dtype=np.int32), df['height'].to_numpy(dtype=np.int32)), axis=1)
+        return self.read_sizes(df['image'].tolist())
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Remove all results from the shared cache.
+        """
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    def _probe_chunk(self, paths):
+        """
+        Private method that probes a chunk of images on one worker thread.
+        """
+        return [self.probe(path) for path in paths]
+
+
+def sniff_image_format(data: bytes):
+    """
+    Return the format ('png', 'jpeg' or 'webp') of encoded image bytes from their magic number, or None for other formats.
+    Only the first 12 bytes are needed.
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def read_image_metadata(data: bytes):
+    """
+    Return a dict with the width, height, channels and format of encoded image bytes that are already in memory.
+    """
+    metadata = _parse_header(data[:PXL_dataset_image_probe.HEADER_BYTES])
+    if metadata is None and data[:2] == b'\xff\xd8':
+        metadata = _parse_jpeg(data)
+    if metadata is None:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                metadata = {"width": image.size[0], "height": image.size[1], "channels": len(image.getbands()), "format": (image.format or "").lower() or None}
+        except (OSError, ValueError):
+            metadata = _unreadable()
+    return metadata
+
+
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _unreadable():
+    """
+    Private function that returns the metadata of an image that could not be read.
+    """
+    return {"width": 0, "height": 0, "channels": 0, "format": None}
+
+
+def _read_header(path: str):
+    """
+    Private function to read the metadata of one image from the first bytes of the file.
+    """
+    try:
+        header = read_file_bytes(path, PXL_dataset_image_probe.HEADER_BYTES)
+        metadata = _parse_header(header)
+        if metadata is None and header[:2] == b'\xff\xd8':
+            metadata = _parse_jpeg(read_file_bytes(path))
+    except (OSError, ValueError):
+        return _unreadable()
+    if metadata is None:
+        metadata = _read_header_with_pil(path)
+    return metadata
+
+
+def _parse_header(header: bytes):
+    """
+    Private function to parse a PNG, JPEG or WebP header. Returns None for other formats or truncated headers.
+    """
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        width, height, _, color_type = struct.unpack(">IIBB", header[16:26])
+        return {"width": width, "height": height, "channels": PNG_CHANNELS.get(color_type, 3), "format": "png"}
+    if header[:2] == b'\xff\xd8':
+        return _parse_jpeg(header)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return _parse_webp(header)
+    return None
+
+
+def _parse_jpeg(data: bytes):
+    """
+    Private function to find the start of frame segment of a JPEG file and read the size and components from it.
+    """
+    position = 2
+    while position + 9 < len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        segment_length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width, components = struct.unpack(">HHB", data[position + 5:position + 10])
+            return {"width": width, "height": height, "channels": components, "format": "jpeg"}
+        position += 2 + segment_length
+    return None
+
+
+def _parse_webp(header: bytes):
+    """
+    Private function to read the size and alpha flag from the first chunk of a WebP file.
+    """
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:
+        width, height = struct.unpack("<HH", header[26:30])
+        return {"width": width & 0x3FFF, "height": height & 0x3FFF, "channels": 3, "format": "webp"}
+    if chunk == b'VP8L' and len(header) >= 25:
+        bits = struct.unpack("<I", header[21:25])[0]
+        alpha = (bits >> 28) & 0x1
+        return {"width": (bits & 0x3FFF) + 1, "height": ((bits >> 14) & 0x3FFF) + 1, "channels": 4 if alpha else 3, "format": "webp"}
+    if chunk == b'VP8X' and len(header) >= 30:
+        alpha = header[20] & 0x10
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return {"width": width, "height": height, "channels": 4 if alpha else 3, "format": "webp"}
+    return None
+
+
+def _read_header_with_pil(path: str):
+    """
+    Private function to read the metadata of other formats with PIL, which only reads the header on open.
+    """
+    try:
+        with Image.open(io.BytesIO(read_file_bytes(path)) if is_shard_path(path) else path) as image:
+            return {"width": image.size[0], "height": image.size[1], "channels": len(image.getbands()), "format": (image.format or "").lower() or None}
+    except (OSError, ValueError):
+        return _unreadable()
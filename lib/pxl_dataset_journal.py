@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+
+from .pxl_dataset_shard_reader import file_stat_key, is_shard_path, read_file_bytes
+
+
+class PXL_dataset_journal(object):
+    """
+    Progress journal of a resumable save. Every written file is appended as one JSON line with its target path,
+    a key of its source, and the size, mtime and content hash of the target. A task is skipped when its source key
+    is unchanged and the target still has the journalled size and mtime, or else the journalled size and hash.
+    Targets without a journal entry are skipped when their size and hash equal those of the source.
+    The journal is only appended to while saving and compacted when the save is done.
+    """
+    FILENAME = ".pxl_journal"
+
+    def __init__(self, save_directory: str):
+        """
+        Open the journal of a save directory and read the entries of earlier runs.
+        """
+        self.path = os.path.join(save_directory, self.FILENAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try:
+                        target, source_key, size, mtime, digest = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[target] = (source_key, size, mtime, digest)
+
+    def lookup(self, tasks):
+        """
+        Return the tasks with the journal entry of their target, or None, as (kind, source, target, entry) tuples.
+        """
+        for kind, source, target in tasks:
+            yield (kind, source, target, self.entries.get(target))
+
+    def append(self, entries):
+        """
+        Append the entries of completed files as (target, source_key, size, mtime, hash) tuples and flush them to disk.
+        """
+        if not entries:
+            return
+        with self._lock:
+            with open(self.path, 'a') as file:
+                for entry in entries:
+                    file.write(json.dumps(list(entry)) + "\n")
+                    self.entries[entry[0]] = tuple(entry[1:])
+
+    def compact(self):
+        """
+        Rewrite the journal with one line per target.
+        """
+        with self._lock:
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, 'w') as file:
+                for target, entry in self.entries.items():
+                    file.write(json.dumps([target] + list(entry)) + "\n")
+            os.replace(temporary_path, self.path)
+
+
+def source_key(kind: str, source, codec=None):
+    """
+    Return a string that changes when the source of a write task changes: the size and mtime of a source file,
+    or the hash of in-memory content. For transcode tasks with a PXL_dataset_codec the settings of the codec are
+    part of the key, so a save with other settings writes the images again.
+    """
+    if isinstance(source, bytes):
+        key = "hash:" + content_hash(source)
+    elif kind == "yolo":
+        return "hash:" + content_hash(source.tobytes())
+    else:
+        try:
+            key = "stat:" + ":".join(str(value) for value in file_stat_key(source))
+        except OSError:
+            return None
+    if kind == "transcode" and codec is not None:
+        key += "|" + codec.key
+    return key
+
+
+def content_hash(data: bytes):
+    """
+    Return the BLAKE2 hash of some bytes as a hex string.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_hash(path: str, block_size: int = 2**20):
+    """
+    Return the BLAKE2 hash of the content of a file, or of a file packed in a shard, as a hex string.
+    """
+    if is_shard_path(path):
+        return content_hash(read_file_bytes(path))
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_unchanged(kind: str, source, target: str, entry, key: str):
+    """
+    True when the target of a task does not need to be written again.
+    """
+    try:
+        stat = os.stat(target)
+    except OSError:
+        return False
+    if entry is not None and (entry[0] == key or (kind == "move" and key is None)):
+        if entry[1] == stat.st_size and entry[2] == stat.st_mtime_ns:
+            return True
+        return entry[1] == stat.st_size and entry[3] == file_hash(target)
+    if kind == "bytes":
+        return len(source) == stat.st_size and key == "hash:" + file_hash(target)
+    if kind == "link" and key is not None and os.path.samefile(source, target):
+        return True
+    if kind in ("copy", "link") and key is not None:
+        source_size = file_stat_key(source)[1] if is_shard_path(source) else os.path.getsize(source)
+        return source_size == stat.st_size and file_hash(source) == file_hash(target)
+    return False
+
+
+def target_entry(target: str, key: str):
+    """
+    Return the journal entry of a written target.
+    """
+    stat = os.stat(target)
+    return (target, key, stat.st_size, stat.st_mtime_ns, file_hash(target))
@@ -1,15 +1,20 @@
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_journal import PXL_dataset_journal
 from .pxl_dataset_sources import PXL_dataset_sources
 from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_transcoder import PXL_dataset_transcoder
 from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_writer import PXL_dataset_writer, PXL_dataset_write_report, format_yolo_lines
 from .pxl_value_exception import PXL_value_exception
 
+import numpy as np
 import os
 import time
 import shutil
 import io
 from PIL import Image
 from pathlib import Path
-import concurrent.futures
 
 
 class PXL_dataset_loader(object):
@@ -17,7 +22,24 @@ class PXL_dataset_loader(object):
     Class to handle the loading, saving, and preprocessing of datasets within the module.
     This includes tasks such as downloading datasets, saving them to a directory, and manipulating
     dataset directories and files according to specific types of datasets.
+    With resume a save never asks to clear the target directory: a journal in the target directory records every
+    written file, and files whose source is unchanged and whose size and hash still match are skipped, so an
+    interrupted save continues where it stopped and a re-run only writes what changed.
+    With a PXL_dataset_codec the images are saved in its format, transcoded on a process pool where needed.
+    Loaders that ingest an object detection dataset themselves keep a box table per split in box_tables,
+    and return a df_map without an 'objects' column.
     """
+    resume: bool = False
+    codec: PXL_dataset_codec = None
+    box_tables: map = None
+
+    def __init__(self, resume: bool = False, codec: PXL_dataset_codec = None):
+        """
+        Initialize the loader, optionally in resumable mode and with the codec of the saved images.
+        """
+        self.resume = resume
+        self.codec = codec
+
     def download_dataset(self, url: str, dataset_source: PXL_dataset_sources, dataset_name: str):
         """
         Abstract method for downloading the dataset. Should be implemented at each datasource.
@@ -27,53 +49,67 @@ class PXL_dataset_loader(object):
     def save_dataset(self, dataset_type: PXL_dataset_types, df_map: map, save_directory: str):
         """
         Saves a dataset to a specified directory adjusted to the dataset type.
+        The files are written by a PXL_dataset_writer, the result is kept in last_write_report.
+        Object detection images are copied as they are without a codec. Segmentation images are saved as PNG without a codec
+        and masks are always saved as lossless PNG named after their image; images that are already in the target format are copied.
         """
         self._prepare_save_directory(save_directory)
+        writer = PXL_dataset_writer()
+        journal = PXL_dataset_journal(save_directory) if self.resume else None
+        self.last_write_report = PXL_dataset_write_report()
+        self.box_tables = None
+        saved_df_map = {}
         if dataset_type == PXL_dataset_types.Object_Detection:
             for key in df_map.keys():
+                df = df_map.get(key)
                 path = "{}{}/".format(save_directory, key)
                 print("saving into: ", path)
-                os.makedirs(path)
-                with concurrent.futures.ProcessPoolExecutor() as executor:
-                    for index, row in df_map.get(key).iterrows():
-                        objects_filename = "{}{}/{}.txt".format(save_directory, key, row['image'].split('/')[-1].split('.')[0])
-                        target_image_filename = "{}{}/{}".format(save_directory, key, row['image'].split('/')[-1])
-                        executor.submit(self._write_yolo_bounding_boxes_file, objects_filename, row['objects'])
-                        executor.submit(shutil.copyfile, row['image'], target_image_filename)
-            df_map = self._change_parent_directory_of_image_path(df_map, save_directory)
-            return df_map
+                os.makedirs(path, exist_ok=True)
+                target_images = [path + image.split('/')[-1] for image in df['image']]
+                if self.codec is not None:
+                    target_images = [self.codec.target_path(image) for image in target_images]
+                if 'objects' in df.columns:
+                    box_table = PXL_dataset_box_table.from_objects(df['objects'].tolist())
+                else:
+                    box_table = PXL_dataset_box_table.empty(len(df))
+                tasks = self._object_detection_write_tasks(df['image'], target_images, box_table, copy_images=self.codec is None)
+                self.last_write_report.add(writer.run(tasks, journal=journal))
+                if self.codec is not None:
+                    self.last_write_report.add(PXL_dataset_transcoder(self.codec).run(df['image'], target_images, journal))
+                saved_df_map[key] = df.assign(image=target_images)
+            self._finish_save(journal)
+            return saved_df_map
 
         elif dataset_type == PXL_dataset_types.Segmentation:            
             for key in df_map.keys():
+                df = df_map.get(key)
                 path = "{}{}/".format(save_directory, key)
                 print("saving into: ", path)
-                os.makedirs("{}image/".format(path))
-                os.makedirs("{}segmented/".format(path))
-                with concurrent.futures.ProcessPoolExecutor() as executor:
-                    for index, row in df_map.get(key).iterrows():
-                        image_path = row.get('image')
-                        image_name = image_path.split("/")[-1].split(".")[0]
-                        output_path = "{}{}.png".format(path + "image/", image_name)
-                        executor.submit(shutil.copyfile, image_path, output_path)
-                        image_path = row.get('segmentation_image')
-                        image_name = image_path.split("/")[-1].split(".")[0]
-                        output_path = "{}{}.png".format(path + "segmented/", image_name)
-                        executor.submit(shutil.copyfile, image_path, output_path)
-            df_map = self._change_parent_directory_of_image_path(df_map, save_directory)
-            return df_map
+                os.makedirs("{}image/".format(path), exist_ok=True)
+                os.makedirs("{}segmented/".format(path), exist_ok=True)
+                image_codec = self.codec or PXL_dataset_codec('png')
+                stems = [os.path.splitext(image.split("/")[-1])[0] for image in df['image']]
+                target_images = ["{}image/{}{}".format(path, stem, image_codec.extension) for stem in stems]
+                target_segmentations = ["{}segmented/{}.png".format(path, stem) for stem in stems]
+                self.last_write_report.add(PXL_dataset_transcoder(image_codec).run(df['image'], target_images, journal))
+                self.last_write_report.add(PXL_dataset_transcoder(PXL_dataset_codec('png')).run(df['segmentation_image'], target_segmentations, journal))
+                saved_df_map[key] = df.assign(image=target_images, segmentation_image=target_segmentations)
+            self._finish_save(journal)
+            return saved_df_map
 
         elif dataset_type == PXL_dataset_types.Classification:
             pass
         else:
-            PXL_value_exception("Dataset type not implemented yet")
+            raise PXL_value_exception("Dataset type not implemented yet")
 
     def _prepare_save_directory(self, path: str, require_empty=True):
         """
         Private method that prepares the save directory by ensuring it exists and is empty.
+        In resumable mode the content of the directory is kept without asking.
         """
         if not os.path.exists(path):
             os.makedirs(path)
-        elif require_empty and len(os.listdir(path)) > 0:
+        elif require_empty and not self.resume and len(os.listdir(path)) > 0:
             print("!!! It seems that de target directory is not empty! Do you want to continue and clear the directory? (y/N):")
             time.sleep(1) #wait for print te be printed
             answer = input()
@@ -98,14 +134,14 @@ class PXL_dataset_loader(object):
         """
         return_value = False
         directory = Path(path)
-        for item in directory.interdir():
+        for item in directory.iterdir():
             for split in PXL_dataset_split:
-                if item.startwith(split.value):
+                if item.is_dir() and item.name.lower().startswith(split.value):
                     return_value = True
-                    current_path = os.path.join(path, item)
-                    new_directory_name = split.name
-                    new_path = os.path.join(path, new_directory_name)
-                    os.rename(current_path, new_path)
+                    new_path = os.path.join(path, split.name.lower())
+                    if str(item) != new_path:
+                        os.rename(item, new_path)
+                    break
         return return_value
 
     def _rename_df_map_keys_to_pxl_split_names(self, df_map: map):
@@ -114,10 +150,10 @@ class PXL_dataset_loader(object):
         """
         new_df_map = {}
         for key in df_map.keys():
-            if any(key.startswith(split.value) for split in PXL_dataset_sources):
-                for split in PXL_dataset_sources:
+            if any(key.startswith(split.value) for split in PXL_dataset_split):
+                for split in PXL_dataset_split:
                     if key.startswith(split.value):
-                        new_df_map[split] = df_map[key]
+                        new_df_map[split.name.lower()] = df_map[key]
             else:
                 new_df_map[key] = df_map[key]
         return new_df_map
@@ -139,36 +175,56 @@ class PXL_dataset_loader(object):
         image = Image.open(image_path)
         image.save(new_image_path)
 
-    def _resave_images_as_png(self, image_path, path):
+    def _resave_images_as_png(self, image_paths, path, compress_level: int = 6):
         """
-        Private method to save an image as a png.
+        Private method to save images, one path or a list of paths, as png into the folder path.
+        Images that are already PNG are copied, the others are transcoded on a process pool. Returns the write report.
         """
-        image_name = image_path.split("/")[-1].split(".")[0]
-        output_path = "{}{}.png".format(path, image_name)
-        if(image_path.lower().endswith('.png')):
-            shutil.copyfile(image_path, output_path)
-        else:
-            with Image.open(image_path) as image:
-                image.save(output_path, 'PNG')
-    
-    def _change_parent_directory_of_image_path(self, df_map, new_parent_directory):
-        """
-        Private method to change the parent directory of the images paths to another one.
-        """
-        for key in df_map.keys():
-            df_map.get(key)['image'] = df_map.get(key)['image'].apply(lambda x: "{}{}/image/{}".format(new_parent_directory, key, x.split('/')[-1]))
-            if 'segmentation_image' in df_map.get(key).columns:
-                df_map.get(key)['segmentation_image'] = df_map.get(key)['segmentation_image'].apply(lambda x: "{}{}/segmented/{}".format(new_parent_directory, key, x.split('/')[-1]))
-        return df_map
+        if isinstance(image_paths, str):
+            image_paths = [image_paths]
+        output_paths = ["{}{}.png".format(path, image_path.split("/")[-1].split(".")[0]) for image_path in image_paths]
+        return PXL_dataset_transcoder(PXL_dataset_codec('png', compress_level=compress_level)).run(image_paths, output_paths)
     
     def _write_yolo_bounding_boxes_file(self, filename:str, boxes):
         """
         Private method to save objects to a yolo fileformat.
+        The boxes are either a list of dicts with 'centerNSize' values or an (n, 5) array of class, cx, cy, w, h.
         """
+        if isinstance(boxes, np.ndarray):
+            with open(filename, 'w') as file:
+                file.write(format_yolo_lines(boxes.reshape(-1, 5)))
+            return
         with open(filename, 'w') as file:
             for box in boxes:
                 line = "0 "
                 for point in box['centerNSize']:
                     line += str(point) + " "
                 line += '\n'
-                file.write(line)
\ No newline at end of file
+                file.write(line)
+
+    def _object_detection_write_tasks(self, source_images, target_images, box_table: PXL_dataset_box_table, copy_images: bool = True):
+        """
+        Private method that generates the writer tasks to copy every image and write its YOLO label file.
+        Without copy_images only the label files are written.
+        """
+        for index, (source, target) in enumerate(zip(source_images, target_images)):
+            if copy_images:
+                yield ("copy", source, target)
+            yield ("yolo", box_table.label_array(index), "{}.txt".format(os.path.splitext(target)[0]))
+
+    def _finish_save(self, journal: PXL_dataset_journal = None):
+        """
+        Private method that compacts the journal of a resumable save and reports the files that could not be written.
+        """
+        if journal is not None:
+            journal.compact()
+            print("{} files written, {} files already complete.".format(self.last_write_report.written, self.last_write_report.skipped))
+        self._print_write_failures()
+
+    def _print_write_failures(self):
+        """
+        Private method that reports the files that could not be written by the last save.
+        """
+        if not self.last_write_report.ok:
+            print("!!! {} files could not be saved, see last_write_report for details. First error: {} ({})".format(
+                len(self.last_write_report.failures), *self.last_write_report.failures[0]))
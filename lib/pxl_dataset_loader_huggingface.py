@@ -1,60 +1,158 @@
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_journal import PXL_dataset_journal
 from .pxl_dataset_loader import PXL_dataset_loader
+from .pxl_dataset_parallel import chunked
 from .pxl_dataset_sources import PXL_dataset_sources
+from .pxl_dataset_transcoder import PXL_dataset_transcoder
 from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_writer import PXL_dataset_writer, PXL_dataset_write_report
 from .pxl_value_exception import PXL_value_exception
 
+import os
+import pandas as pd
+from datasets import Image as HuggingfaceImage
 from datasets import load_dataset as load_from_huggingface
 
 
 class PXL_dataset_loader_huggingface(PXL_dataset_loader):
     """
     A loader for handling dataset dataset downloads en preprocessing for datasets hosted on Huggingface.
+    In streaming mode the dataset is read as an iterable dataset and the images are written to the save directory
+    in batches of batch_size while they arrive, so the df_map only holds image paths and annotations.
+    The images are saved as PNG, or in the format of the codec when one is given.
     """
+    def __init__(self, streaming: bool = False, batch_size: int = 256, image_column_name: str = 'image', label_column_name: str = 'label', resume: bool = False,
+                 codec: PXL_dataset_codec = None):
+        """
+        Initialize the loader. The label column is used to sort the images of classification datasets in folders.
+        With resume, images that were already written by an earlier run are skipped.
+        """
+        super().__init__(resume, codec)
+        self.streaming = streaming
+        self.batch_size = batch_size
+        self.image_column_name = image_column_name
+        self.label_column_name = label_column_name
+
     def download_dataset(self, url: str, dataset_source: PXL_dataset_sources, dataset_name: str, save_directory: str):
         """
         Downloads a dataset from Huggingface.
         """
         self._prepare_save_directory(save_directory)
+        if self.streaming:
+            return self._stream_dataset(dataset_name, save_directory)
         dataset = load_from_huggingface(dataset_name)
         df_map = {key: dataset[key].to_pandas() for key in dataset.keys()}
         df_map = self._rename_df_map_keys_to_pxl_split_names(df_map)
         return df_map
-        
-        
 
     def save_dataset(self, dataset_type: PXL_dataset_types, df_map: map, save_directory: str):
         """
         Save the downloaded dataset in the correct format and at a given location.
+        Encoded images that are already in the target format are written as they are, other images are transcoded on a process pool.
+        Images that were already written by the streaming mode are moved into place instead of written again.
+        The result of the writes is kept in last_write_report.
         """
-        for key in df_map:
-            image_counter = 0
-            for index, row in df_map.get(key).iterrows():
-                if dataset_type == PXL_dataset_types.Classification:
-                    try:
-                        image_folder = "{}{}/{}/".format(save_directory, key.name, str(row[label_column_name]))
-                    except KeyError:
-                        raise PXL_value_exception("The given label_column_name is not valid. The options are {}".format(row.keys()))
-                else:
-                    image_folder = "{}{}/".format(save_directory, key.name)
-                self._prepare_save_directory(save_directory, require_empty=False)
-                binary_image = row['image'].get('bytes', None)
-                image_path = row['image'].get('path', None)
-                image_name = "{}.png".format(image_counter)
-                if binary_image:
-                    self._save_binary_image(image_folder, image_name, binary_image)
-                elif image_path:
-                    self._save_image_from_path(image_folder, image_name, image_path)
-                image_counter += 1
+        saved_df_map = {}
+        self.last_write_report = PXL_dataset_write_report()
+        self._journal = PXL_dataset_journal(save_directory) if self.resume else None
+        with PXL_dataset_writer() as writer, PXL_dataset_transcoder(self.codec) as transcoder:
+            for key in df_map:
+                df = df_map.get(key)
+                image_folders = self._get_image_folders(dataset_type, save_directory, key, df)
+                for image_folder in set(image_folders):
+                    os.makedirs(image_folder, exist_ok=True)
+                image_paths = ["{}{}{}".format(image_folder, image_counter, transcoder.codec.extension) for image_counter, image_folder in enumerate(image_folders)]
+                self._write_images(writer, transcoder, df[self.image_column_name].tolist(), image_paths)
+                saved_df_map[key] = df.assign(**{self.image_column_name: image_paths})
+        self._finish_save(self._journal)
+        return saved_df_map
+
+    def _stream_dataset(self, dataset_name: str, save_directory: str):
+        """
+        Private method that streams every split of a dataset and writes the images in batches to {save_directory}{split}/.
+        The other image columns, such as segmentation masks, are written as lossless PNG to {save_directory}{split}/{column}/.
+        Only the paths and the other columns are kept in memory.
+        """
+        dataset = load_from_huggingface(dataset_name, streaming=True)
+        df_map = {}
+        self.last_write_report = PXL_dataset_write_report()
+        self._journal = PXL_dataset_journal(save_directory) if self.resume else None
+        with PXL_dataset_writer() as writer, PXL_dataset_transcoder(self.codec) as transcoder, \
+                PXL_dataset_transcoder(PXL_dataset_codec('png')) as mask_transcoder:
+            for split_key in dataset.keys():
+                key = self._get_pxl_split_name(split_key)
+                split = dataset[split_key]
+                image_columns = [self.image_column_name] + [column for column, feature in (split.features or {}).items()
+                                                            if isinstance(feature, HuggingfaceImage) and column != self.image_column_name]
+                image_folders = {column: "{}{}/".format(save_directory, key) if column == self.image_column_name else "{}{}/{}/".format(save_directory, key, column)
+                                 for column in image_columns}
+                for column in image_columns:
+                    os.makedirs(image_folders[column], exist_ok=True)
+                    split = split.cast_column(column, HuggingfaceImage(decode=False))
+                columns = {}
+                image_counter = 0
+                for batch in chunked(iter(split), self.batch_size):
+                    for column in image_columns:
+                        column_transcoder = transcoder if column == self.image_column_name else mask_transcoder
+                        image_paths = ["{}{}{}".format(image_folders[column], image_counter + i, column_transcoder.codec.extension) for i in range(len(batch))]
+                        failed_paths = self._write_images(writer, column_transcoder, [row[column] for row in batch], image_paths)
+                        for row, image_path in zip(batch, image_paths):
+                            row[column] = image_path if row[column] is not None and image_path not in failed_paths else None
+                    image_counter += len(batch)
+                    for row in batch:
+                        for column, value in row.items():
+                            columns.setdefault(column, []).append(value)
+                df_map[key] = pd.DataFrame(columns)
+        return df_map
+
+    def _write_images(self, writer: PXL_dataset_writer, transcoder: PXL_dataset_transcoder, images, image_paths):
+        """
+        Private method that writes images, given as paths or dicts with bytes or path, to the given paths in the format of the transcoder.
+        Images that were already written are moved on threads, the others go through the transcoder.
+        Returns the set of paths that could not be written.
+        """
+        move_tasks = []
+        sources = []
+        targets = []
+        for image, image_path in zip(images, image_paths):
+            if image is None:
+                continue
+            if isinstance(image, str):
+                if os.path.abspath(image) != os.path.abspath(image_path):
+                    move_tasks.append(("move", image, image_path))
+            elif image.get('bytes', None) or image.get('path', None):
+                sources.append(image['bytes'] if image.get('bytes', None) else image['path'])
+                targets.append(image_path)
+        move_report = writer.run(move_tasks, journal=self._journal)
+        transcode_report = transcoder.run(sources, targets, self._journal)
+        self.last_write_report.add(move_report)
+        self.last_write_report.add(transcode_report)
+        return {target for target, _ in move_report.failures + transcode_report.failures}
+
+    def _get_image_folders(self, dataset_type: PXL_dataset_types, save_directory: str, key: str, df):
+        """
+        Private method that returns the folder of every image of a split, with a folder per label for classification datasets.
+        """
+        if dataset_type == PXL_dataset_types.Classification:
+            if self.label_column_name not in df.columns:
+                raise PXL_value_exception("The given label_column_name is not valid. The options are {}".format(list(df.columns)))
+            return ["{}{}/{}/".format(save_directory, key, str(label)) for label in df[self.label_column_name]]
+        return ["{}{}/".format(save_directory, key)] * len(df)
+
+    def _get_pxl_split_name(self, key: str):
+        """
+        Private method that returns the PXL split name of a Huggingface split, or the key itself when it does not match.
+        """
+        return next(iter(self._rename_df_map_keys_to_pxl_split_names({key: None}).keys()))
 
     def _prepare_save_directory(self, path: str, require_empty=True):
         super()._prepare_save_directory(path, require_empty)
 
     def _rename_df_map_keys_to_pxl_split_names(self, df_map: map):
-        super()._rename_df_map_keys_to_pxl_split_names(df_map)
+        return super()._rename_df_map_keys_to_pxl_split_names(df_map)
 
     def _save_binary_image(self, image_folder: str, image_name: str, binary_image):
         super()._save_binary_image(image_folder, image_name, binary_image)
 
     def _save_image_from_path(self, image_folder: str, image_name: str, image_path):
         super()._save_image_from_path(image_folder, image_name, image_path)
-
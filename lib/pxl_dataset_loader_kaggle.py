@@ -1,35 +1,66 @@
+from .pxl_dataset_archive_ingest import PXL_dataset_archive_ingest
+from .pxl_dataset_codec import PXL_dataset_codec
 from .pxl_dataset_loader import PXL_dataset_loader
 from .pxl_dataset_sources import PXL_dataset_sources
 from .pxl_dataset_types import PXL_dataset_types
 from .pxl_dataset_format_exception import PXL_dataset_format_exception
 
+import os
 import shutil
-from opendatasets import download as load_from_kaggle
 
 
 class PXL_dataset_loader_kaggle(PXL_dataset_loader):
     """
     A loader for handling dataset dataset downloads en preprocessing for datasets hosted on Kaggle.
+    The dataset is downloaded as an archive that is not extracted: save_dataset streams its members straight into the save directory.
     """
+    def __init__(self, resume: bool = False, archive_path: str = None, max_workers: int = None, codec: PXL_dataset_codec = None):
+        """
+        Initialize the loader. With archive_path a local archive is ingested instead of a downloaded one.
+        With a codec the images are saved in its format.
+        """
+        super().__init__(resume, codec)
+        self.archive_path = archive_path
+        self.max_workers = max_workers
+
     def download_dataset(self, url: str, dataset_source: PXL_dataset_sources, dataset_name: str, save_directory: str):
         """
-        Downloads a dataset from Kaggle.
+        Downloads a dataset from Kaggle as a zip archive, without extracting it.
+        Returns None, as the df_map is only known once save_dataset has ingested the archive.
         """
-        load_from_kaggle(url)
-        split_name = dataset_name.split("/")
-        path = self._add_single_folders_to_path(split_name[-1])
-        if not self._check_and_rename_split_folders():
+        from kaggle.api.kaggle_api_extended import KaggleApi
+        api = KaggleApi()
+        api.authenticate()
+        download_directory = "{}/".format(dataset_name.split("/")[-1])
+        api.dataset_download_files(dataset_name, path=download_directory, quiet=False, unzip=False)
+        archives = [name for name in os.listdir(download_directory) if name.endswith(".zip")]
+        if not archives:
             raise PXL_dataset_format_exception()
-        pass
-        ##TODO implement further from here
-        
-        
+        self.archive_path = download_directory + archives[0]
+        return None
+
     def save_dataset(self, dataset_type: PXL_dataset_types, df_map: map, save_directory: str):
         """
         Save the downloaded dataset in the correct format and at a given location.
+        Without a df_map the archive is ingested: its members are written once, in parallel, into the save layout.
         """
-        super().save_dataset(dataset_type, df_map, save_directory)
+        if df_map is None and self.archive_path is not None:
+            return self.ingest_archive(self.archive_path, dataset_type, save_directory)
+        return super().save_dataset(dataset_type, df_map, save_directory)
 
+    def ingest_archive(self, archive_path: str, dataset_type: PXL_dataset_types, save_directory: str):
+        """
+        Stream a local zip or tar archive into the save layout of the dataset type and return the df_map.
+        The split folders are detected by the PXL_dataset_split prefixes of the member names.
+        For object detection the boxes are kept in box_tables.
+        """
+        self._prepare_save_directory(save_directory)
+        ingest = PXL_dataset_archive_ingest(self.max_workers, codec=self.codec)
+        df_map = ingest.ingest(archive_path, dataset_type, save_directory)
+        self.last_write_report = ingest.last_write_report
+        self.box_tables = ingest.box_tables
+        self._print_write_failures()
+        return df_map
 
     def _add_single_folders_to_path(self, path: str):
         return super()._add_single_folders_to_path(path)
@@ -48,4 +79,3 @@ class PXL_dataset_loader_kaggle(PXL_dataset_loader):
 
     def _save_image_from_path(self, image_folder: str, image_name: str, image_path):
         return super()._save_image_from_path(image_folder, image_name, image_path)
-
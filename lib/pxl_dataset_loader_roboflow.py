@@ -1,20 +1,36 @@
-from roboflow import Roboflow
-
+from .pxl_dataset_journal import PXL_dataset_journal
 from .pxl_dataset_loader import PXL_dataset_loader
 from .pxl_dataset_sources import PXL_dataset_sources
 from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_writer import PXL_dataset_writer
+from .pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
 from .pxl_value_exception import PXL_value_exception
 
+import numpy as np
+import os
+import pandas as pd
+
 
 class PXL_dataset_loader_roboflow(PXL_dataset_loader):
     """
     A loader for handling dataset dataset downloads en preprocessing for datasets hosted on Roboflow.
+    The dataset is downloaded as a YOLO export, whose files are linked into the save directory instead of copied.
     """
+    def __init__(self, resume: bool = False, export_directory: str = None, max_workers: int = None):
+        """
+        Initialize the loader. With export_directory a local Ultralytics or Roboflow YOLO export is ingested instead of a download.
+        """
+        super().__init__(resume)
+        self.export_directory = export_directory
+        self.max_workers = max_workers
+        self.class_names = None
+
     def download_dataset(self, url: str, dataset_source: PXL_dataset_sources, dataset_name: str, save_directory: str):
         """
         Downloads a dataset from Roboflow. Make sure to put the Roboflow_api_key.txt at the right location.
+        Returns None, as the df_map is built when save_dataset ingests the downloaded export.
         """
-        self._prepare_save_directory(save_directory)
+        from roboflow import Roboflow
         with open("Roboflow_api_key.txt", "r") as file:
             api_key = file.readline()
         rf = Roboflow(api_key=api_key)
@@ -24,22 +40,61 @@ class PXL_dataset_loader_roboflow(PXL_dataset_loader):
 
         latest_version = all_versions[0].version
         dataset = project.version(latest_version).download("yolov5")
-
-        ##TODO implement further from here
-        
-        
+        self.export_directory = dataset.location
+        return None
 
     def save_dataset(self, dataset_type: PXL_dataset_types, df_map: map, save_directory: str):
         """
         Save the downloaded dataset in the correct format and at a given location.
+        Without a df_map the downloaded export is ingested into the save directory.
+        """
+        if df_map is None and self.export_directory is not None:
+            if dataset_type != PXL_dataset_types.Object_Detection:
+                raise PXL_value_exception("A YOLO export can only be loaded as an object detection dataset.")
+            return self.ingest_export(self.export_directory, save_directory)
+        return super().save_dataset(dataset_type, df_map, save_directory)
+
+    def ingest_export(self, export_directory: str, save_directory: str):
+        """
+        Ingest an Ultralytics or Roboflow YOLO export tree (data.yaml, train/images, train/labels, valid/...) into the save directory.
+        The tree is scanned and the labels are parsed once, then every image and label file is hard linked into the
+        save layout on a thread pool, falling back to a copy across filesystems. Images without labels get an empty label file.
+        Returns the object detection df_map, the boxes are kept in box_tables and the class names of data.yaml in class_names.
+        """
+        self._prepare_save_directory(save_directory)
+        df_map, box_tables, label_paths, self.class_names = PXL_dataset_yolo_ingest(self.max_workers).load_export_tree(export_directory)
+        journal = PXL_dataset_journal(save_directory) if self.resume else None
+        saved_df_map = {}
+        tasks = []
+        for key, df in df_map.items():
+            path = "{}{}/".format(save_directory, key)
+            print("saving into: ", path)
+            os.makedirs(path, exist_ok=True)
+            target_images = [path + image.split("/")[-1] for image in df['image']]
+            tasks.append(self._link_tasks(df['image'], target_images, label_paths[key]))
+            saved_df_map[key] = pd.DataFrame({'image': target_images})
+        self.last_write_report = PXL_dataset_writer(self.max_workers).run((task for split_tasks in tasks for task in split_tasks), journal=journal)
+        self.box_tables = box_tables
+        self._finish_save(journal)
+        return saved_df_map
+
+    def _link_tasks(self, source_images, target_images, label_paths):
+        """
+        Private method that generates the writer tasks to link every image and its label file into the save directory.
         """
-        super().save_dataset(dataset_type, df_map, save_directory)
+        for source, target, label_path in zip(source_images, target_images, label_paths):
+            yield ("link", source, target)
+            target_label = "{}.txt".format(os.path.splitext(target)[0])
+            if label_path is None:
+                yield ("yolo", np.zeros((0, 5), dtype=np.float32), target_label)
+            else:
+                yield ("link", label_path, target_label)
 
     def _prepare_save_directory(self, path: str, require_empty=True):
         super()._prepare_save_directory(path, require_empty)
 
     def _rename_df_map_keys_to_pxl_split_names(self, df_map: map):
-        super()._rename_df_map_keys_to_pxl_split_names(df_map)
+        return super()._rename_df_map_keys_to_pxl_split_names(df_map)
 
     def _save_binary_image(self, image_folder: str, image_name: str, binary_image):
         super()._save_binary_image(image_folder, image_name, binary_image)
@@ -0,0 +1,269 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_image_probe import PXL_dataset_image_probe
+from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+class PXL_dataset_manifest(object):
+    """
+    Index of a saved dataset directory, stored as one compact file in the save directory.
+    Per image it holds the file name, size, mtime, width, height, channels, format and the size and mtime of the annotation file
+    (the YOLO label file or the segmentation mask). For object detection it also holds the parsed boxes.
+    When the manifest is validated, only the files whose size or mtime changed are scanned again.
+    """
+    FILENAME = ".pxl_manifest.npz"
+    VERSION = 2
+
+    def __init__(self, save_directory: str, dataset_type: PXL_dataset_types, max_workers: int = None):
+        """
+        Initialize the manifest of a save directory for the given dataset type.
+        """
+        self.save_directory = save_directory
+        self.dataset_type = dataset_type
+        self.max_workers = max_workers
+        self.path = os.path.join(save_directory, self.FILENAME)
+
+    def load_object_detection(self, validate: bool = True):
+        """
+        Load an object detection dataset through the manifest.
+        Returns the df_map, with width, height, channels and format columns, and the box table of every split.
+        """
+        df_map = {}
+        box_tables = {}
+        for key, folder, records in self._load_records(validate):
+            prefix = "{}{}/".format(self.save_directory, folder)
+            df_map[key] = pd.DataFrame({
+                'image': [prefix + name for name in records['name']],
+                'width': records['width'],
+                'height': records['height'],
+                'channels': records['channels'],
+                'format': [value or None for value in records['format']]
+            })
+            box_tables[key] = PXL_dataset_box_table.from_arrays(records['box_count'], records['class_id'], records['boxes'])
+        return df_map, box_tables
+
+    def load_segmentation(self, validate: bool = True):
+        """
+        Load a segmentation dataset through the manifest. Returns the df_map, with width, height, channels and format columns.
+        """
+        df_map = {}
+        for key, folder, records in self._load_records(validate):
+            prefix = "{}{}/".format(self.save_directory, folder)
+            df_map[key] = pd.DataFrame({
+                'image': [prefix + "image/" + name for name in records['name']],
+                'segmentation_image': [prefix + "segmented/" + os.path.splitext(name)[0] + ".png" for name in records['name']],
+                'width': records['width'],
+                'height': records['height'],
+                'channels': records['channels'],
+                'format': [value or None for value in records['format']]
+            })
+        return df_map
+
+    def invalidate(self):
+        """
+        Remove the manifest file so the next load scans the whole directory.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _load_records(self, validate: bool):
+        """
+        Private method that returns (split key, folder, records) for every split.
+        Without validation the stored records are returned as is, with validation the directory is
+        compared with the stored records and the manifest is rewritten when something changed.
+        """
+        stored = self._read()
+        if stored is not None and not validate:
+            return [(key, folder, stored[key]) for key, folder in stored['__folders__']]
+        folders = self._scan_split_folders()
+        result = []
+        changed = stored is None or [key for key, _ in stored['__folders__']] != [key for key, _ in folders]
+        for key, folder in folders:
+            old_records = stored.get(key) if stored is not None else None
+            records, split_changed = self._refresh_split(folder, old_records)
+            changed = changed or split_changed
+            result.append((key, folder, records))
+        if changed:
+            self._write(result)
+        return result
+
+    def _scan_split_folders(self):
+        """
+        Private method that returns the split key and folder name of every split folder in the save directory.
+        """
+        with os.scandir(self.save_directory) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir())
+        folders = []
+        for name in names:
+            for split in PXL_dataset_split:
+                if name.startswith(split.value):
+                    folders.append((split.name.lower(), name))
+        return folders
+
+    def _scan_split(self, folder: str):
+        """
+        Private method that lists the images of a split with their annotation files and file statistics.
+        """
+        split_directory = "{}{}/".format(self.save_directory, folder)
+        if self.dataset_type == PXL_dataset_types.Segmentation:
+            image_directory = split_directory + "image/"
+            annotations = self._stat_directory(split_directory + "segmented/")
+            images = self._stat_directory(image_directory)
+            annotation_names = {name: os.path.splitext(name)[0] + ".png" for name in images}
+        else:
+            image_directory = split_directory
+            entries = self._stat_directory(split_directory)
+            images = {name: stat for name, stat in entries.items() if not name.endswith(".txt")}
+            annotations = {name: stat for name, stat in entries.items() if name.endswith(".txt")}
+            annotation_names = {name: os.path.splitext(name)[0] + ".txt" for name in images}
+        names = sorted(images)
+        scan = {
+            'name': names,
+            'image_size': np.array([images[name][0] for name in names], dtype=np.int64),
+            'image_mtime': np.array([images[name][1] for name in names], dtype=np.int64),
+            'annotation_size': np.array([annotations.get(annotation_names[name], (-1, -1))[0] for name in names], dtype=np.int64),
+            'annotation_mtime': np.array([annotations.get(annotation_names[name], (-1, -1))[1] for name in names], dtype=np.int64)
+        }
+        annotation_directory = split_directory + "segmented/" if self.dataset_type == PXL_dataset_types.Segmentation else split_directory
+        scan['image_path'] = [image_directory + name for name in names]
+        scan['annotation_path'] = [annotation_directory + annotation_names[name] if annotation_names[name] in annotations else None for name in names]
+        return scan
+
+    def _stat_directory(self, directory: str):
+        """
+        Private method that returns the size and mtime in nanoseconds of every visible file in a directory,
+        without the temporary files of writes in progress.
+        """
+        stats = {}
+        if not os.path.isdir(directory):
+            return stats
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name.endswith(".tmp") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def _refresh_split(self, folder: str, old_records):
+        """
+        Private method that updates the records of a split. Rows whose image and annotation statistics are unchanged
+        are taken from the old records, all other rows are probed and parsed again.
+        Returns the records and whether anything changed.
+        """
+        scan = self._scan_split(folder)
+        num_images = len(scan['name'])
+        old_position = np.full(num_images, -1, dtype=np.int64)
+        if old_records is not None and len(old_records['name']):
+            lookup = {name: position for position, name in enumerate(old_records['name'])}
+            old_position = np.array([lookup.get(name, -1) for name in scan['name']], dtype=np.int64)
+        found = old_position >= 0
+        safe_position = np.where(found, old_position, 0)
+        unchanged = found.copy()
+        if old_records is not None and found.any():
+            for column in ('image_size', 'image_mtime', 'annotation_size', 'annotation_mtime'):
+                unchanged &= old_records[column][safe_position] == scan[column]
+        stale = np.flatnonzero(~unchanged)
+        changed = len(stale) > 0 or old_records is None or len(old_records['name']) != num_images
+
+        records = {column: scan[column] for column in ('name', 'image_size', 'image_mtime', 'annotation_size', 'annotation_mtime')}
+        width = np.zeros(num_images, dtype=np.int32)
+        height = np.zeros(num_images, dtype=np.int32)
+        channels = np.zeros(num_images, dtype=np.int8)
+        formats = [""] * num_images
+        if old_records is not None and unchanged.any():
+            width[unchanged] = old_records['width'][old_position[unchanged]]
+            height[unchanged] = old_records['height'][old_position[unchanged]]
+            channels[unchanged] = old_records['channels'][old_position[unchanged]]
+            for position in np.flatnonzero(unchanged):
+                formats[position] = old_records['format'][old_position[position]]
+        stale_paths = [scan['image_path'][position] for position in stale]
+        for position, metadata in zip(stale, PXL_dataset_image_probe(self.max_workers).probe_all(stale_paths)):
+            width[position] = metadata['width']
+            height[position] = metadata['height']
+            channels[position] = metadata['channels']
+            formats[position] = metadata['format'] or ""
+        records['width'] = width
+        records['height'] = height
+        records['channels'] = channels
+        records['format'] = formats
+
+        if self.dataset_type == PXL_dataset_types.Object_Detection:
+            if old_records is not None:
+                old_table = PXL_dataset_box_table.from_arrays(old_records['box_count'], old_records['class_id'], old_records['boxes'])
+                table = old_table.select(safe_position) if len(old_table.offsets) > 1 else PXL_dataset_box_table.empty(num_images)
+            else:
+                table = PXL_dataset_box_table.empty(num_images)
+            stale_labels = [scan['annotation_path'][position] for position in stale]
+            table = table.replace(stale, PXL_dataset_yolo_ingest(self.max_workers).parse_labels(stale_labels))
+            records['box_count'] = table.counts()
+            records['class_id'] = table.class_id
+            records['boxes'] = table.box_array()
+        return records, changed
+
+    def _read(self):
+        """
+        Private method that reads the manifest file. Returns None when there is no valid manifest.
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if int(data['__version__']) != self.VERSION or str(data['__type__']) != self.dataset_type.value:
+                    return None
+                folders = _decode_strings(data['__folders__'])
+                stored = {'__folders__': [tuple(item.split("/", 1)) for item in folders]}
+                for key, _ in stored['__folders__']:
+                    records = {}
+                    for column in data.files:
+                        if column.startswith(key + "/"):
+                            records[column[len(key) + 1:]] = data[column]
+                    records['name'] = _decode_strings(records['name'])
+                    formats = _decode_strings(records['format'])
+                    records['format'] = formats if len(formats) == len(records['name']) else [""] * len(records['name'])
+                    stored[key] = records
+        except (OSError, ValueError, KeyError):
+            return None
+        return stored
+
+    def _write(self, splits):
+        """
+        Private method that writes the records of every split atomically to the manifest file.
+        """
+        arrays = {
+            '__version__': np.array(self.VERSION),
+            '__type__': np.array(self.dataset_type.value),
+            '__folders__': _encode_strings(["{}/{}".format(key, folder) for key, folder, _ in splits])
+        }
+        for key, _, records in splits:
+            for column, values in records.items():
+                arrays["{}/{}".format(key, column)] = _encode_strings(values) if column in ('name', 'format') else values
+        temporary_path = self.path + ".tmp"
+        try:
+            with open(temporary_path, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            print("!!! The manifest {} could not be saved, the dataset will be scanned again on the next load: {}".format(self.path, error))
+
+
+def _encode_strings(strings):
+    """
+    Private function to pack a list of strings into one uint8 array.
+    """
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_strings(array):
+    """
+    Private function to unpack a list of strings packed with _encode_strings.
+    """
+    text = array.tobytes().decode("utf-8")
+    return text.split("\n") if text else []
+
@@ -5,15 +5,27 @@ import numpy as np
 import os
 import pandas as pd
 import shutil
-from pathlib import Path
+import time
 import tkinter as tk
-import json
 
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_export import PXL_dataset_coco_sink, PXL_dataset_export
+from .pxl_dataset_image_cache import PXL_dataset_image_cache
 from .pxl_dataset_loader import PXL_dataset_loader
+from .pxl_dataset_manifest import PXL_dataset_manifest
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import is_shard_path
+from .pxl_dataset_shards import PXL_dataset_shards
 from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_statistics import box_histograms, class_counts, split_counts
+from .pxl_dataset_tensor_store import PXL_dataset_tensor_store
 from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_writer import PXL_dataset_write_report, write_file_atomic
+from .pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
 from .pxl_datasets import PXL_datasets
 from .pxl_dataset_data_editor import PXL_Dataset_Data_Editor
+from .pxl_value_exception import PXL_value_exception
 
 
 class PXL_object_detection_dataset(PXL_datasets):
@@ -26,149 +38,160 @@ class PXL_object_detection_dataset(PXL_datasets):
         """
         super().__init__()
         self.dataset_type = PXL_dataset_types.Object_Detection
+        self.box_tables: map = {}
     
     def load_from_url(self, loader: PXL_dataset_loader, url: str, save_directory: str):
         """
         Load dataset from a URL using the specified loader.
         """
-        return super().load_from_url(loader, url, save_directory)
+        super().load_from_url(loader, url, save_directory)
+        self._move_objects_into_box_tables(loader.box_tables)
+        return self.df_map
     
-    def load_from_save_dir(self, save_directory: str, loader: PXL_dataset_loader=PXL_dataset_loader()):
+    def load_from_save_dir(self, save_directory: str, loader: PXL_dataset_loader=PXL_dataset_loader(), use_manifest: bool=True, validate_manifest: bool=True):
         """
         Load dataset from a local save directory.
+        With use_manifest the index file in the save directory is used and kept up to date,
+        without validate_manifest the directory is not compared with the index.
+        A sharded save directory is opened through its shard index.
         """
         self.save_directory = save_directory
         self.loader = loader
-        directory = Path(save_directory)
-        df_map = {}
-        for item in directory.iterdir():
-            for split in PXL_dataset_split:
-                if item.is_dir and item.name.startswith(split.value):
-                    directory = Path("{}{}/".format(save_directory, split.name.lower()))
-                    image_paths = []
-                    for image in directory.iterdir():
-                        if image.is_file and image.suffix != ".txt":
-                            image_paths.append("{}{}/{}".format(save_directory, split.name.lower(), image.name))
-                    df = pd.DataFrame({'image': image_paths})
-                    df['objects'] = None
-                    df_map[split.name.lower()] = df
-        for key in df_map.keys():
-            for index, row in df_map.get(key).iterrows():
-                filename = "{}.txt".format(row['image'].split('.')[0])
-                objects = self._load_yolo_txt_file(filename)
-                df_map[key].at[index, 'objects'] = objects
+        if PXL_dataset_shards.is_sharded(save_directory):
+            df_map, box_tables = PXL_dataset_shards(save_directory).load_object_detection()
+        elif use_manifest:
+            df_map, box_tables = PXL_dataset_manifest(save_directory, self.dataset_type).load_object_detection(validate_manifest)
+        else:
+            df_map, box_tables = PXL_dataset_yolo_ingest().load_save_dir(save_directory)
         self.df_map = df_map
+        self.box_tables = box_tables
         return self.df_map
     
-    def load_from_df_map(self, df_map:map, save_directory:str, loader:PXL_dataset_loader=PXL_dataset_loader()):
+    def load_from_df_map(self, df_map:map, save_directory:str, loader:PXL_dataset_loader=PXL_dataset_loader(), box_tables:map=None):
         """
         Load dataset from an existing DataFrame map.
+        The objects are taken from the 'objects' column, or from box_tables with a box table per split when given,
+        or else from the box tables of a loader that ingested the dataset itself.
+        """
+        if box_tables is not None:
+            df_map = {key: df_map[key].assign(objects=[box_tables[key].label_array(index) for index in range(box_tables[key].num_images)])
+                      for key in df_map.keys()}
+        super().load_from_df_map(df_map, save_directory, loader)
+        self.save_directory = save_directory
+        self._move_objects_into_box_tables(box_tables if box_tables is not None else loader.box_tables)
+        return self.df_map
+
+    def save_as_shards(self, save_directory:str, shard_size:int=PXL_dataset_shards.DEFAULT_SHARD_SIZE):
+        """
+        Save the dataset in the packed shard layout, with the boxes stored in the shard index.
+        """
+        return PXL_dataset_shards(save_directory, shard_size).write(self.dataset_type, self.df_map, self.box_tables)
+
+    def export_tensor_store(self, save_directory:str, image_size:tuple, letterbox:bool=True, pad_value:int=114):
+        """
+        Export every split at a fixed image_size into memory mapped arrays, with the boxes rescaled to the stored images.
+        """
+        return PXL_dataset_tensor_store(save_directory).write(self.dataset_type, self.df_map, image_size, letterbox, pad_value, self.box_tables)
+
+    def get_objects(self, split:PXL_dataset_split, index:int):
+        """
+        Return the objects of one image as a list of dicts with 'name' and 'centerNSize' values.
         """
-        return super().load_from_df_map(df_map, save_directory, loader)
+        return self.box_tables[split.name.lower()].objects(index)
     
     def display_random_image(self, split:PXL_dataset_split):
         """
         Display a random image from the specified dataset split.
         """
         df = self.df_map[split.name.lower()]
-        row = df.sample(n=1).iloc[0]
-        self._display_image_with_objects(row['image'], row['objects'])
-
-    def replace_object_files(self, source_directory:str, keep_other_directory:str=None):
-        """
-        Replace object files from source directory, optionally keeping backups.
-        """
-        if(os.path.exists(keep_other_directory)):
-            shutil.rmtree(keep_other_directory)
-        os.mkdir(keep_other_directory)
-        source_directory = Path(source_directory)
-        for source_item in source_directory.iterdir():
-            if source_item.is_file() and source_item.name.endswith(".txt"):
-                for split in PXL_dataset_split:
-                    path_proposal = "{}{}/{}".format(self.save_directory, split.name.lower(), source_item.name)
-                    if(os.path.exists(path_proposal)):
-                        if(keep_other_directory != None):
-                            keep_other_filename = "{}{}".format(keep_other_directory, source_item.name)
-                            shutil.copyfile(source_item, keep_other_filename)
-
-                        os.remove(path_proposal)
-                        shutil.copyfile(source_item, path_proposal)
-        for key in self.df_map.keys():
-            for index, row in self.df_map.get(key).iterrows():
-                filename = "{}.txt".format(row['image'].split('.')[0])
-                objects = self._load_yolo_txt_file(filename)
-                self.df_map[key].at[index, 'objects'] = objects
+        row = df.sample(n=1)
+        boxes = self.box_tables[split.name.lower()].boxes(row.index[0])
+        self._display_image_with_objects(row.iloc[0]['image'], boxes)
+
+    def replace_object_files(self, source_directory:str, keep_other_directory:str=None, max_workers:int=None):
+        """
+        Replace the label files of the dataset with the .txt files of the source directory that have the same name,
+        optionally keeping backups of the replaced files in keep_other_directory, under their own name.
+        The label files are matched through an index of the images of the df_map, compared and written atomically on a
+        thread pool, and only the boxes of the images whose labels changed are reloaded.
+        Returns a PXL_dataset_write_report with the replaced files as written and the identical files as skipped.
+        """
+        if keep_other_directory is not None:
+            if os.path.exists(keep_other_directory):
+                shutil.rmtree(keep_other_directory)
+            os.mkdir(keep_other_directory)
+        index = {}
+        for key, df in self.df_map.items():
+            for position, path in enumerate(df['image'].tolist()):
+                if is_shard_path(path):
+                    raise PXL_value_exception("The object files of a sharded dataset can not be replaced, unpack it first.")
+                label_path = "{}.txt".format(os.path.splitext(path)[0])
+                index.setdefault(os.path.basename(label_path), []).append((key, position, label_path))
+        tasks = []
+        with os.scandir(source_directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    for key, position, label_path in index.get(entry.name, []):
+                        backup_path = None
+                        if keep_other_directory is not None:
+                            backup_path = "{}{}".format(keep_other_directory, entry.name)
+                        tasks.append((key, position, entry.path, label_path, backup_path))
+        report = PXL_dataset_write_report()
+        start = time.perf_counter()
+        changed = {key: [] for key in self.df_map.keys()}
+        for chunk_report, chunk_changed in map_chunks(_replace_label_chunk, chunked(tasks, 256), concurrent.futures.ThreadPoolExecutor, max_workers):
+            report.add(chunk_report)
+            for key, position in chunk_changed:
+                changed[key].append(position)
+        report.seconds = time.perf_counter() - start
+        for key, positions in changed.items():
+            if positions:
+                positions = np.unique(np.array(positions, dtype=np.int64))
+                label_paths = ["{}.txt".format(os.path.splitext(self.df_map[key]['image'].iat[position])[0]) for position in positions.tolist()]
+                self.box_tables[key] = self.box_tables[key].replace(positions, PXL_dataset_box_table.from_yolo_files(label_paths, missing_ok=True))
+        self.last_write_report = report
+        if not report.ok:
+            print("!!! {} object files could not be replaced, see last_write_report for details.".format(len(report.failures)))
+        return report
 
     def manual_improve_data(self, df, save_directory:str, continue_index:int=0):
         """
         Manually improve data using a Tkinter interface.
         """
+        box_table = None
+        if 'objects' not in df.columns:
+            keys = [key for key in self.df_map.keys() if self.df_map[key] is df]
+            if not keys:
+                raise PXL_value_exception("The given dataframe is not a split of this dataset and has no 'objects' column.")
+            box_table = self.box_tables[keys[0]]
         root = tk.Tk()
-        app = PXL_Dataset_Data_Editor(root, df, save_directory, continue_index)
+        app = PXL_Dataset_Data_Editor(root, df, save_directory, continue_index, box_table)
         root.mainloop()
 
-    def export_dataset_in_COCO_format(self, save_directory:str):
+    def export_dataset_in_COCO_format(self, save_directory:str, compact:bool=False, codec:PXL_dataset_codec=None, max_workers:int=None):
+        """
+        Export the dataset in the famous COCO format for training, with the images and a dataset.json per split.
+        By default the images keep their format. With a codec they are transcoded to it on a process pool, images that
+        are already in its format are copied as they are. With compact the JSON is written without any whitespace.
         """
-        Export the dataset in the famous COCO format for training
+        return self.export_dataset(save_directory, (PXL_dataset_coco_sink(save_directory, compact),), compact, max_workers, codec)
+
+    def export_dataset(self, save_directory:str, formats=('yolo', 'coco', 'voc', 'csv'), compact:bool=False, max_workers:int=None, codec:PXL_dataset_codec=None):
         """
+        Export the dataset to several formats in a single pass, each in a subfolder of save_directory named after the format.
+        The formats are 'yolo', 'coco', 'voc', 'csv' and 'parquet', or PXL_dataset_export_sink objects for other formats.
+        Every image is read once and written once, the image folders of the other formats are hard linked to it.
+        With a codec the images are transcoded to its format on a process pool.
+        Returns the PXL_dataset_write_report of the export, also stored as last_write_report.
+        """
+        export = PXL_dataset_export.from_formats(save_directory, formats, compact, max_workers, codec)
         if(os.path.exists(save_directory)):
             shutil.rmtree(save_directory)
-        os.mkdir(save_directory)
-        for split in PXL_dataset_split:
-            if (split.name.lower() in self.df_map.keys()):
-                os.mkdir("{}{}".format(save_directory, split.name.lower()))
-                images = []
-                annotations = []
-                categories = set()
-                annotation_id = 0
-                for index, row in self.df_map[split.name.lower()].iterrows():
-                    filename = row['image'].split("/")[-1].replace(".png", ".jpg")
-                    image = cv2.imread(row['image'])
-                    image_height, image_width = image.shape[:2]
-                    images.append({
-                        "id": index,
-                        "width": image_width,
-                        "height": image_height,
-                        "file_name": filename
-                    })
-                    save_filename = "{}{}/{}".format(save_directory, split.name.lower(), filename)
-                    shutil.copyfile(row['image'], save_filename)
-                    for obj in row['objects']:
-                        class_id = obj.get('name', 0)
-                        values = []
-                        for i in range(1, len(obj["centerNSize"]), 2):
-                            values.append(float(obj["centerNSize"][i-1]) * image_width)
-                            values.append(float(obj["centerNSize"][i]) * image_height)
-                        x_min = int(values[0]-(values[2]/2))
-                        y_min = int(values[1]-(values[3]/2))
-                        w = values[2]
-                        h = values[3]
-                        annotations.append({
-                                "id": annotation_id,
-                                "image_id": index,
-                                "category_id": int(class_id),
-                                "bbox": [x_min, y_min, w, h],
-                                "area": w * h,
-                                "iscrowd": 0,
-                                "segmentation": []
-                        })
-                        annotation_id += 1
-
-                # Convert categories set to list of dicts
-                categories = [{"id": 0, "name": 0}]
-
-                # Prepare the final dictionary to be written as JSON
-                dataset_file = {
-                    "images": images,
-                    "annotations": annotations,
-                    "categories": categories
-                }
-
-                dataset_file_path = "{}{}/dataset.json".format(save_directory, split.name.lower())
-                # Write the COCO data to a JSON file
-                with open(dataset_file_path, 'w') as json_file:
-                    json.dump(dataset_file, json_file, indent=4)
-
+        os.makedirs(save_directory)
+        self.last_write_report = export.run(self.df_map, self.box_tables)
+        if not self.last_write_report.ok:
+            print("!!! {} images could not be exported, see last_write_report for details.".format(len(self.last_write_report.failures)))
+        return self.last_write_report
 
     def print_dataset_information(self):
         """
@@ -176,54 +199,114 @@ class PXL_object_detection_dataset(PXL_datasets):
         """
         super().print_dataset_information()
         print("Number of objects per split:")
-        for split in PXL_dataset_split:
-            print("\t{}:".format(split.name))
-            total_objects = 0
-            for index, row in self.df_map[split.name.lower()].iterrows():
-                total_objects += len(row["objects"])
-            print("\t\t{}".format(total_objects))
-        
-
-    def _load_yolo_txt_file(self, filepath):
-        """
-        Private function to load annotations from a YOLO format text file.
-        """
-        with open(filepath, 'r') as file:
-            boxes = []
-            lines = file.readlines()
-            for line in lines:
-                split_line = line.strip().split(" ")
-                box_class = split_line.pop(0)
-                poly = []
-                if len(split_line) > 4:
-                    for i in range(1, len(split_line), 2):
-                        poly.append([split_line[i-1], split_line[i]])
-                    boxes.append({"name": box_class, "poly": poly})
-                else:
-                    boxes.append({"name": box_class, "centerNSize": split_line})
-        return boxes
-    
-    def _display_image_with_objects(self, path, objects):
+        for key, table in self.box_tables.items():
+            print("\t{}:".format(key))
+            print("\t\t{}".format(len(table)))
+
+    def statistics(self, resolutions:bool=False, max_workers:int=None, bins:int=20):
+        """
+        Return the statistics of the dataset with the objects per split, the boxes per class and split,
+        and histograms with bins bins of the box sizes and aspect ratios, all computed from the box tables.
+        """
+        statistics = super().statistics(resolutions, max_workers)
+        statistics.splits = split_counts(self.df_map, self.box_tables)
+        statistics.classes = class_counts(self.box_tables)
+        statistics.box_sizes, statistics.aspect_ratios = box_histograms(self.box_tables, bins)
+        return statistics
+
+    def _display_image_with_objects(self, path, boxes):
         """
         Private function to display an image with annotated objects overlayed.
+        The boxes are an (n, 4) array of normalised cx, cy, w, h values. The image is taken from the shared decoded-image cache.
         """
-        image = cv2.imread(path)
-        image_height, image_width = image.shape[:2]
-        plt_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        for obj in objects:
-            values = []
-            for i in range(1, len(obj["centerNSize"]), 2):
-                values.append(float(obj["centerNSize"][i-1]) * image_width)
-                values.append(float(obj["centerNSize"][i]) * image_height)
-            tl = [int(values[0]-(values[2]/2)), int(values[1]-(values[3]/2))]
-            tr = [int(values[0]+(values[2]/2)), int(values[1]-(values[3]/2))]
-            bl = [int(values[0]-(values[2]/2)), int(values[1]+(values[3]/2))]
-            br = [int(values[0]+(values[2]/2)), int(values[1]+(values[3]/2))]
-            rectangle = [tl, tr, br, bl]
-            points = np.array([rectangle], np.int32)
-            plt_image = cv2.polylines(plt_image, [points], isClosed=True, color=(255,255,0), thickness=int(image_width/200.0))
+        plt_image = PXL_dataset_image_cache.shared().get(path).copy()
+        image_height, image_width = plt_image.shape[:2]
+        boxes = boxes * np.array([image_width, image_height, image_width, image_height], dtype=np.float32)
+        left = (boxes[:, 0] - boxes[:, 2] / 2).astype(np.int32)
+        right = (boxes[:, 0] + boxes[:, 2] / 2).astype(np.int32)
+        top = (boxes[:, 1] - boxes[:, 3] / 2).astype(np.int32)
+        bottom = (boxes[:, 1] + boxes[:, 3] / 2).astype(np.int32)
+        rectangles = np.stack((np.stack((left, top), axis=1), np.stack((right, top), axis=1),
+                               np.stack((right, bottom), axis=1), np.stack((left, bottom), axis=1)), axis=1)
+        if len(rectangles):
+            plt_image = cv2.polylines(plt_image, list(rectangles), isClosed=True, color=(255,255,0), thickness=int(image_width/200.0))
         plt.figure(figsize=(10, 10))
         plt.imshow(plt_image)
         plt.axis('off')
         plt.title(path)
         plt.show()
+
+    def _move_objects_into_box_tables(self, box_tables:map=None):
+        """
+        Private function to convert the 'objects' column of every split into a box table and drop the column.
+        When box tables are given they are used as they are.
+        """
+        for key in self.df_map.keys():
+            df = self.df_map[key].reset_index(drop=True)
+            if box_tables is not None:
+                self.box_tables[key] = box_tables[key]
+            elif 'objects' in df.columns:
+                self.box_tables[key] = PXL_dataset_box_table.from_objects(df['objects'].tolist())
+            elif key not in self.box_tables:
+                self.box_tables[key] = PXL_dataset_box_table.empty(len(df))
+            if 'objects' in df.columns:
+                df = df.drop(columns='objects')
+            self.df_map[key] = df
+
+    def _remove_rows(self, key:str, positions):
+        """
+        Private method that drops rows from a split together with their boxes.
+        """
+        keep = np.ones(len(self.df_map[key]), dtype=bool)
+        keep[positions] = False
+        super()._remove_rows(key, positions)
+        if key in self.box_tables:
+            self.box_tables[key] = self.box_tables[key].select(np.flatnonzero(keep))
+
+    def _collate_batch(self, key:str, positions, samples):
+        """
+        Private method that stacks the images of a batch for iter_batches and pads the boxes to the largest number of boxes in the batch.
+        The padded boxes are zeros with class id -1, num_boxes holds the real number of boxes of every image.
+        """
+        batch_table = self.box_tables[key].select(positions)
+        counts = batch_table.counts()
+        max_boxes = int(counts.max()) if len(counts) else 0
+        boxes = np.zeros((len(positions), max_boxes, 4), dtype=np.float32)
+        class_ids = np.full((len(positions), max_boxes), -1, dtype=np.int32)
+        image_ids = batch_table.image_ids()
+        slots = np.arange(len(batch_table)) - batch_table.offsets[image_ids]
+        boxes[image_ids, slots] = batch_table.box_array()
+        class_ids[image_ids, slots] = batch_table.class_id
+        batch = super()._collate_batch(key, positions, samples)
+        batch.update({'boxes': boxes, 'class_ids': class_ids, 'num_boxes': counts.astype(np.int32)})
+        return batch
+
+
+def _replace_label_chunk(tasks):
+    """
+    Private function that replaces a chunk of label files on a worker thread. A label file is only backed up and
+    written when its content differs from the source file. Returns the report and the (key, position) of the changed labels.
+    """
+    report = PXL_dataset_write_report()
+    changed = []
+    for key, position, source_path, label_path, backup_path in tasks:
+        try:
+            with open(source_path, 'rb') as file:
+                data = file.read()
+            try:
+                with open(label_path, 'rb') as file:
+                    current = file.read()
+            except FileNotFoundError:
+                current = None
+            if current == data:
+                report.skipped += 1
+                continue
+            if backup_path is not None and current is not None:
+                write_file_atomic(backup_path, current)
+            write_file_atomic(label_path, data)
+            report.written += 1
+            report.bytes_written += len(data)
+            changed.append((key, position))
+        except OSError as error:
+            report.failures.append((label_path, "{}: {}".format(type(error).__name__, error)))
+    return report, changed
@@ -0,0 +1,72 @@
+import collections
+import concurrent.futures
+import os
+from itertools import islice
+
+
+def default_worker_count():
+    """
+    Number of workers used when no explicit count is given.
+    """
+    return os.cpu_count() or 1
+
+
+def chunked(items, chunk_size: int):
+    """
+    Split an iterable into lists of at most chunk_size items.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_chunks(function, chunks, executor_class=concurrent.futures.ProcessPoolExecutor, max_workers: int = None, max_in_flight: int = None, executor=None):
+    """
+    Apply a function to every chunk on a worker pool and yield the results in the order of the chunks.
+    At most max_in_flight chunks are submitted at once, so the input is consumed lazily.
+    A single chunk is handled in the calling process to avoid the cost of starting a pool.
+    When an executor is given it is used instead of a new pool of executor_class and it is not shut down.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None:
+        yield function(first)
+        return
+    max_workers = max_workers or default_worker_count()
+    max_in_flight = max_in_flight or max_workers * 2
+    if executor is None:
+        with executor_class(max_workers=max_workers) as executor:
+            for result in _map_bounded(executor, function, _prepend((first, second), chunks), max_in_flight):
+                yield result
+    else:
+        for result in _map_bounded(executor, function, _prepend((first, second), chunks), max_in_flight):
+            yield result
+
+
+def _map_bounded(executor, function, chunks, max_in_flight: int):
+    """
+    Private function that submits chunks to an executor with at most max_in_flight pending and yields the results in order.
+    """
+    pending = collections.deque()
+    for chunk in chunks:
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, chunk))
+    while pending:
+        yield pending.popleft().result()
+
+
+def _prepend(items, iterator):
+    """
+    Private function to yield some already consumed items before the rest of an iterator.
+    """
+    for item in items:
+        yield item
+    for item in iterator:
+        yield item
@@ -1,10 +1,20 @@
 from .pxl_datasets import PXL_datasets
+from .pxl_dataset_batches import read_image, read_mask, stack_arrays
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_image_cache import PXL_dataset_image_cache
+from .pxl_dataset_parallel import chunked, map_chunks
 from .pxl_dataset_types import PXL_dataset_types
 from .pxl_dataset_loader import PXL_dataset_loader
+from .pxl_dataset_manifest import PXL_dataset_manifest
+from .pxl_dataset_shard_reader import imread
+from .pxl_dataset_shards import PXL_dataset_shards
 from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_statistics import mask_coverage
 from .pxl_dataset_object_detection import PXL_object_detection_dataset
 
 from pathlib import Path
+import concurrent.futures
+import numpy as np
 import pandas as pd
 import cv2
 import matplotlib.pyplot as plt
@@ -24,11 +34,20 @@ class PXL_segmentation_dataset(PXL_datasets):
         """
         return super().load_from_url(loader, url, save_directory)
     
-    def load_from_save_dir(self, save_directory: str):
+    def load_from_save_dir(self, save_directory: str, use_manifest: bool=True, validate_manifest: bool=True):
         """
         Loads dataset from a specified directory.
+        With use_manifest the index file in the save directory is used and kept up to date,
+        without validate_manifest the directory is not compared with the index.
+        A sharded save directory is opened through its shard index.
         """
         self.save_directory = save_directory
+        if PXL_dataset_shards.is_sharded(save_directory):
+            self.df_map = PXL_dataset_shards(save_directory).load_segmentation()
+            return self.df_map
+        if use_manifest:
+            self.df_map = PXL_dataset_manifest(save_directory, self.dataset_type).load_segmentation(validate_manifest)
+            return self.df_map
         directory = Path(save_directory)
         df_map = {}
         for item in directory.iterdir():
@@ -40,7 +59,7 @@ class PXL_segmentation_dataset(PXL_datasets):
                     for image in image_directory.iterdir():
                         if image.is_file:
                             image_paths.append("{}{}/image/{}".format(save_directory, split.name.lower(), image.name))
-                            segmented_image_paths.append("{}{}/segmented/{}".format(save_directory, split.name.lower(), image.name))
+                            segmented_image_paths.append("{}{}/segmented/{}.png".format(save_directory, split.name.lower(), image.stem))
                     df = pd.DataFrame({'image': image_paths, 'segmentation_image': segmented_image_paths})
                     df_map[split.name.lower()] = df
         self.df_map = df_map
@@ -59,16 +78,26 @@ class PXL_segmentation_dataset(PXL_datasets):
         """
         super().print_dataset_information()
     
+    def statistics(self, resolutions:bool=False, max_workers:int=None, masks:bool=False):
+        """
+        Return the statistics of the dataset. With masks every mask is decoded to add the share of the pixels
+        and the number of masks of every mask value per split.
+        """
+        statistics = super().statistics(resolutions, max_workers)
+        if masks:
+            statistics.mask_coverage = mask_coverage(self.df_map, max_workers)
+        return statistics
+
     def display_random_image(self, split:PXL_dataset_split):
         """
         Displays a random image and its corresponding segmentation from a given dataset split.
+        The images are taken from the shared decoded-image cache.
         """
         df = self.df_map[split.name.lower()]
         row = df.sample(n=1).iloc[0]
-        image = cv2.imread(row['image'])
-        segmented_image = cv2.imread(row['segmentation_image'])
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        segmented_image = cv2.cvtColor(segmented_image, cv2.COLOR_BGR2RGB)
+        cache = PXL_dataset_image_cache.shared()
+        image = cache.get(row['image'])
+        segmented_image = cache.get(row['segmentation_image'])
         plt.figure(figsize=(20, 10))
         plt.subplot(1, 2, 1)
         plt.imshow(image)
@@ -77,49 +106,110 @@ class PXL_segmentation_dataset(PXL_datasets):
         plt.imshow(segmented_image)
         plt.axis('off')
 
-    def convert_to_object_detection_dataset(self, save_directory:str, loader:PXL_dataset_loader=PXL_dataset_loader()):
+    def convert_to_object_detection_dataset(self, save_directory:str, loader:PXL_dataset_loader=PXL_dataset_loader(), max_workers:int=None, chunk_size:int=256):
         """
         Converts a segmentation dataset into an object detection dataset by computing bounding boxes
-        from the segmentation masks.
+        from the segmentation masks. The masks are processed in chunks on a process pool and every
+        connected region of a mask value becomes a box, with the mask values mapped to class ids 0..n.
         """
         print("Converting images into bounding boxes...")
+        df_map = {}
+        box_tables = {}
         for key in self.df_map.keys():
-            all_boxes = []
-            for index, row in self.df_map.get(key).iterrows():
-                segmented_image = row['segmentation_image']
-                boxes = self._get_boundingboxes_from_segmentation(segmented_image)
-                all_boxes.append(boxes)
-            self.df_map[key]['objects'] = pd.Series(all_boxes, index=self.df_map[key].index)
-            self.df_map[key].drop('segmentation_image', axis=1)
+            counts = []
+            labels = []
+            boxes = []
+            chunks = chunked(self.df_map[key]['segmentation_image'].tolist(), chunk_size)
+            for chunk_counts, chunk_labels, chunk_boxes in map_chunks(_extract_boxes_from_mask_chunk, chunks, concurrent.futures.ProcessPoolExecutor, max_workers):
+                counts.append(chunk_counts)
+                labels.append(chunk_labels)
+                boxes.append(chunk_boxes)
+            df_map[key] = self.df_map[key].drop(columns='segmentation_image').reset_index(drop=True)
+            if counts:
+                box_tables[key] = PXL_dataset_box_table.from_arrays(np.concatenate(counts), np.concatenate(labels), np.concatenate(boxes))
+            else:
+                box_tables[key] = PXL_dataset_box_table.empty(0)
+        mask_values = np.unique(np.concatenate([table.class_id for table in box_tables.values()] or [np.empty(0, dtype=np.int32)]))
+        for table in box_tables.values():
+            table.class_id = np.searchsorted(mask_values, table.class_id).astype(np.int32)
 
         new_dataset = PXL_object_detection_dataset()
-        new_dataset.load_from_df_map(self.df_map, save_directory, loader)
+        new_dataset.load_from_df_map(df_map, save_directory, loader, box_tables)
         return new_dataset
 
 
+    def _read_batch_sample(self, key:str, position:int, image_size:tuple=None):
+        """
+        Private method that reads the image and mask at a position of a split for iter_batches. Runs on a worker thread.
+        """
+        row = self.df_map[key].iloc[position]
+        return read_image(row['image'], image_size), read_mask(row['segmentation_image'], image_size)
+
+    def _collate_batch(self, key:str, positions, samples):
+        """
+        Private method that stacks the images and the masks of a batch for iter_batches.
+        """
+        return {'images': stack_arrays([image for image, _ in samples]),
+                'masks': stack_arrays([mask for _, mask in samples], "masks"),
+                'positions': positions}
+
     def _get_boundingboxes_from_segmentation(self, path:str):
         """
         Private method to extract bounding boxes from a segmented image.
         """
-        if not cv2.cuda.getCudaEnabledDeviceCount():
-            image = cv2.imread(path)
-            image_height, image_width = image.shape[:2]
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            _, binary_image = cv2.threshold(gray_image, 1, 255, cv2.THRESH_BINARY)
-        else: # not yet integrated in the normal opencv installation version but can already be compiled
-            gpu = cv2.cuda_GpuMat()
-            image = cv2.imread(path)
-            gpu.upload(image)
-            gpu = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGR2GRAY)
-            _, gpu = cv2.cuda.threshold(gpu, 1, 255, cv2.THRESH_BINARY)
-            binary_image = gpu.download()
-        contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        boxes = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            x = (float(x) + (float(w)/2)) / image_width
-            y = float(y + (float(h)/2)) / image_height
-            w = float(w) / image_width
-            h = float(h) / image_height
-            boxes.append({"centerNSize": [x, y, w, h]})
-        return boxes
+        _, boxes = _extract_boxes_from_mask(path)
+        return [{"centerNSize": box} for box in boxes.tolist()]
+
+
+def _extract_boxes_from_mask(path:str):
+    """
+    Private function to extract the boxes of one mask. The mask is decoded as a single channel image
+    and every connected region of a nonzero mask value becomes a box labelled with that value.
+    The nonzero pixels are labelled once, and the value of a region is read from its pixels. Only regions in which
+    different values touch are labelled again per value, inside their bounding box.
+    Returns the mask values and an (n, 4) array of normalised cx, cy, w, h.
+    """
+    mask = imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise FileNotFoundError("Segmentation image {} could not be read.".format(path))
+    image_height, image_width = mask.shape[:2]
+    num_components, components, component_stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if num_components <= 1:
+        return np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.float32)
+    flat_components = components.ravel()
+    flat_mask = mask.ravel()
+    areas = component_stats[:, 4]
+    values = np.rint(np.bincount(flat_components, weights=flat_mask, minlength=num_components) / np.maximum(areas, 1)).astype(np.int32)
+    uniform = np.bincount(flat_components, weights=flat_mask == values[flat_components], minlength=num_components) == areas
+    labels = [values[1:][uniform[1:]]]
+    stats = [component_stats[1:, :4][uniform[1:]]]
+    for component in np.flatnonzero(~uniform):
+        x, y, width, height = component_stats[component, :4]
+        region = np.where(components[y:y + height, x:x + width] == component, mask[y:y + height, x:x + width], 0)
+        for value in np.unique(region[region > 0]):
+            num_parts, _, part_stats, _ = cv2.connectedComponentsWithStats((region == value).view(np.uint8), connectivity=8)
+            stats.append(part_stats[1:num_parts, :4] + np.array([x, y, 0, 0]))
+            labels.append(np.full(num_parts - 1, value, dtype=np.int32))
+    labels = np.concatenate(labels)
+    order = np.argsort(labels, kind='stable')
+    stats = np.concatenate(stats)[order].astype(np.float32)
+    size = np.array([image_width, image_height], dtype=np.float32)
+    centers = (stats[:, :2] + stats[:, 2:] / 2) / size
+    return labels[order], np.concatenate((centers, stats[:, 2:] / size), axis=1)
+
+
+def _extract_boxes_from_mask_chunk(paths):
+    """
+    Private function to extract the boxes of a chunk of masks. Used as a worker task, so it only returns plain arrays.
+    """
+    counts = np.zeros(len(paths), dtype=np.int64)
+    labels = []
+    boxes = []
+    for index, path in enumerate(paths):
+        mask_labels, mask_boxes = _extract_boxes_from_mask(path)
+        counts[index] = len(mask_labels)
+        labels.append(mask_labels)
+        boxes.append(mask_boxes)
+    if not labels:
+        return counts, np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.float32)
+    return counts, np.concatenate(labels), np.concatenate(boxes)
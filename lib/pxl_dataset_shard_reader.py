@@ -0,0 +1,105 @@
+import mmap
+import os
+import re
+import threading
+
+import cv2
+import numpy as np
+
+
+SHARD_EXTENSION = ".pxs"
+SHARD_PATH_PATTERN = re.compile(r"^(.*\.pxs):(\d+):(\d+)/([^/]*)$")
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def shard_path(shard_file: str, offset: int, length: int, name: str):
+    """
+    Return the path of a file that is packed in a shard, in the form {shard_file}:{offset}:{length}/{name}.
+    The last part of the path is the original file name, so code that names files after the image keeps working.
+    """
+    return "{}:{}:{}/{}".format(shard_file, offset, length, name)
+
+
+def is_shard_path(path: str):
+    """
+    True when the path points to a file packed in a shard.
+    """
+    return isinstance(path, str) and SHARD_EXTENSION + ":" in path and SHARD_PATH_PATTERN.match(path) is not None
+
+
+def parse_shard_path(path: str):
+    """
+    Return the shard file, offset, length and name of a shard path.
+    """
+    match = SHARD_PATH_PATTERN.match(path)
+    if match is None:
+        raise ValueError("{} is not a shard path.".format(path))
+    return match.group(1), int(match.group(2)), int(match.group(3)), match.group(4)
+
+
+def read_file_bytes(path: str, max_length: int = None):
+    """
+    Return the bytes of a normal file or of a file packed in a shard, at most max_length bytes when given.
+    Shards are read through a memory map that is shared by all threads.
+    """
+    if not is_shard_path(path):
+        with open(path, 'rb') as file:
+            return file.read() if max_length is None else file.read(max_length)
+    shard_file, offset, length, _ = parse_shard_path(path)
+    if max_length is not None:
+        length = min(length, max_length)
+    return _get_map(shard_file)[offset:offset + length]
+
+
+def file_stat_key(path: str):
+    """
+    Return a key that changes when the file, or the shard of a packed file, changes. Raises an OSError for missing files.
+    """
+    if is_shard_path(path):
+        shard_file, offset, length, _ = parse_shard_path(path)
+        stat = os.stat(shard_file)
+        return (offset, length, stat.st_mtime_ns)
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def imread(path: str, flags: int = cv2.IMREAD_COLOR):
+    """
+    cv2.imread that also reads images packed in a shard. Returns None when the image can not be read.
+    """
+    if not is_shard_path(path):
+        return cv2.imread(path, flags)
+    try:
+        data = read_file_bytes(path)
+    except (OSError, ValueError):
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def close_maps():
+    """
+    Close all memory maps of shard files.
+    """
+    with _maps_lock:
+        for shard_map, _ in _maps.values():
+            if isinstance(shard_map, mmap.mmap):
+                shard_map.close()
+        _maps.clear()
+
+
+def _get_map(shard_file: str):
+    """
+    Private function that returns the memory map of a shard file, mapping it again when the file has grown.
+    The old map is not closed, as other threads may still read from it; it is released when it is no longer used.
+    """
+    size = os.path.getsize(shard_file)
+    with _maps_lock:
+        entry = _maps.get(shard_file)
+        if entry is not None and entry[1] == size:
+            return entry[0]
+        with open(shard_file, 'rb') as file:
+            shard_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        _maps[shard_file] = (shard_map, size)
+        return shard_map
@@ -0,0 +1,330 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_image_probe import PXL_dataset_image_probe
+from .pxl_dataset_manifest import _decode_strings, _encode_strings
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import SHARD_EXTENSION, read_file_bytes, shard_path
+from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_view import PXL_dataset_view
+from .pxl_dataset_writer import PXL_dataset_writer, PXL_dataset_write_report
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_shards(object):
+    """
+    Packed storage of a dataset: the image (and mask) files of every split are appended to a few large shard files
+    in {save_directory}{split}/shard-00000.pxs, and one index file holds per sample the shard, offset and length of
+    every packed file, the image metadata and the annotations (boxes for object detection, labels for classification).
+    Shard files are only ever appended to. Packed files are read through memory maps and are referred to with
+    shard paths ({shard_file}:{offset}:{length}/{name}), which every reader of the library understands.
+    """
+    INDEX_FILENAME = "pxl_shards.npz"
+    VERSION = 1
+    DEFAULT_SHARD_SIZE = 2**30
+
+    def __init__(self, save_directory: str, shard_size: int = DEFAULT_SHARD_SIZE, max_workers: int = None, chunk_size: int = 256):
+        """
+        Initialize the shard storage of a save directory with the maximum size in bytes of one shard file.
+        """
+        self.save_directory = save_directory
+        self.shard_size = shard_size
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.index_path = os.path.join(save_directory, self.INDEX_FILENAME)
+
+    @classmethod
+    def is_sharded(cls, save_directory: str):
+        """
+        True when the save directory holds a sharded dataset.
+        """
+        return os.path.isfile(os.path.join(save_directory, cls.INDEX_FILENAME))
+
+    def write(self, dataset_type: PXL_dataset_types, df_map: map, box_tables: map = None):
+        """
+        Append the rows of a df_map to the shards. Images are read on a thread pool and appended in order to the last shard
+        of their split, a new shard is started when it would exceed the shard size. Returns a PXL_dataset_write_report.
+        Rows with a file that cannot be read are left out and their files are listed in the failures of the report.
+        For object detection the boxes are taken from box_tables, or from the 'objects' column of the splits.
+        """
+        stored = self._read()
+        if stored is not None and stored['__type__'] != dataset_type.value:
+            raise PXL_value_exception("The shards in {} hold a {} dataset.".format(self.save_directory, stored['__type__']))
+        splits = stored['__splits__'] if stored is not None else []
+        report = PXL_dataset_write_report()
+        for key, df in df_map.items():
+            df = df.reset_index(drop=True)
+            os.makedirs("{}{}/".format(self.save_directory, key), exist_ok=True)
+            records = {}
+            readable = np.ones(len(df), dtype=bool)
+            for column, prefix in self._file_columns(dataset_type):
+                shards, offsets, lengths = self._append_files(key, df[column].tolist(), report)
+                records[prefix + '_shard'] = shards
+                records[prefix + '_offset'] = offsets
+                records[prefix + '_length'] = lengths
+                readable &= lengths >= 0
+            if not readable.all():
+                rows = np.flatnonzero(readable)
+                records = {column: values[rows] for column, values in records.items()}
+                if box_tables is not None and key in box_tables:
+                    box_tables = {**box_tables, key: box_tables[key].select(rows)}
+                df = df.iloc[rows].reset_index(drop=True)
+            records['name'] = [path.split("/")[-1] for path in df['image']]
+            metadata = PXL_dataset_image_probe(self.max_workers).probe_all(df['image'].tolist())
+            records['width'] = np.array([item['width'] for item in metadata], dtype=np.int32)
+            records['height'] = np.array([item['height'] for item in metadata], dtype=np.int32)
+            records['channels'] = np.array([item['channels'] for item in metadata], dtype=np.int8)
+            records['format'] = [item['format'] or "" for item in metadata]
+            if dataset_type == PXL_dataset_types.Object_Detection:
+                if box_tables is not None and key in box_tables:
+                    table = box_tables[key]
+                elif 'objects' in df.columns:
+                    table = PXL_dataset_box_table.from_objects(df['objects'].tolist())
+                else:
+                    table = PXL_dataset_box_table.empty(len(df))
+                records['box_count'] = table.counts()
+                records['class_id'] = table.class_id
+                records['boxes'] = table.box_array()
+            elif dataset_type == PXL_dataset_types.Classification:
+                if 'label' in df.columns:
+                    records['label'] = [str(label) for label in df['label']]
+                else:
+                    records['label'] = [path.split("/")[-2] for path in df['image']]
+            if stored is not None and key in stored:
+                records = _concatenate_records(stored[key], records)
+            else:
+                splits = splits + [key]
+            if stored is None:
+                stored = {'__type__': dataset_type.value, '__splits__': splits}
+            stored['__splits__'] = splits
+            stored[key] = records
+        if stored is not None:
+            self._write(stored)
+        return report
+
+    def pack(self, source_directory: str, dataset_type: PXL_dataset_types):
+        """
+        Convert a dataset saved in the directory layout into the sharded layout of this save directory.
+        """
+        view = PXL_dataset_view(source_directory, dataset_type, self.max_workers)
+        box_tables = view.box_tables() if dataset_type == PXL_dataset_types.Object_Detection else None
+        return self.write(dataset_type, view.to_df_map(), box_tables)
+
+    def unpack(self, target_directory: str):
+        """
+        Convert the sharded dataset into the directory layout in target_directory, with one file per image, mask and label file.
+        Returns a PXL_dataset_write_report.
+        """
+        stored = self._read_required()
+        dataset_type = PXL_dataset_types(stored['__type__'])
+        df_map, box_tables = self._load(stored)
+        report = PXL_dataset_write_report()
+        with PXL_dataset_writer(self.max_workers) as writer:
+            for key, df in df_map.items():
+                split_directory = "{}{}/".format(target_directory, key)
+                names = [path.split("/")[-1] for path in df['image']]
+                tasks = []
+                if dataset_type == PXL_dataset_types.Segmentation:
+                    for folder in ("image/", "segmented/"):
+                        os.makedirs(split_directory + folder, exist_ok=True)
+                    tasks.extend(("copy", source, split_directory + "image/" + name) for source, name in zip(df['image'], names))
+                    tasks.extend(("copy", source, split_directory + "segmented/" + os.path.splitext(name)[0] + ".png") for source, name in zip(df['segmentation_image'], names))
+                elif dataset_type == PXL_dataset_types.Classification:
+                    for label in set(df['label']):
+                        os.makedirs("{}{}/".format(split_directory, label), exist_ok=True)
+                    tasks.extend(("copy", source, "{}{}/{}".format(split_directory, label, name)) for source, label, name in zip(df['image'], df['label'], names))
+                else:
+                    os.makedirs(split_directory, exist_ok=True)
+                    tasks.extend(("copy", source, split_directory + name) for source, name in zip(df['image'], names))
+                    tasks.extend(("yolo", box_tables[key].label_array(index), split_directory + os.path.splitext(name)[0] + ".txt") for index, name in enumerate(names))
+                report.add(writer.run(tasks))
+        return report
+
+    def load_object_detection(self):
+        """
+        Load the sharded object detection dataset. Returns the df_map, with shard paths and image metadata, and the box tables.
+        """
+        return self._load(self._read_required(PXL_dataset_types.Object_Detection))
+
+    def load_segmentation(self):
+        """
+        Load the sharded segmentation dataset. Returns the df_map with shard paths and image metadata.
+        """
+        return self._load(self._read_required(PXL_dataset_types.Segmentation))[0]
+
+    def load_classification(self):
+        """
+        Load the sharded classification dataset. Returns the df_map with shard paths, labels and image metadata.
+        """
+        return self._load(self._read_required(PXL_dataset_types.Classification))[0]
+
+    def _file_columns(self, dataset_type: PXL_dataset_types):
+        """
+        Private method that returns the df_map columns with files to pack and their prefix in the index.
+        """
+        if dataset_type == PXL_dataset_types.Segmentation:
+            return [('image', 'image'), ('segmentation_image', 'mask')]
+        return [('image', 'image')]
+
+    def _shard_file(self, key: str, shard: int):
+        """
+        Private method that returns the path of a shard file of a split.
+        """
+        return "{}{}/shard-{:05d}{}".format(self.save_directory, key, shard, SHARD_EXTENSION)
+
+    def _last_shard(self, key: str):
+        """
+        Private method that returns the number of the last shard file of a split, 0 when there is none yet.
+        """
+        with os.scandir("{}{}/".format(self.save_directory, key)) as entries:
+            shards = [int(entry.name[6:-len(SHARD_EXTENSION)]) for entry in entries
+                      if entry.name.startswith("shard-") and entry.name.endswith(SHARD_EXTENSION)]
+        return max(shards, default=0)
+
+    def _append_files(self, key: str, paths, report: PXL_dataset_write_report):
+        """
+        Private method that appends files to the last shard of a split and returns their shard numbers, offsets and lengths.
+        Files that cannot be read are added to the failures of the report and get a length of -1.
+        """
+        shard = self._last_shard(key)
+        shards = np.zeros(len(paths), dtype=np.int32)
+        offsets = np.zeros(len(paths), dtype=np.int64)
+        lengths = np.zeros(len(paths), dtype=np.int64)
+        shard_file = open(self._shard_file(key, shard), 'ab')
+        try:
+            position = 0
+            for chunk in map_chunks(_read_files_chunk, chunked(paths, self.chunk_size), concurrent.futures.ThreadPoolExecutor, self.max_workers):
+                for path, data in chunk:
+                    if isinstance(data, OSError):
+                        report.failures.append((path, "{}: {}".format(type(data).__name__, data)))
+                        lengths[position] = -1
+                        position += 1
+                        continue
+                    offset = shard_file.tell()
+                    if offset > 0 and offset + len(data) > self.shard_size:
+                        shard_file.close()
+                        shard += 1
+                        shard_file = open(self._shard_file(key, shard), 'ab')
+                        offset = shard_file.tell()
+                    shard_file.write(data)
+                    shards[position] = shard
+                    offsets[position] = offset
+                    lengths[position] = len(data)
+                    report.written += 1
+                    report.bytes_written += len(data)
+                    position += 1
+        finally:
+            shard_file.close()
+        return shards, offsets, lengths
+
+    def _load(self, stored):
+        """
+        Private method that builds the df_map and box tables from the index.
+        """
+        dataset_type = PXL_dataset_types(stored['__type__'])
+        df_map = {}
+        box_tables = {}
+        for key in stored['__splits__']:
+            records = stored[key]
+            data = {}
+            for column, prefix in self._file_columns(dataset_type):
+                shard_files = [self._shard_file(key, shard) for shard in range(int(np.max(records[prefix + '_shard'], initial=0)) + 1)]
+                data[column] = [shard_path(shard_files[shard], offset, length, name) for shard, offset, length, name in zip(
+                    records[prefix + '_shard'].tolist(), records[prefix + '_offset'].tolist(), records[prefix + '_length'].tolist(), records['name'])]
+            if dataset_type == PXL_dataset_types.Classification:
+                data['label'] = records['label']
+            data['width'] = records['width']
+            data['height'] = records['height']
+            data['channels'] = records['channels']
+            data['format'] = [value or None for value in records['format']]
+            df_map[key] = pd.DataFrame(data)
+            if dataset_type == PXL_dataset_types.Object_Detection:
+                box_tables[key] = PXL_dataset_box_table.from_arrays(records['box_count'], records['class_id'], records['boxes'])
+        return df_map, box_tables
+
+    def _read_required(self, dataset_type: PXL_dataset_types = None):
+        """
+        Private method that reads the index and raises a PXL_value_exception when there is none or it holds another dataset type.
+        """
+        stored = self._read()
+        if stored is None:
+            raise PXL_value_exception("There is no sharded dataset in {}.".format(self.save_directory))
+        if dataset_type is not None and stored['__type__'] != dataset_type.value:
+            raise PXL_value_exception("The shards in {} hold a {} dataset.".format(self.save_directory, stored['__type__']))
+        return stored
+
+    def _read(self):
+        """
+        Private method that reads the index file. Returns None when there is no valid index.
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                if int(data['__version__']) != self.VERSION:
+                    return None
+                stored = {'__type__': str(data['__type__']), '__splits__': _decode_strings(data['__splits__'])}
+                for key in stored['__splits__']:
+                    records = {}
+                    for column in data.files:
+                        if column.startswith(key + "/"):
+                            records[column[len(key) + 1:]] = data[column]
+                    for column in ('name', 'format', 'label'):
+                        if column in records:
+                            records[column] = _decode_strings(records[column])
+                    records['format'] = records['format'] if len(records['format']) == len(records['name']) else [""] * len(records['name'])
+                    stored[key] = records
+        except (OSError, ValueError, KeyError):
+            return None
+        return stored
+
+    def _write(self, stored):
+        """
+        Private method that writes the index atomically.
+        """
+        arrays = {
+            '__version__': np.array(self.VERSION),
+            '__type__': np.array(stored['__type__']),
+            '__splits__': _encode_strings(stored['__splits__'])
+        }
+        for key in stored['__splits__']:
+            for column, values in stored[key].items():
+                arrays["{}/{}".format(key, column)] = _encode_strings(values) if column in ('name', 'format', 'label') else values
+        os.makedirs(self.save_directory, exist_ok=True)
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_path, self.index_path)
+
+
+def _read_files_chunk(paths):
+    """
+    Private function that reads the bytes of a chunk of files and returns (path, bytes) pairs, with the error
+    in place of the bytes for the files that cannot be read. Used as a worker task.
+    """
+    chunk = []
+    for path in paths:
+        try:
+            chunk.append((path, read_file_bytes(path)))
+        except OSError as error:
+            chunk.append((path, error))
+    return chunk
+
+
+def _concatenate_records(old_records: map, new_records: map):
+    """
+    Private function that appends the records of new rows to the records of a split.
+    """
+    records = {}
+    for column, values in new_records.items():
+        if isinstance(values, list):
+            records[column] = list(old_records[column]) + values
+        elif column == 'boxes':
+            records[column] = np.concatenate((old_records[column].reshape(-1, 4), values.reshape(-1, 4)))
+        else:
+            records[column] = np.concatenate((old_records[column], values))
+    return records
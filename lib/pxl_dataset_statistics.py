@@ -0,0 +1,162 @@
+import concurrent.futures
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_image_probe import PXL_dataset_image_probe
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import imread
+
+
+class PXL_dataset_statistics(object):
+    """
+    Statistics of a dataset as dataframes, computed from the box tables and dataframes with NumPy instead of row by row:
+        splits         images per split, with their share, and objects per split for object detection
+        classes        boxes per class and split for object detection, images per label and split for classification
+        box_sizes      histogram of the box size, sqrt(w * h) relative to the image, per split
+        aspect_ratios  histogram of the box aspect ratio w / h on a log2 scale, per split
+        resolutions    number of images per width and height and split, read from the image headers
+        mask_coverage  share of the pixels and number of masks per mask value and split
+    Statistics that were not computed are None.
+    """
+    def __init__(self, splits, classes=None, box_sizes=None, aspect_ratios=None, resolutions=None, mask_coverage=None):
+        """
+        Initialize the statistics with their dataframes.
+        """
+        self.splits = splits
+        self.classes = classes
+        self.box_sizes = box_sizes
+        self.aspect_ratios = aspect_ratios
+        self.resolutions = resolutions
+        self.mask_coverage = mask_coverage
+
+    def to_dict(self):
+        """
+        Return the computed statistics as a dict of dataframes.
+        """
+        names = ('splits', 'classes', 'box_sizes', 'aspect_ratios', 'resolutions', 'mask_coverage')
+        return {name: getattr(self, name) for name in names if getattr(self, name) is not None}
+
+    def print(self):
+        """
+        Print every computed statistic.
+        """
+        for name, df in self.to_dict().items():
+            print("{}:".format(name.upper().replace("_", " ")))
+            print(df.to_string())
+
+    def __repr__(self):
+        return "PXL_dataset_statistics({})".format(", ".join(self.to_dict().keys()))
+
+
+def split_counts(df_map: map, box_tables: map = None):
+    """
+    Return a dataframe with the number of images and their percentage per split, and the number of objects when box tables are given.
+    """
+    keys = list(df_map.keys())
+    images = np.array([len(df_map[key]) for key in keys], dtype=np.int64)
+    total = images.sum()
+    df = pd.DataFrame({'images': images, 'percentage': images / total * 100 if total else np.zeros(len(keys))}, index=pd.Index(keys, name='split'))
+    if box_tables is not None:
+        df['objects'] = [len(box_tables[key]) if key in box_tables else 0 for key in keys]
+    return df
+
+
+def class_counts(box_tables: map):
+    """
+    Return a dataframe with the number of boxes per class id (rows) and split (columns).
+    """
+    num_classes = max([int(table.class_id.max()) + 1 for table in box_tables.values() if len(table)] or [0])
+    counts = {key: np.bincount(table.class_id, minlength=num_classes) for key, table in box_tables.items()}
+    return pd.DataFrame(counts, index=pd.Index(np.arange(num_classes), name='class_id'))
+
+
+def label_counts(df_map: map):
+    """
+    Return a dataframe with the number of images per label (rows) and split (columns) of a classification dataset.
+    The labels are taken from the 'label' column, or from the name of the folder of each image.
+    """
+    counts = {}
+    for key, df in df_map.items():
+        labels = df['label'].astype(str) if 'label' in df.columns else df['image'].str.rsplit("/", n=2).str[-2]
+        counts[key] = labels.value_counts()
+    return pd.DataFrame(counts).fillna(0).astype(np.int64).rename_axis('label').sort_index()
+
+
+def box_histograms(box_tables: map, bins: int = 20):
+    """
+    Return the histograms of the relative box size in [0, 1] and of the log2 aspect ratio in [-4, 4] as two dataframes
+    with the bin edges and a column of counts per split. Values outside the range are counted in the outer bins.
+    """
+    size_edges = np.linspace(0.0, 1.0, bins + 1)
+    aspect_edges = np.linspace(-4.0, 4.0, bins + 1)
+    sizes = {}
+    aspects = {}
+    for key, table in box_tables.items():
+        w = table.w.astype(np.float64)
+        h = table.h.astype(np.float64)
+        sizes[key] = np.histogram(np.clip(np.sqrt(w * h), 0.0, 1.0), size_edges)[0]
+        ratio = np.log2(np.maximum(w, 1e-9) / np.maximum(h, 1e-9))
+        aspects[key] = np.histogram(np.clip(ratio, -4.0, 4.0), aspect_edges)[0]
+    return _histogram_frame(size_edges, sizes), _histogram_frame(aspect_edges, aspects)
+
+
+def resolution_counts(df_map: map, max_workers: int = None):
+    """
+    Return a dataframe with the number of images per width, height and split.
+    The sizes are taken from the width and height columns when present, otherwise from the image headers.
+    """
+    probe = PXL_dataset_image_probe(max_workers)
+    frames = []
+    for key, df in df_map.items():
+        sizes = probe.read_split_sizes(df)
+        frames.append(pd.DataFrame({'split': key, 'width': sizes[:, 0], 'height': sizes[:, 1]}))
+    if not frames:
+        return pd.DataFrame(columns=['width', 'height'])
+    return pd.concat(frames).groupby(['width', 'height', 'split']).size().unstack(fill_value=0)
+
+
+def mask_coverage(df_map: map, max_workers: int = None, chunk_size: int = 64):
+    """
+    Return a dataframe with, per mask value and split, the share of all mask pixels with that value and the number of masks that contain it.
+    The masks are decoded and counted with np.bincount on a thread pool.
+    """
+    frames = []
+    for key, df in df_map.items():
+        pixels = np.zeros(256, dtype=np.int64)
+        masks = np.zeros(256, dtype=np.int64)
+        for chunk_pixels, chunk_masks in map_chunks(_count_mask_chunk, chunked(df['segmentation_image'].tolist(), chunk_size), concurrent.futures.ThreadPoolExecutor, max_workers):
+            pixels += chunk_pixels
+            masks += chunk_masks
+        values = np.flatnonzero(pixels)
+        frames.append(pd.DataFrame({'split': key, 'value': values, 'coverage': pixels[values] / max(1, pixels.sum()), 'masks': masks[values]}))
+    if not frames:
+        return pd.DataFrame(columns=['coverage', 'masks'])
+    return pd.concat(frames).set_index(['split', 'value'])
+
+
+def _histogram_frame(edges, counts: map):
+    """
+    Private function that builds a histogram dataframe with the bin edges and the counts per split.
+    """
+    df = pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:]})
+    for key, values in counts.items():
+        df[key] = values
+    return df
+
+
+def _count_mask_chunk(paths):
+    """
+    Private function that counts the pixels per mask value, and the masks that contain every value, of a chunk of masks.
+    """
+    pixels = np.zeros(256, dtype=np.int64)
+    masks = np.zeros(256, dtype=np.int64)
+    for path in paths:
+        mask = imread(path, cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            raise FileNotFoundError("Segmentation image {} could not be read.".format(path))
+        mask_pixels = np.bincount(mask.ravel(), minlength=256)
+        pixels += mask_pixels
+        masks += mask_pixels > 0
+    return pixels, masks
@@ -0,0 +1,135 @@
+import concurrent.futures
+import os
+
+import cv2
+import numpy as np
+
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_writer import format_yolo_lines
+
+
+class PXL_dataset_synthetic(object):
+    """
+    Generator for synthetic datasets in the saved directory layout, used to benchmark the library without downloads.
+    Every image gets boxes_per_image filled rectangles; object detection datasets get a YOLO label file per image
+    and segmentation datasets get a mask in which every rectangle has the value of its class + 1.
+    The content of an image only depends on the seed and its index, so a dataset can be generated again identically.
+    """
+    SPLITS = {"train": 0.8, "valid": 0.1, "test": 0.1}
+
+    def __init__(self, image_size: tuple = (640, 480), boxes_per_image: int = 5, num_classes: int = 3, seed: int = 0, max_workers: int = None, chunk_size: int = 64):
+        """
+        Initialize the generator with the (width, height) of the images, the number of boxes per image and the number of classes.
+        """
+        self.image_size = image_size
+        self.boxes_per_image = boxes_per_image
+        self.num_classes = num_classes
+        self.seed = seed
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def generate_object_detection(self, save_directory: str, num_images: int):
+        """
+        Write an object detection dataset of num_images images with YOLO label files to {save_directory}{split}/.
+        """
+        for folder, indices in self._split_indices(num_images):
+            directory = "{}{}/".format(save_directory, folder)
+            os.makedirs(directory, exist_ok=True)
+            self._generate(directory, directory, None, indices)
+        return save_directory
+
+    def generate_segmentation(self, save_directory: str, num_images: int):
+        """
+        Write a segmentation dataset of num_images images to {save_directory}{split}/image/ and {save_directory}{split}/segmented/.
+        """
+        for folder, indices in self._split_indices(num_images):
+            image_directory = "{}{}/image/".format(save_directory, folder)
+            mask_directory = "{}{}/segmented/".format(save_directory, folder)
+            os.makedirs(image_directory, exist_ok=True)
+            os.makedirs(mask_directory, exist_ok=True)
+            self._generate(image_directory, None, mask_directory, indices)
+        return save_directory
+
+    def generate_label_files(self, directory: str, image_paths):
+        """
+        Write a new YOLO label file for every given image path to directory, named after the image.
+        The boxes are generated with another seed, so they differ from the boxes of the dataset.
+        """
+        os.makedirs(directory, exist_ok=True)
+        names = [os.path.splitext(os.path.basename(path))[0] for path in image_paths]
+        tasks = [(directory + name + ".txt", self.seed + 1, index) for index, name in enumerate(names)]
+        settings = (self.image_size, self.boxes_per_image, self.num_classes)
+        for _ in map_chunks(_write_label_chunk, [(settings, chunk) for chunk in chunked(tasks, self.chunk_size)],
+                            concurrent.futures.ProcessPoolExecutor, self.max_workers):
+            pass
+        return [task[0] for task in tasks]
+
+    def _split_indices(self, num_images: int):
+        """
+        Private method that divides the image indices over the train, valid and test folders. Every split gets at least one image.
+        """
+        counts = [max(1, int(round(num_images * fraction))) for fraction in self.SPLITS.values()]
+        counts[0] = max(1, num_images - sum(counts[1:]))
+        start = 0
+        for folder, count in zip(self.SPLITS.keys(), counts):
+            yield folder, range(start, start + count)
+            start += count
+
+    def _generate(self, image_directory: str, label_directory: str, mask_directory: str, indices):
+        """
+        Private method that generates the images with given indices on a process pool.
+        """
+        settings = (self.image_size, self.boxes_per_image, self.num_classes)
+        tasks = [(image_directory, label_directory, mask_directory, self.seed, index) for index in indices]
+        for _ in map_chunks(_generate_chunk, [(settings, chunk) for chunk in chunked(tasks, self.chunk_size)],
+                            concurrent.futures.ProcessPoolExecutor, self.max_workers):
+            pass
+
+
+def _random_boxes(rng, image_size: tuple, boxes_per_image: int, num_classes: int):
+    """
+    Private function that returns an (n, 5) array of class, cx, cy, w, h and the matching pixel rectangles.
+    """
+    width, height = image_size
+    sizes = rng.uniform(0.05, 0.3, size=(boxes_per_image, 2))
+    centers = rng.uniform(sizes / 2, 1 - sizes / 2)
+    classes = rng.integers(0, num_classes, size=boxes_per_image)
+    labels = np.concatenate((classes[:, None], centers, sizes), axis=1).astype(np.float32)
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    corners = np.concatenate((centers - sizes / 2, centers + sizes / 2), axis=1) * scale
+    return labels, np.round(corners).astype(np.int32)
+
+
+def _generate_chunk(arguments):
+    """
+    Private function that generates and writes a chunk of synthetic images with their labels or masks.
+    """
+    (image_size, boxes_per_image, num_classes), tasks = arguments
+    width, height = image_size
+    for image_directory, label_directory, mask_directory, seed, index in tasks:
+        rng = np.random.default_rng((seed, index))
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = rng.integers(0, 256, size=3, dtype=np.uint8)
+        labels, corners = _random_boxes(rng, image_size, boxes_per_image, num_classes)
+        mask = np.zeros((height, width), dtype=np.uint8) if mask_directory is not None else None
+        for (class_id, *_), (x1, y1, x2, y2) in zip(labels.tolist(), corners.tolist()):
+            cv2.rectangle(image, (x1, y1), (x2, y2), rng.integers(0, 256, size=3).tolist(), -1)
+            if mask is not None:
+                mask[y1:y2, x1:x2] = int(class_id) + 1
+        cv2.imwrite("{}{}.png".format(image_directory, index), image)
+        if label_directory is not None:
+            with open("{}{}.txt".format(label_directory, index), 'w') as file:
+                file.write(format_yolo_lines(labels))
+        if mask is not None:
+            cv2.imwrite("{}{}.png".format(mask_directory, index), mask)
+
+
+def _write_label_chunk(arguments):
+    """
+    Private function that writes a chunk of synthetic YOLO label files.
+    """
+    (image_size, boxes_per_image, num_classes), tasks = arguments
+    for path, seed, index in tasks:
+        labels, _ = _random_boxes(np.random.default_rng((seed, index)), image_size, boxes_per_image, num_classes)
+        with open(path, 'w') as file:
+            file.write(format_yolo_lines(labels))
@@ -0,0 +1,234 @@
+import concurrent.futures
+import os
+
+import cv2
+import numpy as np
+
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_manifest import _decode_strings, _encode_strings
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import imread
+from .pxl_dataset_types import PXL_dataset_types
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_tensor_store(object):
+    """
+    Fixed-resolution store of a dataset: every image of a split is resized, or letterboxed, to one shape and written
+    to one uint8 .npy file of shape (n, height, width, 3) that is opened as a memory map, so reading a sample is a
+    slice without any decoding. Masks are resized with nearest neighbour interpolation to a (n, height, width) file,
+    boxes are rescaled to the new images and stored with the scale and padding of every image and its original size.
+    """
+    INDEX_FILENAME = "pxl_tensor_store.npz"
+    VERSION = 1
+
+    def __init__(self, directory: str, max_workers: int = None, chunk_size: int = 64):
+        """
+        Initialize the store in a directory.
+        """
+        self.directory = directory
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.index_path = os.path.join(directory, self.INDEX_FILENAME)
+        self._index = None
+        self._arrays = {}
+
+    def write(self, dataset_type: PXL_dataset_types, df_map: map, image_size: tuple, letterbox: bool = True, pad_value: int = 114, box_tables: map = None):
+        """
+        Write every split of a df_map at image_size (width, height). With letterbox the aspect ratio is kept and the
+        image is centered on a pad_value border, otherwise the image is stretched. Images are decoded and resized on a
+        thread pool straight into the memory mapped file. Existing stores in the directory are replaced.
+        """
+        width, height = image_size
+        os.makedirs(self.directory, exist_ok=True)
+        for key, df in df_map.items():
+            split_directory = "{}{}/".format(self.directory, key)
+            os.makedirs(split_directory, exist_ok=True)
+            num_images = len(df)
+            images = np.lib.format.open_memmap(split_directory + "images.npy", mode='w+', dtype=np.uint8, shape=(num_images, height, width, 3))
+            masks = None
+            if dataset_type == PXL_dataset_types.Segmentation:
+                masks = np.lib.format.open_memmap(split_directory + "masks.npy", mode='w+', dtype=np.uint8, shape=(num_images, height, width))
+            image_paths = df['image'].tolist()
+            mask_paths = df['segmentation_image'].tolist() if masks is not None else [None] * num_images
+            tasks = chunked(zip(range(num_images), image_paths, mask_paths), self.chunk_size)
+            original_sizes = np.zeros((num_images, 2), dtype=np.int32)
+            transforms = np.zeros((num_images, 3), dtype=np.float32)
+            fill = lambda chunk: _fill_chunk(images, masks, chunk, image_size, letterbox, pad_value)
+            for positions, chunk_sizes, chunk_transforms in map_chunks(fill, tasks, concurrent.futures.ThreadPoolExecutor, self.max_workers):
+                original_sizes[positions] = chunk_sizes
+                transforms[positions] = chunk_transforms
+            images.flush()
+            if masks is not None:
+                masks.flush()
+            annotations = {
+                'name': _encode_strings([path.split("/")[-1] for path in image_paths]),
+                'original_size': original_sizes,
+                'transform': transforms
+            }
+            if dataset_type == PXL_dataset_types.Object_Detection:
+                table = box_tables[key] if box_tables is not None else PXL_dataset_box_table.empty(num_images)
+                boxes = self._rescale_boxes(table, original_sizes, transforms, image_size) if letterbox else table.box_array()
+                annotations.update({'box_count': table.counts(), 'class_id': table.class_id, 'boxes': boxes})
+            elif dataset_type == PXL_dataset_types.Classification:
+                labels = df['label'].tolist() if 'label' in df.columns else [path.split("/")[-2] for path in image_paths]
+                annotations['label'] = _encode_strings([str(label) for label in labels])
+            np.savez(split_directory + "annotations.npz", **annotations)
+        np.savez(self.index_path, __version__=np.array(self.VERSION), __type__=np.array(dataset_type.value),
+                 __splits__=_encode_strings(list(df_map.keys())), image_size=np.array(image_size, dtype=np.int32),
+                 letterbox=np.array(letterbox))
+        self._index = None
+        self._arrays = {}
+        return self
+
+    @property
+    def dataset_type(self):
+        """
+        The dataset type of the store.
+        """
+        return PXL_dataset_types(str(self._read_index()['__type__']))
+
+    @property
+    def image_size(self):
+        """
+        The (width, height) of every image in the store.
+        """
+        return tuple(int(value) for value in self._read_index()['image_size'])
+
+    def keys(self):
+        """
+        Return the split keys of the store.
+        """
+        return _decode_strings(self._read_index()['__splits__'])
+
+    def images(self, key: str):
+        """
+        Return the read only memory mapped (n, height, width, 3) RGB image array of a split.
+        """
+        return self._array(key, "images.npy")
+
+    def masks(self, key: str):
+        """
+        Return the read only memory mapped (n, height, width) mask array of a split of a segmentation store.
+        """
+        if self.dataset_type != PXL_dataset_types.Segmentation:
+            raise PXL_value_exception("Only segmentation stores have masks.")
+        return self._array(key, "masks.npy")
+
+    def annotations(self, key: str):
+        """
+        Return a dict with the names, original sizes, transforms (scale, pad_x, pad_y) and the boxes or labels of a split.
+        """
+        cache_key = (key, "annotations.npz")
+        if cache_key not in self._arrays:
+            with np.load("{}{}/annotations.npz".format(self.directory, key), allow_pickle=False) as data:
+                annotations = {column: data[column] for column in data.files}
+            for column in ('name', 'label'):
+                if column in annotations:
+                    annotations[column] = _decode_strings(annotations[column])
+            self._arrays[cache_key] = annotations
+        return self._arrays[cache_key]
+
+    def box_table(self, key: str):
+        """
+        Return the box table of a split of an object detection store, normalised to the stored images.
+        """
+        annotations = self.annotations(key)
+        if 'boxes' not in annotations:
+            raise PXL_value_exception("Only object detection stores have boxes.")
+        if (key, "box_table") not in self._arrays:
+            self._arrays[(key, "box_table")] = PXL_dataset_box_table.from_arrays(annotations['box_count'], annotations['class_id'], annotations['boxes'])
+        return self._arrays[(key, "box_table")]
+
+    def sample(self, key: str, index: int):
+        """
+        Return a dict with the image of one sample, as a view on the memory map, and its mask, boxes or label.
+        """
+        sample = {'image': self.images(key)[index]}
+        dataset_type = self.dataset_type
+        if dataset_type == PXL_dataset_types.Segmentation:
+            sample['mask'] = self.masks(key)[index]
+        elif dataset_type == PXL_dataset_types.Object_Detection:
+            sample['objects'] = self.box_table(key).label_array(index)
+        else:
+            sample['label'] = self.annotations(key)['label'][index]
+        return sample
+
+    def _read_index(self):
+        """
+        Private method that reads the index of the store once.
+        """
+        if self._index is None:
+            if not os.path.exists(self.index_path):
+                raise PXL_value_exception("There is no tensor store in {}.".format(self.directory))
+            with np.load(self.index_path, allow_pickle=False) as data:
+                if int(data['__version__']) != self.VERSION:
+                    raise PXL_value_exception("The tensor store in {} has an unsupported version.".format(self.directory))
+                self._index = {column: data[column] for column in data.files}
+        return self._index
+
+    def _array(self, key: str, filename: str):
+        """
+        Private method that opens an array file of a split as a read only memory map, once.
+        """
+        if key not in self.keys():
+            raise PXL_value_exception("The split {} is not in the store. The options are {}".format(key, self.keys()))
+        if (key, filename) not in self._arrays:
+            self._arrays[(key, filename)] = np.load("{}{}/{}".format(self.directory, key, filename), mmap_mode='r')
+        return self._arrays[(key, filename)]
+
+    def _rescale_boxes(self, table: PXL_dataset_box_table, original_sizes, transforms, image_size: tuple):
+        """
+        Private method that converts the normalised boxes of the original images to normalised boxes of the letterboxed images.
+        """
+        image_ids = table.image_ids()
+        size = np.array(image_size, dtype=np.float32)
+        original = original_sizes[image_ids].astype(np.float32)
+        scale = transforms[image_ids, :1]
+        pad = transforms[image_ids, 1:]
+        boxes = table.box_array()
+        centers = (boxes[:, :2] * original * scale + pad) / size
+        sizes = boxes[:, 2:] * original * scale / size
+        return np.concatenate((centers, sizes), axis=1).astype(np.float32)
+
+
+def _fit(image, image_size: tuple, letterbox: bool, pad_value: int, interpolation: int):
+    """
+    Private function that resizes or letterboxes one image. Returns the image and the scale, pad_x and pad_y,
+    with a scale of 0 for stretched images, whose normalised coordinates do not change.
+    """
+    width, height = image_size
+    original_height, original_width = image.shape[:2]
+    if not letterbox:
+        return cv2.resize(image, (width, height), interpolation=interpolation), (0.0, 0.0, 0.0)
+    scale = min(width / original_width, height / original_height)
+    new_width = max(1, int(round(original_width * scale)))
+    new_height = max(1, int(round(original_height * scale)))
+    pad_x = (width - new_width) // 2
+    pad_y = (height - new_height) // 2
+    result = np.full((height, width) + image.shape[2:], pad_value, dtype=np.uint8)
+    result[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+    return result, (scale, float(pad_x), float(pad_y))
+
+
+def _fill_chunk(images, masks, chunk, image_size: tuple, letterbox: bool, pad_value: int):
+    """
+    Private function that decodes, resizes and writes a chunk of images, and masks, into the memory maps.
+    Runs on a worker thread. Returns the positions, original sizes and transforms of the chunk.
+    """
+    positions = np.array([position for position, _, _ in chunk], dtype=np.int64)
+    sizes = np.zeros((len(chunk), 2), dtype=np.int32)
+    transforms = np.zeros((len(chunk), 3), dtype=np.float32)
+    for row, (position, image_path, mask_path) in enumerate(chunk):
+        image = imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError("Image {} could not be read.".format(image_path))
+        sizes[row] = (image.shape[1], image.shape[0])
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        images[position], transforms[row] = _fit(image, image_size, letterbox, pad_value, cv2.INTER_AREA)
+        if masks is not None:
+            mask = imread(mask_path, cv2.IMREAD_GRAYSCALE)
+            if mask is None:
+                raise FileNotFoundError("Segmentation image {} could not be read.".format(mask_path))
+            masks[position], _ = _fit(mask, image_size, letterbox, 0, cv2.INTER_NEAREST)
+    return positions, sizes, transforms
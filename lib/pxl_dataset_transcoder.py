@@ -0,0 +1,89 @@
+import concurrent.futures
+import time
+
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_image_probe import sniff_image_format
+from .pxl_dataset_journal import PXL_dataset_journal
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_shard_reader import read_file_bytes
+from .pxl_dataset_writer import PXL_dataset_writer
+
+
+class PXL_dataset_transcoder(object):
+    """
+    Transcoding stage that writes images to their targets in the format of a PXL_dataset_codec.
+    The format of every source is read from its first bytes on a thread pool. Images that are already in the target
+    format are copied as they are on threads, the others are decoded and encoded with the codec on a process pool.
+    The write report counts the transcoded and passed through images, the bytes saved by the transcodes
+    and the estimated time saved by not transcoding the passed through images.
+    Used as a context manager, the worker pools are kept alive between runs.
+    """
+    HEADER_BYTES = 12
+
+    def __init__(self, codec: PXL_dataset_codec = None, max_workers: int = None, chunk_size: int = 16, max_in_flight: int = None):
+        """
+        Initialize the transcoder with the codec, PNG with the default settings when None, the number of workers,
+        the number of images per transcode task and the maximum of tasks in flight.
+        """
+        self.codec = codec or PXL_dataset_codec()
+        self.max_workers = max_workers
+        self._copy_writer = PXL_dataset_writer(max_workers, max_in_flight=max_in_flight)
+        self._transcode_writer = PXL_dataset_writer(max_workers, chunk_size, max_in_flight, self.codec)
+
+    def __enter__(self):
+        self._copy_writer.__enter__()
+        self._transcode_writer.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._copy_writer.__exit__(exc_type, exc_value, traceback)
+        self._transcode_writer.__exit__(exc_type, exc_value, traceback)
+
+    def target_path(self, path: str):
+        """
+        Return the path with the extension of the codec.
+        """
+        return self.codec.target_path(path)
+
+    def run(self, sources, targets, journal: PXL_dataset_journal = None):
+        """
+        Write every source, an image path or encoded image bytes, to its target and return a PXL_dataset_write_report.
+        The targets should have the extension of the codec, see target_path.
+        """
+        start = time.perf_counter()
+        copy_tasks, transcode_tasks = self.plan(sources, targets)
+        report = self._copy_writer.run(copy_tasks, journal=journal)
+        report.passed_through = report.written
+        report.add(self._transcode_writer.run(transcode_tasks, cpu_bound=True, journal=journal))
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def plan(self, sources, targets):
+        """
+        Return the writer tasks that copy the images already in the format of the codec and the tasks that transcode the others.
+        """
+        copy_tasks = []
+        transcode_tasks = []
+        for chunk_copy_tasks, chunk_transcode_tasks in map_chunks(self._plan_chunk, chunked(zip(sources, targets), 256),
+                                                                  concurrent.futures.ThreadPoolExecutor, self.max_workers):
+            copy_tasks.extend(chunk_copy_tasks)
+            transcode_tasks.extend(chunk_transcode_tasks)
+        return copy_tasks, transcode_tasks
+
+    def _plan_chunk(self, pairs):
+        """
+        Private method that reads the format of a chunk of sources and sorts them into copy and transcode tasks.
+        Sources that cannot be read are transcoded, so the error ends up in the report.
+        """
+        copy_tasks = []
+        transcode_tasks = []
+        for source, target in pairs:
+            try:
+                header = source[:self.HEADER_BYTES] if isinstance(source, bytes) else read_file_bytes(source, self.HEADER_BYTES)
+            except OSError:
+                header = b""
+            if self.codec.matches(sniff_image_format(header)):
+                copy_tasks.append(("bytes" if isinstance(source, bytes) else "copy", source, target))
+            else:
+                transcode_tasks.append(("transcode", source, target))
+        return copy_tasks, transcode_tasks
@@ -0,0 +1,287 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_box_table import PXL_dataset_box_table
+from .pxl_dataset_codec import PXL_dataset_codec
+from .pxl_dataset_image_probe import PXL_dataset_image_probe
+from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_view(object):
+    """
+    Lazy view over a saved dataset directory. Opening a view only lists the file names of the split folders;
+    split selection, filtering, slicing and sampling only select row positions and return a new view.
+    Annotations and image metadata are read for the rows of the view when they are asked for, and kept
+    for all views that are derived from the same directory.
+    A view can be turned into a dataset object with to_dataset, so every dataset method runs on just its rows.
+    """
+    METADATA_COLUMNS = ('width', 'height', 'channels', 'format')
+
+    def __init__(self, save_directory: str, dataset_type: PXL_dataset_types, max_workers: int = None):
+        """
+        Open a view over all rows of every split folder of a saved dataset.
+        """
+        self.save_directory = save_directory
+        self.dataset_type = dataset_type
+        self._source = _PXL_dataset_view_source(save_directory, dataset_type, max_workers)
+        self._positions = {key: np.arange(len(paths), dtype=np.int64) for key, paths in self._source.image_paths.items()}
+
+    def keys(self):
+        """
+        Return the split keys of the view.
+        """
+        return list(self._positions.keys())
+
+    def __len__(self):
+        return int(sum(len(positions) for positions in self._positions.values()))
+
+    def __repr__(self):
+        counts = ", ".join("{}={}".format(key, len(positions)) for key, positions in self._positions.items())
+        return "PXL_dataset_view({}, {}, {})".format(self.save_directory, self.dataset_type.name, counts)
+
+    def split(self, *splits: PXL_dataset_split):
+        """
+        Return a view with only the given splits.
+        """
+        keys = [split.name.lower() for split in splits]
+        missing = [key for key in keys if key not in self._positions]
+        if missing:
+            raise PXL_value_exception("The splits {} are not in this view. The options are {}".format(missing, self.keys()))
+        return self._derive({key: self._positions[key] for key in keys})
+
+    def __getitem__(self, selection):
+        """
+        Slice the rows of every split of the view, with a slice, an index or an array of positions within the split.
+        """
+        if isinstance(selection, (int, np.integer)):
+            selection = [selection]
+        return self._derive({key: positions[selection] for key, positions in self._positions.items()})
+
+    def head(self, n: int):
+        """
+        Return a view with the first n rows of every split.
+        """
+        return self[:n]
+
+    def sample(self, n: int, random_state: int = None):
+        """
+        Return a view with n random rows of every split, or all rows of a smaller split.
+        """
+        rng = np.random.default_rng(random_state)
+        return self._derive({key: np.sort(rng.choice(positions, min(n, len(positions)), replace=False))
+                             for key, positions in self._positions.items()})
+
+    def filter(self, function, columns=('image',)):
+        """
+        Return a view with the rows for which function returns True. The function gets the dataframe of a split
+        with the given columns and returns a boolean mask. Only the requested columns are read, so filtering on
+        'image' or 'label' costs nothing, while 'width', 'height', 'channels', 'format' and 'num_objects' are
+        read for the rows of this view only.
+        """
+        positions = {}
+        for key in self._positions.keys():
+            df = self._frame(key, columns)
+            mask = np.asarray(function(df), dtype=bool)
+            positions[key] = self._positions[key][mask]
+        return self._derive(positions)
+
+    def to_df_map(self, metadata: bool = False):
+        """
+        Return the df_map of the rows of the view. With metadata the width, height, channels and format columns are added.
+        """
+        columns = self._source.path_columns + (self.METADATA_COLUMNS if metadata else ())
+        return {key: self._frame(key, columns) for key in self._positions.keys()}
+
+    def box_tables(self):
+        """
+        Return the box table of every split of an object detection view. Only the label files of the rows of the view are read.
+        """
+        if self.dataset_type != PXL_dataset_types.Object_Detection:
+            raise PXL_value_exception("Only object detection datasets have boxes.")
+        return {key: self._source.boxes(key, positions) for key, positions in self._positions.items()}
+
+    def to_dataset(self):
+        """
+        Return a dataset object of the matching type that holds only the rows of the view.
+        Nothing is copied or saved, the dataset refers to the files in the save directory.
+        """
+        # Imported here, the dataset classes import this module themselves.
+        from .pxl_dataset_classification import PXL_classification_dataset
+        from .pxl_dataset_object_detection import PXL_object_detection_dataset
+        from .pxl_dataset_segmentation import PXL_segmentation_dataset
+        dataset_classes = {
+            PXL_dataset_types.Object_Detection: PXL_object_detection_dataset,
+            PXL_dataset_types.Segmentation: PXL_segmentation_dataset,
+            PXL_dataset_types.Classification: PXL_classification_dataset
+        }
+        dataset = dataset_classes[self.dataset_type]()
+        dataset.save_directory = self.save_directory
+        dataset.df_map = self.to_df_map()
+        if self.dataset_type == PXL_dataset_types.Object_Detection:
+            dataset.box_tables = self.box_tables()
+        return dataset
+
+    def display_random_image(self, split: PXL_dataset_split):
+        """
+        Display a random image of the given split. Only the annotations of the chosen row are read.
+        """
+        self.split(split).sample(1).to_dataset().display_random_image(split)
+
+    def export_dataset_in_COCO_format(self, save_directory: str, compact: bool = False, codec: PXL_dataset_codec = None):
+        """
+        Export the rows of an object detection view in the COCO format, with the images transcoded to the codec if one is given.
+        """
+        if self.dataset_type != PXL_dataset_types.Object_Detection:
+            raise PXL_value_exception("Only object detection datasets can be exported in the COCO format.")
+        dataset = self.to_dataset()
+        dataset.export_dataset_in_COCO_format(save_directory, compact, codec)
+        return dataset
+
+    def export_dataset(self, save_directory: str, formats=('yolo', 'coco', 'voc', 'csv'), compact: bool = False, max_workers: int = None,
+                       codec: PXL_dataset_codec = None):
+        """
+        Export the rows of an object detection view to several formats in a single pass.
+        """
+        if self.dataset_type != PXL_dataset_types.Object_Detection:
+            raise PXL_value_exception("Only object detection datasets can be exported.")
+        dataset = self.to_dataset()
+        dataset.export_dataset(save_directory, formats, compact, max_workers, codec)
+        return dataset
+
+    def _derive(self, positions: map):
+        """
+        Private method that returns a view on the same source with other row positions.
+        """
+        view = object.__new__(PXL_dataset_view)
+        view.save_directory = self.save_directory
+        view.dataset_type = self.dataset_type
+        view._source = self._source
+        view._positions = positions
+        return view
+
+    def _frame(self, key: str, columns):
+        """
+        Private method that builds the dataframe of the rows of one split with the given columns.
+        """
+        positions = self._positions[key]
+        data = {}
+        for column in columns:
+            if column in self._source.path_columns:
+                paths = self._source.columns[key][column]
+                data[column] = [paths[position] for position in positions]
+            elif column in self.METADATA_COLUMNS:
+                data[column] = self._source.metadata(key, positions)[column]
+            elif column == 'num_objects':
+                data[column] = self._source.boxes(key, positions).counts()
+            else:
+                raise PXL_value_exception("Unknown column '{}'. The options are {}".format(
+                    column, list(self._source.path_columns + self.METADATA_COLUMNS) + ['num_objects']))
+        return pd.DataFrame(data, columns=list(columns))
+
+
+class _PXL_dataset_view_source(object):
+    """
+    Private class with the file listing of a save directory and the annotations and metadata read so far,
+    shared by all views derived from it.
+    """
+    def __init__(self, save_directory: str, dataset_type: PXL_dataset_types, max_workers: int = None):
+        """
+        List the split folders of the save directory.
+        """
+        self.save_directory = save_directory
+        self.dataset_type = dataset_type
+        self.max_workers = max_workers
+        self.columns = {}
+        self.label_paths = {}
+        self._box_tables = {}
+        self._resolved = {}
+        self._lock = threading.Lock()
+        if dataset_type == PXL_dataset_types.Segmentation:
+            self.path_columns = ('image', 'segmentation_image')
+        elif dataset_type == PXL_dataset_types.Classification:
+            self.path_columns = ('image', 'label')
+        else:
+            self.path_columns = ('image',)
+        if not os.path.isdir(save_directory):
+            raise PXL_value_exception("The save directory {} does not exist.".format(save_directory))
+        with os.scandir(save_directory) as entries:
+            folders = sorted(entry.name for entry in entries if entry.is_dir())
+        for folder in folders:
+            for split in PXL_dataset_split:
+                if folder.startswith(split.value):
+                    self._list_split(split.name.lower(), "{}{}/".format(save_directory, folder))
+
+    @property
+    def image_paths(self):
+        """
+        The image paths of every split.
+        """
+        return {key: columns['image'] for key, columns in self.columns.items()}
+
+    def metadata(self, key: str, positions):
+        """
+        Return the width, height, channels and format of the images at the given positions of a split.
+        """
+        paths = self.columns[key]['image']
+        metadata = PXL_dataset_image_probe(self.max_workers).probe_all([paths[position] for position in positions])
+        return {
+            'width': np.array([item['width'] for item in metadata], dtype=np.int32),
+            'height': np.array([item['height'] for item in metadata], dtype=np.int32),
+            'channels': np.array([item['channels'] for item in metadata], dtype=np.int8),
+            'format': [item['format'] for item in metadata]
+        }
+
+    def boxes(self, key: str, positions):
+        """
+        Return the box table of the rows at the given positions of a split. Label files that were not read yet are parsed first.
+        """
+        with self._lock:
+            resolved = self._resolved[key]
+            stale = np.unique(positions[~resolved[positions]])
+            if len(stale):
+                parsed = PXL_dataset_yolo_ingest(self.max_workers).parse_labels([self.label_paths[key][position] for position in stale])
+                self._box_tables[key] = self._box_tables[key].replace(stale, parsed)
+                resolved[stale] = True
+            return self._box_tables[key].select(positions)
+
+    def _list_split(self, key: str, split_directory: str):
+        """
+        Private method that lists the file names of one split folder without reading any file.
+        """
+        if self.dataset_type == PXL_dataset_types.Segmentation:
+            names = _list_files(split_directory + "image/")
+            self.columns[key] = {
+                'image': [split_directory + "image/" + name for name in names],
+                'segmentation_image': [split_directory + "segmented/" + os.path.splitext(name)[0] + ".png" for name in names]
+            }
+        elif self.dataset_type == PXL_dataset_types.Classification:
+            images = []
+            labels = []
+            for label in _list_files(split_directory, directories=True):
+                names = _list_files("{}{}/".format(split_directory, label))
+                images.extend("{}{}/{}".format(split_directory, label, name) for name in names)
+                labels.extend([label] * len(names))
+            self.columns[key] = {'image': images, 'label': labels}
+        else:
+            image_paths, label_paths = PXL_dataset_yolo_ingest(self.max_workers).scan(split_directory)
+            self.columns[key] = {'image': image_paths}
+            self.label_paths[key] = label_paths
+            self._box_tables[key] = PXL_dataset_box_table.empty(len(image_paths))
+            self._resolved[key] = np.zeros(len(image_paths), dtype=bool)
+
+
+def _list_files(directory: str, directories: bool = False):
+    """
+    Private function that returns the sorted names of the visible files, or folders, in a directory.
+    """
+    if not os.path.isdir(directory):
+        return []
+    with os.scandir(directory) as entries:
+        return sorted(entry.name for entry in entries
+                      if not entry.name.startswith(".") and (entry.is_dir() if directories else entry.is_file()))
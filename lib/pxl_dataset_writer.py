@@ -0,0 +1,280 @@
+import concurrent.futures
+import functools
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from PIL import Image
+
+from .pxl_dataset_journal import PXL_dataset_journal, is_unchanged, source_key, target_entry
+from .pxl_dataset_parallel import chunked, default_worker_count, map_chunks
+from .pxl_dataset_shard_reader import is_shard_path, read_file_bytes
+
+
+class PXL_dataset_write_report(object):
+    """
+    Result of a write stage: the number of written and skipped files, the written bytes, the duration and every failed file.
+    """
+    def __init__(self):
+        """
+        Initialize an empty report.
+        """
+        self.written: int = 0
+        self.skipped: int = 0
+        self.bytes_written: int = 0
+        self.seconds: float = 0.0
+        self.failures: list = []
+        self.transcoded: int = 0
+        self.passed_through: int = 0
+        self.bytes_saved: int = 0
+        self.transcode_seconds: float = 0.0
+
+    @property
+    def ok(self):
+        """
+        True when no file failed.
+        """
+        return len(self.failures) == 0
+
+    @property
+    def seconds_saved(self):
+        """
+        Estimated worker time saved by not transcoding the images that were already in the target format,
+        from the mean time of the images that were transcoded.
+        """
+        if self.transcoded == 0:
+            return 0.0
+        return self.passed_through * self.transcode_seconds / self.transcoded
+
+    def add(self, other):
+        """
+        Add the counts and failures of another report to this one.
+        """
+        self.written += other.written
+        self.skipped += other.skipped
+        self.bytes_written += other.bytes_written
+        self.seconds += other.seconds
+        self.failures.extend(other.failures)
+        self.transcoded += other.transcoded
+        self.passed_through += other.passed_through
+        self.bytes_saved += other.bytes_saved
+        self.transcode_seconds += other.transcode_seconds
+        return self
+
+    def __repr__(self):
+        transcodes = ""
+        if self.transcoded or self.passed_through:
+            transcodes = ", transcoded={}, passed_through={}, bytes_saved={}, seconds_saved={:.2f}".format(
+                self.transcoded, self.passed_through, self.bytes_saved, self.seconds_saved)
+        return "PXL_dataset_write_report(written={}, skipped={}, bytes_written={}, failures={}, seconds={:.2f}{})".format(
+            self.written, self.skipped, self.bytes_written, len(self.failures), self.seconds, transcodes)
+
+
+class PXL_dataset_writer(object):
+    """
+    Writer stage that executes file tasks in chunks on a worker pool with a bounded number of chunks in flight.
+    A task is a plain tuple (kind, source, target), so nothing but paths, bytes and arrays is sent to the workers:
+        ("copy", source_path, target_path)
+        ("move", source_path, target_path)
+        ("link", source_path, target_path), a hard link to the source, or a copy when the source is on another filesystem
+        ("bytes", encoded_image, target_path)
+        ("transcode", encoded_image_or_path, target_path), decodes and saves with the codec of the writer, or else
+                                                          in the format of the target extension with the default settings
+        ("yolo", label_array, target_path), where label_array is an (n, 5) array of class, cx, cy, w, h
+    Copy, move, bytes and label tasks are I/O bound and run on threads, cpu_bound tasks such as transcodes run on processes.
+    Failed tasks are collected in the report instead of being dropped.
+    With a PXL_dataset_journal, tasks whose target is already complete are skipped and completed targets are journalled.
+    Used as a context manager, the worker pools are kept alive between runs.
+    """
+    def __init__(self, max_workers: int = None, chunk_size: int = 256, max_in_flight: int = None, codec=None):
+        """
+        Initialize the writer with the number of workers, the number of tasks per chunk, the maximum of chunks in flight
+        and the PXL_dataset_codec of the transcode tasks.
+        """
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.codec = codec
+        self._executors = None
+
+    def __enter__(self):
+        self._executors = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._executors = None
+
+    def run(self, tasks, cpu_bound: bool = False, journal: PXL_dataset_journal = None):
+        """
+        Execute the tasks, which may be a generator, and return a PXL_dataset_write_report.
+        With a journal the completed targets of every chunk are appended to it as soon as the chunk is done.
+        """
+        start = time.perf_counter()
+        executor_class = concurrent.futures.ProcessPoolExecutor if cpu_bound else concurrent.futures.ThreadPoolExecutor
+        report = PXL_dataset_write_report()
+        executor = self._get_executor(executor_class)
+        if journal is None:
+            write_chunk = functools.partial(_run_write_chunk, codec=self.codec)
+            for chunk_report in map_chunks(write_chunk, chunked(tasks, self.chunk_size), executor_class, self.max_workers, self.max_in_flight, executor):
+                report.add(chunk_report)
+        else:
+            chunks = chunked(journal.lookup(tasks), self.chunk_size)
+            resumable_chunk = functools.partial(_run_resumable_chunk, codec=self.codec)
+            for chunk_report, entries in map_chunks(resumable_chunk, chunks, executor_class, self.max_workers, self.max_in_flight, executor):
+                journal.append(entries)
+                report.add(chunk_report)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _get_executor(self, executor_class):
+        """
+        Private method that returns the kept alive pool of the given class, or None outside of a with block.
+        """
+        if self._executors is None:
+            return None
+        if executor_class not in self._executors:
+            self._executors[executor_class] = executor_class(max_workers=self.max_workers or default_worker_count())
+        return self._executors[executor_class]
+
+
+def format_yolo_lines(label_array):
+    """
+    Format an (n, 5) array of class, cx, cy, w, h as the lines of a YOLO label file.
+    """
+    return "".join("{:d} {:.6f} {:.6f} {:.6f} {:.6f}\n".format(int(row[0]), row[1], row[2], row[3], row[4])
+                   for row in label_array.tolist())
+
+
+def write_file_atomic(target: str, data):
+    """
+    Write bytes or text to a file through a temporary file that replaces the target, so the target is never half written.
+    The temporary file has a unique hidden .tmp name next to the target and is removed when the write fails.
+    """
+    descriptor, temporary_path = tempfile.mkstemp(suffix=".tmp", prefix="." + os.path.basename(target) + ".", dir=os.path.dirname(target) or ".")
+    try:
+        if hasattr(os, 'fchmod'):
+            os.fchmod(descriptor, 0o666 & ~_process_umask())
+        with os.fdopen(descriptor, 'w' if isinstance(data, str) else 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, target)
+    finally:
+        if os.path.lexists(temporary_path):
+            os.remove(temporary_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _process_umask():
+    """
+    Private function that returns the umask of the process, so files written through mkstemp get the permissions
+    of a plain open. It is read from /proc, as os.umask can only be read by setting it for every thread.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    return 0o022
+
+
+def link_file(source: str, target: str):
+    """
+    Hard link the target to the source, or copy the source when it is on another filesystem. The link or copy is made
+    under a temporary name that replaces the target, so an existing target is never removed before the new one is in place.
+    Returns the number of bytes copied, 0 for a link.
+    """
+    temporary_path = "{}.{}.tmp".format(target, uuid.uuid4().hex)
+    try:
+        try:
+            os.link(source, temporary_path)
+            bytes_copied = 0
+        except OSError:
+            shutil.copyfile(source, temporary_path)
+            bytes_copied = os.path.getsize(temporary_path)
+        os.replace(temporary_path, target)
+    finally:
+        if os.path.lexists(temporary_path):
+            os.remove(temporary_path)
+    return bytes_copied
+
+
+def _run_resumable_chunk(tasks, codec=None):
+    """
+    Private function that executes a chunk of (kind, source, target, journal entry) tasks, skipping the complete targets.
+    Returns the report of the chunk and the journal entries of the written and verified targets.
+    """
+    report = PXL_dataset_write_report()
+    entries = []
+    for kind, source, target, entry in tasks:
+        try:
+            key = source_key(kind, source, codec)
+            if is_unchanged(kind, source, target, entry, key):
+                report.skipped += 1
+                if entry is None or (key is not None and entry[0] != key):
+                    entries.append(target_entry(target, key))
+                continue
+        except OSError:
+            pass
+        chunk_report = _run_write_chunk([(kind, source, target)], codec)
+        report.add(chunk_report)
+        if chunk_report.ok:
+            entries.append(target_entry(target, key))
+    return report, entries
+
+
+def _run_write_chunk(tasks, codec=None):
+    """
+    Private function that executes a chunk of write tasks and returns the report of the chunk.
+    Transcode tasks are saved with the given codec, and their time and the difference in size with the source are counted.
+    Copies, bytes, transcodes and label files are written through write_file_atomic, so an interrupted write never
+    leaves a truncated target behind.
+    """
+    report = PXL_dataset_write_report()
+    for kind, source, target in tasks:
+        try:
+            if kind == "copy":
+                data = read_file_bytes(source)
+                write_file_atomic(target, data)
+                report.bytes_written += len(data)
+            elif kind == "move":
+                shutil.move(source, target)
+            elif kind == "link":
+                if os.path.exists(target) and os.path.samefile(source, target):
+                    report.skipped += 1
+                    continue
+                report.bytes_written += link_file(source, target)
+            elif kind == "bytes":
+                write_file_atomic(target, source)
+                report.bytes_written += len(source)
+            elif kind == "transcode":
+                start = time.perf_counter()
+                if is_shard_path(source):
+                    source = read_file_bytes(source)
+                source_size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+                output = io.BytesIO()
+                with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+                    if codec is None:
+                        image.save(output, Image.registered_extensions()[os.path.splitext(target)[1].lower()])
+                    else:
+                        codec.save(image, output)
+                write_file_atomic(target, output.getvalue())
+                target_size = output.tell()
+                report.bytes_written += target_size
+                report.transcoded += 1
+                report.bytes_saved += source_size - target_size
+                report.transcode_seconds += time.perf_counter() - start
+            elif kind == "yolo":
+                text = format_yolo_lines(source)
+                write_file_atomic(target, text)
+                report.bytes_written += len(text)
+            else:
+                raise ValueError("Unknown write task '{}'".format(kind))
+            report.written += 1
+        except Exception as error:
+            report.failures.append((target, "{}: {}".format(type(error).__name__, error)))
+    return report
@@ -0,0 +1,201 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+
+from .pxl_dataset_box_table import PXL_dataset_box_table, _read_yolo_chunk
+from .pxl_dataset_parallel import chunked, map_chunks
+from .pxl_dataset_split import PXL_dataset_split
+from .pxl_value_exception import PXL_value_exception
+
+
+class PXL_dataset_yolo_ingest(object):
+    """
+    Batched ingestion engine for object detection directories with YOLO label files.
+    Every directory is scanned once with os.scandir, images are paired with their label files by name
+    and the label files are parsed in chunks on a process pool.
+    """
+    def __init__(self, max_workers: int = None, chunk_size: int = 4096):
+        """
+        Initialize the engine with the number of worker processes and the number of label files per task.
+        """
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def load_save_dir(self, save_directory: str):
+        """
+        Load every split folder of a saved object detection dataset.
+        Returns the df_map and a map with the box table of every split.
+        """
+        df_map = {}
+        box_tables = {}
+        with os.scandir(save_directory) as entries:
+            split_folders = sorted(entry.name for entry in entries if entry.is_dir())
+        for folder in split_folders:
+            for split in PXL_dataset_split:
+                if folder.startswith(split.value):
+                    prefix = "{}{}/".format(save_directory, folder)
+                    df, box_table = self.load_split(prefix)
+                    df_map[split.name.lower()] = df
+                    box_tables[split.name.lower()] = box_table
+        return df_map, box_tables
+
+    def load_export_tree(self, export_directory: str):
+        """
+        Load an Ultralytics or Roboflow YOLO export with a data.yaml and split folders with images/ and labels/ subfolders.
+        The splits are scanned in parallel on threads, every image is paired with its label file in the same pass and the
+        label files are parsed on the process pool.
+        Returns the df_map with the image paths, a map with the box table and a map with the label paths of every split,
+        and the class names from data.yaml, or None when the file has no names.
+        """
+        export_directory = self._with_separator(export_directory)
+        split_directories, class_names = self.find_export_splits(export_directory)
+        if not split_directories:
+            raise PXL_value_exception("No split folders with images found in {}.".format(export_directory))
+        keys = list(split_directories.keys())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(keys), self.max_workers or len(keys))) as executor:
+            scans = list(executor.map(lambda key: self.scan(*split_directories[key]), keys))
+        df_map = {}
+        box_tables = {}
+        label_paths = {}
+        for key, (image_paths, split_label_paths) in zip(keys, scans):
+            df_map[key] = pd.DataFrame({'image': image_paths})
+            box_tables[key] = self.parse_labels(split_label_paths)
+            label_paths[key] = split_label_paths
+        return df_map, box_tables, label_paths, class_names
+
+    def find_export_splits(self, export_directory: str):
+        """
+        Return a map from split key to (image directory, label directory) and the class names of an export tree.
+        The paths in data.yaml are used when they exist, otherwise the folders that start with a split prefix.
+        The label directory is the image directory with its last 'images' folder replaced by 'labels'.
+        """
+        export_directory = self._with_separator(export_directory)
+        config = {}
+        yaml_path = export_directory + "data.yaml"
+        if os.path.exists(yaml_path):
+            import yaml
+            with open(yaml_path, 'r') as file:
+                config = yaml.safe_load(file) or {}
+        names = config.get('names')
+        class_names = [names[index] for index in sorted(names)] if isinstance(names, dict) else names
+        split_directories = {}
+        for name in ('train', 'val', 'test'):
+            image_directory = self._resolve_export_path(export_directory, config.get(name))
+            if image_directory is not None:
+                split_directories[_split_key(name)] = image_directory
+        with os.scandir(export_directory) as entries:
+            folders = sorted(entry.name for entry in entries if entry.is_dir())
+        for folder in folders:
+            key = _split_key(folder)
+            if key is not None and key not in split_directories:
+                image_directory = "{}{}/images/".format(export_directory, folder)
+                split_directories[key] = image_directory if os.path.isdir(image_directory) else "{}{}/".format(export_directory, folder)
+        directories = {}
+        for key, image_directory in split_directories.items():
+            label_directory = _label_directory(image_directory)
+            directories[key] = (image_directory, label_directory if os.path.isdir(label_directory) else image_directory)
+        return directories, class_names
+
+    def load_split(self, image_directory: str, label_directory: str = None):
+        """
+        Load one split where the images are in image_directory and the labels in label_directory,
+        which defaults to the image directory. Images without a label file get no boxes.
+        """
+        image_paths, label_paths = self.scan(image_directory, label_directory)
+        return pd.DataFrame({'image': image_paths}), self.parse_labels(label_paths)
+
+    def scan(self, image_directory: str, label_directory: str = None):
+        """
+        Scan the image and label directory once and pair every image with its label file.
+        Returns the sorted image paths and the matching label paths, None for images without labels.
+        """
+        image_directory = self._with_separator(image_directory)
+        label_directory = self._with_separator(label_directory) if label_directory else image_directory
+        image_names = []
+        label_stems = set()
+        with os.scandir(image_directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name.endswith(".tmp") or not entry.is_file():
+                    continue
+                if entry.name.endswith(".txt"):
+                    label_stems.add(entry.name[:-4])
+                else:
+                    image_names.append(entry.name)
+        if label_directory != image_directory and os.path.isdir(label_directory):
+            with os.scandir(label_directory) as entries:
+                label_stems = {entry.name[:-4] for entry in entries if entry.name.endswith(".txt") and entry.is_file()}
+        image_names.sort()
+        image_paths = [image_directory + name for name in image_names]
+        label_paths = []
+        for name in image_names:
+            stem = os.path.splitext(name)[0]
+            label_paths.append(label_directory + stem + ".txt" if stem in label_stems else None)
+        return image_paths, label_paths
+
+    def parse_labels(self, label_paths):
+        """
+        Parse the label files in chunks on the worker pool and assemble one box table.
+        """
+        counts = []
+        class_ids = []
+        boxes = []
+        chunks = chunked(label_paths, self.chunk_size)
+        for chunk_counts, chunk_class_ids, chunk_boxes in map_chunks(_read_yolo_chunk, chunks, concurrent.futures.ProcessPoolExecutor, self.max_workers):
+            counts.append(chunk_counts)
+            class_ids.append(chunk_class_ids)
+            boxes.append(chunk_boxes)
+        if not counts:
+            return PXL_dataset_box_table.empty(0)
+        return PXL_dataset_box_table.from_arrays(np.concatenate(counts), np.concatenate(class_ids), np.concatenate(boxes))
+
+    def _resolve_export_path(self, export_directory: str, path):
+        """
+        Private method to find the image directory of a data.yaml entry. Relative paths are only resolved against the
+        export directory, never against the working directory. Roboflow writes paths like ../train/images, relative to
+        a folder inside the export, so the path without its leading ../ parts is tried first, then the path as it is,
+        which can reach the parent of the export directory like in Ultralytics.
+        """
+        if not isinstance(path, str):
+            return None
+        if os.path.isabs(path):
+            candidates = [path]
+        else:
+            stripped = path
+            while stripped.startswith("../"):
+                stripped = stripped[3:]
+            candidates = [os.path.join(export_directory, stripped)]
+            if not path.startswith("../../"):
+                candidates.append(os.path.join(export_directory, path))
+        for candidate in candidates:
+            if os.path.isdir(candidate):
+                return self._with_separator(os.path.normpath(candidate))
+        return None
+
+    def _with_separator(self, directory: str):
+        """
+        Private method to make sure a directory ends with a path separator, as the rest of the library expects.
+        """
+        return directory if directory.endswith("/") else directory + "/"
+
+
+def _split_key(folder: str):
+    """
+    Private function that returns the df_map key of a split folder, or None when it is not a split folder.
+    """
+    for split in PXL_dataset_split:
+        if folder.lower().startswith(split.value):
+            return split.name.lower()
+    return None
+
+
+def _label_directory(image_directory: str):
+    """
+    Private function that returns the label directory of an image directory of a YOLO export.
+    """
+    parts = image_directory.rstrip("/").split("/")
+    if "images" in parts:
+        index = len(parts) - 1 - parts[::-1].index("images")
+        parts[index] = "labels"
+    return "/".join(parts) + "/"
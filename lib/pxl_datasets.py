@@ -1,10 +1,19 @@
 # Import custom modules
+from .pxl_dataset_batches import PXL_dataset_batch_iterator, read_image, stack_arrays
+from .pxl_dataset_dedup import PXL_dataset_dedup
+from .pxl_dataset_image_probe import PXL_dataset_image_probe
 from .pxl_dataset_loader import PXL_dataset_loader
+from .pxl_dataset_shards import PXL_dataset_shards
 from .pxl_dataset_sources import PXL_dataset_sources
 from .pxl_dataset_split import PXL_dataset_split
+from .pxl_dataset_statistics import PXL_dataset_statistics, resolution_counts, split_counts
+from .pxl_dataset_tensor_store import PXL_dataset_tensor_store
 from .pxl_dataset_types import PXL_dataset_types
+from .pxl_dataset_view import PXL_dataset_view
 from .pxl_value_exception import PXL_value_exception
 
+import numpy as np
+
 
 class PXL_datasets:
     """
@@ -73,18 +82,89 @@ class PXL_datasets:
             print("Source:\t{}".format(self.dataset_source))
         if self.url:
             print("Url:\t{}".format(self.url))
-        total_rows = 0
-        for split in PXL_dataset_split:
-            total_rows += len(self.df_map[split.name.lower()])
+        splits = self.statistics().splits
         print("Total number of rows:")
-        print("\t{}".format(total_rows))
+        print("\t{}".format(int(splits['images'].sum())))
         print("Number of rows per split:")
-        for split in PXL_dataset_split:
-            print("\t{}:".format(split.name))
-            num_rows = len(self.df_map[split.name.lower()])
-            num_row_percentage = (float(num_rows) / float(total_rows))*100
-            print("\t\t{}\t{}%".format(num_rows, num_row_percentage))
+        for key, row in splits.iterrows():
+            print("\t{}:".format(key))
+            print("\t\t{}\t{}%".format(int(row['images']), row['percentage']))
+
+    def statistics(self, resolutions:bool=False, max_workers:int=None):
+        """
+        Return a PXL_dataset_statistics with the images per split and the statistics of the dataset type,
+        computed with vectorised operations over the loaded dataset. Only the splits in the df_map are counted.
+        With resolutions the number of images per width and height is added, read from the image headers or the width and height columns.
+        """
+        statistics = PXL_dataset_statistics(split_counts(self.df_map))
+        if resolutions:
+            statistics.resolutions = resolution_counts(self.df_map, max_workers)
+        return statistics
+
+    def probe_image_metadata(self, max_workers:int=None):
+        """
+        Add width, height, channels and format columns to every split of the df_map.
+        The values are read from the image headers on a thread pool, without decoding the pixels.
+        """
+        probe = PXL_dataset_image_probe(max_workers)
+        for key in self.df_map.keys():
+            self.df_map[key] = probe.probe_split(self.df_map[key])
+        return self.df_map
+
+    def find_duplicates(self, max_distance:int=4, remove:bool=False,
+                        keep_order:tuple=(PXL_dataset_split.Test, PXL_dataset_split.Validation, PXL_dataset_split.Train),
+                        cache_path:str=None, max_workers:int=None):
+        """
+        Find exact and near duplicate images within and across the splits and return a PXL_dataset_dedup_report.
+        Images whose perceptual hashes differ in at most max_distance bits are near duplicates, pairs across splits are leakage.
+        With remove, one image of every group of duplicates is kept, in the first split of keep_order, and the others are
+        dropped from the df_map. The files on disk are not touched, save the dataset again to write the cleaned splits.
+        """
+        report = PXL_dataset_dedup(max_distance, cache_path, max_workers).find(self.df_map)
+        if remove:
+            for key, positions in report.duplicates_to_remove(keep_order).items():
+                if len(positions):
+                    self._remove_rows(key, positions)
+        return report
+
+    def save_as_shards(self, save_directory:str, shard_size:int=PXL_dataset_shards.DEFAULT_SHARD_SIZE):
+        """
+        Save the dataset in the packed shard layout: the files of every split are appended to large shard files
+        with one index for the whole dataset. load_from_save_dir opens such a directory transparently.
+        Returns a PXL_dataset_write_report.
+        """
+        return PXL_dataset_shards(save_directory, shard_size).write(self.dataset_type, self.df_map)
+
+    def export_tensor_store(self, save_directory:str, image_size:tuple, letterbox:bool=True, pad_value:int=114):
+        """
+        Export every split resized, or letterboxed, to image_size (width, height) into one memory mapped uint8 array per split.
+        Returns the PXL_dataset_tensor_store, whose samples are slices of the memory map without any decoding.
+        """
+        return PXL_dataset_tensor_store(save_directory).write(self.dataset_type, self.df_map, image_size, letterbox, pad_value)
+
+    def view(self, save_directory:str=None, max_workers:int=None):
+        """
+        Open a lazy PXL_dataset_view over the save directory of this dataset, or over another saved dataset of the same type.
+        The view does not need the dataset to be loaded and only reads the annotations of the rows it touches.
+        """
+        return PXL_dataset_view(save_directory or self.save_directory, self.dataset_type, max_workers)
 
+    def iter_batches(self, split:PXL_dataset_split, batch_size:int=32, shuffle:bool=False, image_size:tuple=None, prefetch:int=2,
+                     seed:int=None, drop_last:bool=False, max_workers:int=None):
+        """
+        Iterate over the given split in batches of NumPy arrays, for feeding a training loop.
+        The images are decoded and resized to image_size (width, height) on a thread pool while earlier batches are consumed,
+        with at most prefetch batches decoded ahead. Without an image_size all images of a batch must have the same size.
+        Every batch is a dict with an 'images' array of shape (batch, height, width, 3) and the annotations of the dataset type.
+        """
+        key = split.name.lower()
+        if key not in self.df_map:
+            raise PXL_value_exception("The split {} is not in this dataset. The options are {}".format(key, list(self.df_map.keys())))
+        num_rows = len(self.df_map[key])
+        positions = np.random.default_rng(seed).permutation(num_rows) if shuffle else np.arange(num_rows)
+        return PXL_dataset_batch_iterator(lambda position: self._read_batch_sample(key, position, image_size),
+                                          lambda batch_positions, samples: self._collate_batch(key, batch_positions, samples),
+                                          positions, batch_size, prefetch, max_workers, drop_last)
 
     def display_random_image(self, split:PXL_dataset_split):
         """
@@ -95,6 +175,26 @@ class PXL_datasets:
         """
         pass
 
+    def _read_batch_sample(self, key:str, position:int, image_size:tuple=None):
+        """
+        Private method that reads the image at a position of a split for iter_batches. Runs on a worker thread.
+        """
+        return read_image(self.df_map[key]['image'].iat[position], image_size)
+
+    def _collate_batch(self, key:str, positions, samples):
+        """
+        Private method that stacks the samples of a batch for iter_batches.
+        """
+        return {'images': stack_arrays(samples), 'positions': positions}
+
+    def _remove_rows(self, key:str, positions):
+        """
+        Private method that drops the rows at the given positions from a split and renumbers the remaining rows.
+        """
+        keep = np.ones(len(self.df_map[key]), dtype=bool)
+        keep[positions] = False
+        self.df_map[key] = self.df_map[key][keep].reset_index(drop=True)
+
     def _set_dataset_source_and_name_from_url(self, url: str):
         """
         Private method to set the dataset source and name from the given URL.
@@ -0,0 +1,97 @@
+import os
+import tarfile
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from lib.pxl_dataset_archive_ingest import PXL_dataset_archive_ingest
+from lib.pxl_dataset_codec import PXL_dataset_codec
+from lib.pxl_dataset_loader_kaggle import PXL_dataset_loader_kaggle
+from lib.pxl_dataset_object_detection import PXL_object_detection_dataset
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_types import PXL_dataset_types
+from lib.pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+def _zip_directory(directory, archive_path, prefix="dataset/"):
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                archive.write(path, prefix + os.path.relpath(path, directory).replace(os.sep, "/"))
+
+
+def test_segmentation_masks_stay_lossless_png_with_a_jpeg_codec(tmp_path):
+    source = str(tmp_path / "source") + "/"
+    PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_segmentation(source, 10)
+    for root, _, files in os.walk(source):
+        for filename in files:
+            if os.path.basename(root) == "segmented":
+                path = os.path.join(root, filename)
+                Image.open(path).save(os.path.splitext(path)[0] + ".bmp")
+                os.remove(path)
+    archive_path = str(tmp_path / "dataset.zip")
+    _zip_directory(source, archive_path)
+    save_directory = str(tmp_path / "save") + "/"
+
+    ingest = PXL_dataset_archive_ingest(max_workers=2, codec=PXL_dataset_codec('jpeg', quality=50))
+    df_map = ingest.ingest(archive_path, PXL_dataset_types.Segmentation, save_directory)
+
+    assert ingest.last_write_report.ok
+    for key, df in df_map.items():
+        assert len(df) > 0
+        for image_path, mask_path in zip(df['image'], df['segmentation_image']):
+            assert image_path.endswith(".jpg") and mask_path.endswith(".png")
+            with Image.open(mask_path) as mask:
+                assert mask.format == 'PNG'
+                saved = np.asarray(mask)
+            name = os.path.splitext(os.path.basename(mask_path))[0] + ".bmp"
+            folder = {"train": "train", "validation": "valid", "test": "test"}[key]
+            expected = np.asarray(Image.open("{}{}/segmented/{}".format(source, folder, name)))
+            assert np.array_equal(saved, expected)
+
+
+def _tar_directory(directory, archive_path, prefix="dataset/"):
+    with tarfile.open(archive_path, 'w:gz') as archive:
+        archive.add(directory, prefix.rstrip("/"))
+
+
+def test_object_detection_zip_and_tar_ingest(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 12)
+    expected_df_map, expected_box_tables = PXL_dataset_yolo_ingest().load_save_dir(source)
+    for archive_name, pack in (("dataset.zip", _zip_directory), ("dataset.tar.gz", _tar_directory)):
+        archive_path = str(tmp_path / archive_name)
+        pack(source, archive_path)
+        save_directory = str(tmp_path / archive_name.replace(".", "_")) + "/"
+        loader = PXL_dataset_loader_kaggle(archive_path=archive_path, max_workers=2)
+        dataset = PXL_object_detection_dataset()
+        dataset.load_from_df_map(None, save_directory, loader)
+
+        assert loader.last_write_report.ok
+        assert loader.last_write_report.written == sum(2 * len(df) for df in expected_df_map.values())
+        assert sorted(dataset.df_map.keys()) == sorted(expected_df_map.keys())
+        for key, df in dataset.df_map.items():
+            assert 'objects' not in df.columns
+            for saved_path, source_path in zip(df['image'], expected_df_map[key]['image']):
+                assert os.path.basename(saved_path) == os.path.basename(source_path)
+                assert open(saved_path, 'rb').read() == open(source_path, 'rb').read()
+            assert np.array_equal(dataset.box_tables[key].counts(), expected_box_tables[key].counts())
+            assert np.allclose(dataset.box_tables[key].box_array(), expected_box_tables[key].box_array())
+
+
+def test_classification_folders_become_labels(tmp_path):
+    source = str(tmp_path / "source") + "/"
+    for split, count in (("train", 4), ("test", 2)):
+        for label in ("cat", "dog"):
+            os.makedirs("{}{}/{}".format(source, split, label))
+            for index in range(count):
+                Image.new('RGB', (8, 8), (index, 0, 0)).save("{}{}/{}/{}.png".format(source, split, label, index))
+    archive_path = str(tmp_path / "dataset.zip")
+    _zip_directory(source, archive_path, prefix="outer/inner/")
+
+    df_map = PXL_dataset_archive_ingest(max_workers=2).ingest(archive_path, PXL_dataset_types.Classification, str(tmp_path / "save") + "/")
+
+    assert sorted(df_map.keys()) == ["test", "train"]
+    assert sorted(df_map['train']['label'].value_counts().items()) == [("cat", 4), ("dog", 4)]
+    assert all(os.path.isfile(path) for path in df_map['test']['image'])
@@ -0,0 +1,54 @@
+import numpy as np
+
+from lib.pxl_dataset_box_table import PXL_dataset_box_table
+
+
+def _table():
+    return PXL_dataset_box_table.from_objects([
+        [{"name": "0", "centerNSize": ["0.5", "0.5", "0.2", "0.4"]}, {"name": "2", "poly": [["0.1", "0.2"], ["0.3", "0.2"], ["0.3", "0.6"]]}],
+        None,
+        np.array([[1, 0.25, 0.75, 0.1, 0.1]], dtype=np.float32)
+    ])
+
+
+def test_from_objects_reads_dicts_polygons_and_arrays():
+    table = _table()
+
+    assert table.num_images == 3
+    assert table.counts().tolist() == [2, 0, 1]
+    assert table.class_id.tolist() == [0, 2, 1]
+    assert np.allclose(table.boxes(0), [[0.5, 0.5, 0.2, 0.4], [0.2, 0.4, 0.2, 0.4]])
+    assert table.boxes(1).shape == (0, 4)
+    assert np.allclose(table.label_array(2), [[1, 0.25, 0.75, 0.1, 0.1]])
+    assert table.objects(0)[1]["name"] == "2"
+
+
+def test_yolo_files_with_box_and_polygon_lines(tmp_path):
+    boxes_path = tmp_path / "boxes.txt"
+    boxes_path.write_text("0 0.500000 0.500000 0.200000 0.400000\n3 0.1 0.2 0.3 0.4\n")
+    mixed_path = tmp_path / "mixed.txt"
+    mixed_path.write_text("1 0.5 0.5 0.1 0.1\n\n2 0.1 0.1 0.5 0.1 0.5 0.3 0.1 0.3\n")
+
+    table = PXL_dataset_box_table.from_yolo_files([str(boxes_path), None, str(mixed_path), str(tmp_path / "missing.txt")], missing_ok=True)
+
+    assert table.counts().tolist() == [2, 0, 2, 0]
+    assert table.class_ids(0).tolist() == [0, 3]
+    assert table.class_ids(2).tolist() == [1, 2]
+    assert np.allclose(table.boxes(2), [[0.5, 0.5, 0.1, 0.1], [0.3, 0.2, 0.4, 0.2]])
+
+
+def test_select_and_replace_keep_the_boxes_of_every_image():
+    table = _table()
+
+    selected = table.select([2, 0])
+    assert selected.counts().tolist() == [1, 2]
+    assert selected.class_id.tolist() == [1, 0, 2]
+    assert np.allclose(selected.boxes(1), table.boxes(0))
+
+    other = PXL_dataset_box_table.from_arrays([3], [4, 5, 6], np.full((3, 4), 0.5))
+    replaced = table.replace([1], other)
+    assert replaced.counts().tolist() == [2, 3, 1]
+    assert replaced.class_id.tolist() == [0, 2, 4, 5, 6, 1]
+    assert np.allclose(replaced.boxes(2), table.boxes(2))
+
+    assert PXL_dataset_box_table.concatenate([table, selected]).counts().tolist() == [2, 0, 1, 1, 2]
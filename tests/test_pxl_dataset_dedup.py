@@ -0,0 +1,72 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from lib.pxl_dataset_dedup import PXL_dataset_dedup
+from lib.pxl_dataset_split import PXL_dataset_split
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+def _df_map_with_duplicates(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(128, 96), boxes_per_image=3, max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 20)
+    df_map, _ = PXL_dataset_yolo_ingest().load_save_dir(source)
+    train = df_map['train']['image'].tolist()
+    exact_copy = str(tmp_path / "exact_copy.png")
+    shutil.copyfile(train[0], exact_copy)
+    near_copy = str(tmp_path / "near_copy.jpg")
+    Image.open(train[1]).convert('RGB').save(near_copy, quality=95)
+    train_copy = str(tmp_path / "train_copy.png")
+    shutil.copyfile(train[0], train_copy)
+    df_map['train'] = pd.DataFrame({'image': train + [train_copy]})
+    df_map['test'] = pd.DataFrame({'image': df_map['test']['image'].tolist() + [exact_copy]})
+    df_map['validation'] = pd.DataFrame({'image': df_map['validation']['image'].tolist() + [near_copy]})
+    return df_map
+
+
+def test_exact_near_and_leaking_pairs(tmp_path):
+    PXL_dataset_dedup.clear_cache()
+    df_map = _df_map_with_duplicates(tmp_path)
+    report = PXL_dataset_dedup(max_distance=4, max_workers=2).find(df_map)
+
+    pairs = {(frozenset([(row.split_a, row.image_a.split("/")[-1]), (row.split_b, row.image_b.split("/")[-1])]), row.exact)
+             for row in report.pairs.itertuples()}
+    train = [path.split("/")[-1] for path in df_map['train']['image']]
+    assert pairs == {
+        (frozenset([('train', train[0]), ('train', 'train_copy.png')]), True),
+        (frozenset([('train', train[0]), ('test', 'exact_copy.png')]), True),
+        (frozenset([('train', 'train_copy.png'), ('test', 'exact_copy.png')]), True),
+        (frozenset([('train', train[1]), ('validation', 'near_copy.jpg')]), False)
+    }
+    assert len(report.exact) == 3 and len(report.near) == 1 and len(report.leakage) == 3
+
+
+def test_duplicates_to_remove_keeps_one_image_per_group(tmp_path):
+    PXL_dataset_dedup.clear_cache()
+    df_map = _df_map_with_duplicates(tmp_path)
+    report = PXL_dataset_dedup(max_distance=4, max_workers=2).find(df_map)
+
+    remove = report.duplicates_to_remove()
+    assert remove['train'].tolist() == [0, 1, len(df_map['train']) - 1]
+    assert len(remove['test']) == 0 and len(remove['validation']) == 0
+
+    remove = report.duplicates_to_remove(keep_order=(PXL_dataset_split.Train, PXL_dataset_split.Validation, PXL_dataset_split.Test))
+    assert remove['train'].tolist() == [len(df_map['train']) - 1]
+    assert remove['test'].tolist() == [len(df_map['test']) - 1]
+    assert remove['validation'].tolist() == [len(df_map['validation']) - 1]
+
+
+def test_hashes_are_cached_in_a_file(tmp_path):
+    PXL_dataset_dedup.clear_cache()
+    df_map = _df_map_with_duplicates(tmp_path)
+    paths = df_map['train']['image'].tolist()
+    cache_path = str(tmp_path / "hashes.npz")
+    content_hashes, perceptual_hashes = PXL_dataset_dedup(cache_path=cache_path).hash_images(paths)
+
+    PXL_dataset_dedup.clear_cache()
+    cached_content_hashes, cached_perceptual_hashes = PXL_dataset_dedup(cache_path=cache_path).hash_images(paths)
+    assert cached_content_hashes == content_hashes
+    assert np.array_equal(cached_perceptual_hashes, perceptual_hashes)
+    assert content_hashes[0] == content_hashes[-1]
@@ -0,0 +1,70 @@
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from lib.pxl_dataset_box_table import PXL_dataset_box_table
+from lib.pxl_dataset_export import PXL_dataset_export
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+def test_every_sink_gets_the_same_images_and_boxes(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 12)
+    df_map, box_tables = PXL_dataset_yolo_ingest().load_save_dir(source)
+    save_directory = str(tmp_path / "export") + "/"
+
+    report = PXL_dataset_export.from_formats(save_directory, ('yolo', 'coco', 'voc', 'csv'), max_workers=2).run(df_map, box_tables)
+
+    assert report.ok and report.written == sum(len(df) for df in df_map.values())
+    manifest = pd.read_csv(save_directory + "csv/manifest.csv")
+    assert len(manifest) == report.written
+    for key, df in df_map.items():
+        table = box_tables[key]
+        names = [path.split("/")[-1] for path in df['image']]
+        labels = ["{}yolo/{}/labels/{}.txt".format(save_directory, key, os.path.splitext(name)[0]) for name in names]
+        assert np.allclose(PXL_dataset_box_table.from_yolo_files(labels).box_array(), table.box_array(), atol=1e-6)
+        for name in names:
+            yolo_image = "{}yolo/{}/images/{}".format(save_directory, key, name)
+            assert os.path.samefile(yolo_image, "{}coco/{}/{}".format(save_directory, key, name))
+            assert os.path.samefile(yolo_image, "{}voc/{}/JPEGImages/{}".format(save_directory, key, name))
+
+        coco = json.load(open("{}coco/{}/dataset.json".format(save_directory, key)))
+        assert [image['file_name'] for image in coco['images']] == names
+        assert all(image['width'] == 64 and image['height'] == 48 for image in coco['images'])
+        assert len(coco['annotations']) == len(table)
+
+        for name, count in zip(names, table.counts()):
+            root = ET.parse("{}voc/{}/Annotations/{}.xml".format(save_directory, key, os.path.splitext(name)[0])).getroot()
+            assert len(root.findall('object')) == count
+
+        rows = manifest[manifest['split'] == key]
+        assert rows['file_name'].tolist() == names and rows['num_objects'].tolist() == table.counts().tolist()
+    assert os.path.isfile(save_directory + "yolo/data.yaml")
+
+
+def test_images_that_fail_are_left_out_of_every_sink(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 10)
+    df_map, box_tables = PXL_dataset_yolo_ingest().load_save_dir(source)
+    train = df_map['train']
+    missing = str(tmp_path / "missing.png")
+    objects = [box_tables['train'].label_array(index) for index in range(len(train))]
+    df_map = {'train': pd.DataFrame({'image': [train['image'][0], missing] + train['image'][1:].tolist()})}
+    table = PXL_dataset_box_table.from_objects([objects[0], np.array([[0, 0.5, 0.5, 0.2, 0.2]])] + objects[1:])
+    save_directory = str(tmp_path / "export") + "/"
+
+    report = PXL_dataset_export.from_formats(save_directory, ('yolo', 'coco', 'voc', 'csv'), max_workers=2).run(df_map, {'train': table})
+
+    assert [path for path, _ in report.failures] == [missing] and report.written == len(train)
+    names = [path.split("/")[-1] for path in train['image']]
+    coco = json.load(open(save_directory + "coco/train/dataset.json"))
+    assert [image['file_name'] for image in coco['images']] == names
+    assert [image['id'] for image in coco['images']] == [0] + list(range(2, len(train) + 1))
+    assert all(image['width'] == 64 and image['height'] == 48 for image in coco['images'])
+    assert len(coco['annotations']) == len(box_tables['train']) and 1 not in {annotation['image_id'] for annotation in coco['annotations']}
+    assert sorted(os.listdir(save_directory + "yolo/train/labels/")) == sorted(os.path.splitext(name)[0] + ".txt" for name in names)
+    assert sorted(os.listdir(save_directory + "voc/train/Annotations/")) == sorted(os.path.splitext(name)[0] + ".xml" for name in names)
+    manifest = pd.read_csv(save_directory + "csv/manifest.csv")
+    assert manifest['file_name'].tolist() == names and manifest['num_objects'].tolist() == box_tables['train'].counts().tolist()
@@ -0,0 +1,23 @@
+import numpy as np
+from PIL import Image
+
+from lib.pxl_dataset_image_probe import PXL_dataset_image_probe
+
+
+def test_cache_is_bounded_and_follows_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(PXL_dataset_image_probe, 'MAX_CACHE_ENTRIES', 3)
+    PXL_dataset_image_probe.clear_cache()
+    paths = [str(tmp_path / "{}.png".format(index)) for index in range(5)]
+    for index, path in enumerate(paths):
+        Image.fromarray(np.zeros((10 + index, 20, 3), dtype=np.uint8)).save(path)
+    probe = PXL_dataset_image_probe(max_workers=2)
+
+    assert [item['height'] for item in probe.probe_all(paths)] == [10, 11, 12, 13, 14]
+    assert len(PXL_dataset_image_probe._cache) == 3
+    assert probe.probe(paths[2])['height'] == 12
+    assert list(PXL_dataset_image_probe._cache) == [paths[3], paths[4], paths[2]]
+
+    Image.fromarray(np.zeros((40, 30), dtype=np.uint8)).save(paths[4], 'JPEG')
+    assert probe.probe(paths[4]) == {"width": 30, "height": 40, "channels": 1, "format": "jpeg"}
+    assert len(PXL_dataset_image_probe._cache) == 3
+    PXL_dataset_image_probe.clear_cache()
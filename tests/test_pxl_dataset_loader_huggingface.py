@@ -0,0 +1,35 @@
+import io
+import os
+
+import datasets
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from lib import pxl_dataset_loader_huggingface
+from lib.pxl_dataset_loader_huggingface import PXL_dataset_loader_huggingface
+from lib.pxl_dataset_sources import PXL_dataset_sources
+
+
+def _png_bytes(value):
+    output = io.BytesIO()
+    Image.fromarray(np.full((8, 8, 3), value, dtype=np.uint8)).save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_streaming_keeps_no_path_for_images_that_failed(tmp_path, monkeypatch):
+    images = [{'bytes': _png_bytes(0), 'path': None}, {'bytes': b"not an image", 'path': None}, {'bytes': _png_bytes(255), 'path': None}]
+    features = datasets.Features({'image': datasets.Image(), 'label': datasets.Value('int64')})
+    split = datasets.Dataset.from_dict({'image': images, 'label': [0, 1, 2]}, features=features).to_iterable_dataset()
+    monkeypatch.setattr(pxl_dataset_loader_huggingface, 'load_from_huggingface', lambda name, streaming=False: datasets.IterableDatasetDict({'train': split}))
+    save_directory = str(tmp_path / "save") + "/"
+    loader = PXL_dataset_loader_huggingface(streaming=True, batch_size=2)
+
+    df_map = loader.download_dataset(None, PXL_dataset_sources.HuggingFace, "synthetic", save_directory)
+
+    assert [path for path, _ in loader.last_write_report.failures] == [save_directory + "train/1.png"]
+    paths = df_map['train']['image'].tolist()
+    assert paths[0] == save_directory + "train/0.png" and paths[2] == save_directory + "train/2.png"
+    assert pd.isna(paths[1])
+    assert all(os.path.isfile(path) for path in (paths[0], paths[2])) and not os.path.exists(save_directory + "train/1.png")
+    assert df_map['train']['label'].tolist() == [0, 1, 2]
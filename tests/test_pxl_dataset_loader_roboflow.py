@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import numpy as np
+
+from lib.pxl_dataset_loader_roboflow import PXL_dataset_loader_roboflow
+from lib.pxl_dataset_object_detection import PXL_object_detection_dataset
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+def _export_tree(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 10)
+    export_directory = str(tmp_path / "export") + "/"
+    for split in ("train", "valid", "test"):
+        os.makedirs("{}{}/images".format(export_directory, split))
+        os.makedirs("{}{}/labels".format(export_directory, split))
+        for name in sorted(os.listdir(source + split)):
+            folder = "labels" if name.endswith(".txt") else "images"
+            shutil.copyfile("{}{}/{}".format(source, split, name), "{}{}/{}/{}".format(export_directory, split, folder, name))
+    with open(export_directory + "data.yaml", 'w') as file:
+        file.write("train: ../train/images\nval: ../valid/images\ntest: ../test/images\nnc: 3\nnames: ['a', 'b', 'c']\n")
+    return source, export_directory
+
+
+def test_export_tree_is_linked_into_the_save_directory(tmp_path):
+    source, export_directory = _export_tree(tmp_path)
+    os.remove(export_directory + "train/labels/0.txt")
+    expected_df_map, expected_box_tables = PXL_dataset_yolo_ingest().load_save_dir(source)
+    save_directory = str(tmp_path / "save") + "/"
+    loader = PXL_dataset_loader_roboflow(export_directory=export_directory, max_workers=2)
+    dataset = PXL_object_detection_dataset()
+    dataset.load_from_df_map(None, save_directory, loader)
+
+    assert loader.last_write_report.ok
+    assert loader.class_names == ['a', 'b', 'c']
+    assert sorted(dataset.df_map.keys()) == sorted(expected_df_map.keys())
+    for key, df in dataset.df_map.items():
+        folder = {"train": "train", "validation": "valid", "test": "test"}[key]
+        for saved_path in df['image']:
+            assert os.path.samefile(saved_path, "{}{}/images/{}".format(export_directory, folder, os.path.basename(saved_path)))
+            assert os.path.isfile(os.path.splitext(saved_path)[0] + ".txt")
+        counts = expected_box_tables[key].counts()
+        if key == "train":
+            assert dataset.box_tables[key].counts()[0] == 0
+            assert open(save_directory + "train/0.txt").read() == ""
+            counts[0] = 0
+        assert np.array_equal(dataset.box_tables[key].counts(), counts)
+
+
+def test_resume_skips_the_linked_files(tmp_path):
+    _, export_directory = _export_tree(tmp_path)
+    save_directory = str(tmp_path / "save") + "/"
+    loader = PXL_dataset_loader_roboflow(resume=True, max_workers=2)
+    first = loader.ingest_export(export_directory, save_directory)
+    written = loader.last_write_report.written
+
+    second = loader.ingest_export(export_directory, save_directory)
+
+    assert written == 2 * sum(len(df) for df in first.values())
+    assert loader.last_write_report.written == 0
+    assert loader.last_write_report.skipped == written
+    assert {key: df['image'].tolist() for key, df in first.items()} == {key: df['image'].tolist() for key, df in second.items()}
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from lib.pxl_dataset_manifest import PXL_dataset_manifest
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_types import PXL_dataset_types
+from lib.pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+def _touch_later(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_build_matches_a_directory_scan(tmp_path):
+    save_directory = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path) + "/", 10)
+    manifest = PXL_dataset_manifest(save_directory, PXL_dataset_types.Object_Detection)
+    df_map, box_tables = manifest.load_object_detection()
+    expected_df_map, expected_box_tables = PXL_dataset_yolo_ingest().load_save_dir(save_directory)
+
+    assert os.path.isfile(manifest.path)
+    assert sorted(df_map.keys()) == sorted(expected_df_map.keys())
+    for key in df_map.keys():
+        assert df_map[key]['image'].tolist() == expected_df_map[key]['image'].tolist()
+        assert (df_map[key]['width'] == 64).all() and (df_map[key]['height'] == 48).all()
+        assert np.array_equal(box_tables[key].counts(), expected_box_tables[key].counts())
+        assert np.allclose(box_tables[key].box_array(), expected_box_tables[key].box_array())
+
+
+def test_changed_label_file_is_parsed_again(tmp_path):
+    save_directory = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path) + "/", 10)
+    manifest = PXL_dataset_manifest(save_directory, PXL_dataset_types.Object_Detection)
+    df_map, box_tables = manifest.load_object_detection()
+    label_path = os.path.splitext(df_map['train']['image'][0])[0] + ".txt"
+    with open(label_path, 'w') as file:
+        file.write("2 0.500000 0.500000 0.250000 0.250000\n")
+    _touch_later(label_path)
+
+    _, stale_box_tables = manifest.load_object_detection(validate=False)
+    assert np.array_equal(stale_box_tables['train'].counts(), box_tables['train'].counts())
+
+    _, refreshed = manifest.load_object_detection()
+    assert refreshed['train'].counts()[0] == 1
+    assert refreshed['train'].class_ids(0).tolist() == [2]
+    assert np.array_equal(refreshed['train'].counts()[1:], box_tables['train'].counts()[1:])
+    assert np.allclose(refreshed['train'].box_array()[1:], box_tables['train'].box_array()[box_tables['train'].counts()[0]:])
+
+
+def test_removed_image_and_invalidate(tmp_path):
+    save_directory = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path) + "/", 10)
+    manifest = PXL_dataset_manifest(save_directory, PXL_dataset_types.Object_Detection)
+    df_map, _ = manifest.load_object_detection()
+    os.remove(df_map['train']['image'][0])
+
+    reloaded, box_tables = manifest.load_object_detection()
+    assert len(reloaded['train']) == len(df_map['train']) - 1
+    assert box_tables['train'].num_images == len(reloaded['train'])
+
+    manifest.invalidate()
+    assert not os.path.exists(manifest.path)
+
+
+def test_segmentation_masks_of_jpeg_images_are_recorded(tmp_path):
+    save_directory = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_segmentation(str(tmp_path) + "/", 10)
+    image_directory = save_directory + "train/image/"
+    for name in os.listdir(image_directory):
+        path = image_directory + name
+        Image.open(path).convert('RGB').save(os.path.splitext(path)[0] + ".jpg")
+        os.remove(path)
+    manifest = PXL_dataset_manifest(save_directory, PXL_dataset_types.Segmentation)
+    records = {key: records for key, _, records in manifest._load_records(True)}
+
+    assert (records['train']['annotation_size'] > 0).all()
+    df = manifest.load_segmentation()['train']
+    assert all(os.path.isfile(path) for path in df['segmentation_image'])
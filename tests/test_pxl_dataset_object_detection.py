@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import numpy as np
+
+from lib.pxl_dataset_box_table import PXL_dataset_box_table
+from lib.pxl_dataset_object_detection import PXL_object_detection_dataset
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+
+
+def test_replace_object_files_only_reloads_the_changed_rows(tmp_path):
+    generator = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2)
+    save_directory = generator.generate_object_detection(str(tmp_path / "save") + "/", 10)
+    dataset = PXL_object_detection_dataset()
+    dataset.load_from_save_dir(save_directory, use_manifest=False)
+    train = dataset.df_map['train']['image'].tolist()
+    labels = [os.path.splitext(path)[0] + ".txt" for path in train]
+    old_boxes = dataset.box_tables['train'].box_array().copy()
+    old_counts = dataset.box_tables['train'].counts().copy()
+
+    source_directory = str(tmp_path / "new_labels") + "/"
+    generator.generate_label_files(source_directory, [train[1]])
+    shutil.copyfile(labels[0], source_directory + os.path.basename(labels[0]))
+    with open(source_directory + "unknown.txt", 'w') as file:
+        file.write("0 0.5 0.5 0.1 0.1\n")
+    old_second_label = open(labels[1]).read()
+    with open(labels[2], 'w') as file:
+        file.write("")
+    backup_directory = str(tmp_path / "backup") + "/"
+
+    report = dataset.replace_object_files(source_directory, backup_directory, max_workers=2)
+
+    assert report.ok and report.written == 1 and report.skipped == 1
+    assert os.listdir(backup_directory) == [os.path.basename(labels[1])]
+    assert open(backup_directory + os.path.basename(labels[1])).read() == old_second_label
+    table = dataset.box_tables['train']
+    expected = PXL_dataset_box_table.from_yolo_files([source_directory + os.path.basename(labels[1])])
+    assert np.allclose(table.boxes(1), expected.boxes(0))
+    assert not np.allclose(table.boxes(1), old_boxes[old_counts[0]:old_counts[0] + old_counts[1]])
+    assert table.counts()[2] == old_counts[2]
+    assert np.allclose(table.boxes(0), old_boxes[:old_counts[0]])
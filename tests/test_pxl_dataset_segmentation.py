@@ -0,0 +1,80 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from lib.pxl_dataset_codec import PXL_dataset_codec
+from lib.pxl_dataset_loader import PXL_dataset_loader
+from lib.pxl_dataset_segmentation import PXL_segmentation_dataset, _extract_boxes_from_mask
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_types import PXL_dataset_types
+from lib.pxl_dataset_view import PXL_dataset_view
+
+
+def _synthetic_df_map(directory):
+    PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_segmentation(directory, 10)
+    df_map = {}
+    for folder, key in (("train", "train"), ("valid", "validation"), ("test", "test")):
+        images = sorted(glob.glob("{}{}/image/*.png".format(directory, folder)))
+        df_map[key] = pd.DataFrame({'image': images, 'segmentation_image': [path.replace("/image/", "/segmented/") for path in images]})
+    return df_map
+
+
+def test_save_with_a_jpeg_codec_and_reload(tmp_path):
+    df_map = _synthetic_df_map(str(tmp_path / "source") + "/")
+    save_directory = str(tmp_path / "save") + "/"
+    dataset = PXL_segmentation_dataset()
+    dataset.load_from_df_map(df_map, save_directory, PXL_dataset_loader(codec=PXL_dataset_codec('jpeg')))
+    assert dataset.loader.last_write_report.ok
+
+    loaded = [
+        PXL_segmentation_dataset().load_from_save_dir(save_directory, use_manifest=False),
+        PXL_segmentation_dataset().load_from_save_dir(save_directory),
+        PXL_dataset_view(save_directory, PXL_dataset_types.Segmentation).to_df_map()
+    ]
+    for reloaded in loaded:
+        assert sorted(reloaded.keys()) == sorted(df_map.keys())
+        for key, df in reloaded.items():
+            assert len(df) == len(df_map[key])
+            for image_path, mask_path in zip(df['image'], df['segmentation_image']):
+                assert image_path.endswith(".jpg") and mask_path.endswith(".png")
+                assert os.path.splitext(os.path.basename(image_path))[0] == os.path.splitext(os.path.basename(mask_path))[0]
+                assert os.path.isfile(mask_path)
+                source_mask = "{}{}/segmented/{}".format(str(tmp_path / "source") + "/", {"train": "train", "validation": "valid", "test": "test"}[key],
+                                                        os.path.basename(mask_path))
+                assert np.array_equal(np.asarray(Image.open(mask_path)), np.asarray(Image.open(source_mask)))
+
+
+def test_every_nonzero_mask_value_is_a_region(tmp_path):
+    mask = np.zeros((20, 40), dtype=np.uint8)
+    mask[2:6, 2:10] = 1
+    mask[10:14, 10:20] = 2
+    mask[10:14, 20:30] = 3
+    mask[16, 32] = 3
+    mask[17, 33] = 3
+    path = str(tmp_path / "mask.png")
+    Image.fromarray(mask).save(path)
+
+    labels, boxes = _extract_boxes_from_mask(path)
+
+    pixels = np.round(boxes * [40, 20, 40, 20]).astype(int)
+    found = sorted(zip(labels.tolist(), map(tuple, pixels.tolist())))
+    assert found == [(1, (6, 4, 8, 4)), (2, (15, 12, 10, 4)), (3, (25, 12, 10, 4)), (3, (33, 17, 2, 2))]
+
+
+def test_convert_to_object_detection_dataset(tmp_path):
+    df_map = _synthetic_df_map(str(tmp_path / "source") + "/")
+    dataset = PXL_segmentation_dataset()
+    dataset.df_map = df_map
+
+    converted = dataset.convert_to_object_detection_dataset(str(tmp_path / "converted") + "/", max_workers=2)
+
+    for key, df in df_map.items():
+        table = converted.box_tables[key]
+        assert table.num_images == len(df)
+        assert (table.counts() > 0).all()
+        assert set(table.class_id.tolist()) <= {0, 1, 2}
+        assert ((table.box_array() > 0) & (table.box_array() <= 1)).all()
+    assert 'segmentation_image' not in converted.df_map['train'].columns
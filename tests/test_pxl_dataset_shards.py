@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib.pxl_dataset_shard_reader import imread, is_shard_path, read_file_bytes
+from lib.pxl_dataset_shards import PXL_dataset_shards
+from lib.pxl_dataset_synthetic import PXL_dataset_synthetic
+from lib.pxl_dataset_types import PXL_dataset_types
+from lib.pxl_dataset_yolo_ingest import PXL_dataset_yolo_ingest
+
+
+def test_pack_load_and_unpack_round_trip(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 12)
+    expected_df_map, expected_box_tables = PXL_dataset_yolo_ingest().load_save_dir(source)
+    shards = PXL_dataset_shards(str(tmp_path / "shards") + "/", shard_size=4096, max_workers=2)
+
+    report = shards.pack(source, PXL_dataset_types.Object_Detection)
+    assert report.ok and report.written == sum(len(df) for df in expected_df_map.values())
+    assert PXL_dataset_shards.is_sharded(shards.save_directory)
+    assert len(os.listdir(shards.save_directory + "train/")) > 1
+
+    df_map, box_tables = shards.load_object_detection()
+    for key, df in df_map.items():
+        for shard_path, source_path in zip(df['image'], expected_df_map[key]['image']):
+            assert is_shard_path(shard_path)
+            assert bytes(read_file_bytes(shard_path)) == open(source_path, 'rb').read()
+        assert (df['width'] == 64).all() and (df['height'] == 48).all()
+        assert imread(df['image'][0]).shape == (48, 64, 3)
+        assert np.array_equal(box_tables[key].counts(), expected_box_tables[key].counts())
+        assert np.allclose(box_tables[key].box_array(), expected_box_tables[key].box_array())
+
+    unpacked = str(tmp_path / "unpacked") + "/"
+    assert shards.unpack(unpacked).ok
+    unpacked_df_map, unpacked_box_tables = PXL_dataset_yolo_ingest().load_save_dir(unpacked)
+    for key, df in unpacked_df_map.items():
+        for unpacked_path, source_path in zip(df['image'], expected_df_map[key]['image']):
+            assert open(unpacked_path, 'rb').read() == open(source_path, 'rb').read()
+        assert np.allclose(unpacked_box_tables[key].box_array(), expected_box_tables[key].box_array(), atol=1e-6)
+
+
+def test_unreadable_files_are_reported_and_left_out(tmp_path):
+    source = PXL_dataset_synthetic(image_size=(64, 48), max_workers=2).generate_object_detection(str(tmp_path / "source") + "/", 10)
+    df_map, box_tables = PXL_dataset_yolo_ingest().load_save_dir(source)
+    train = df_map['train']
+    missing = str(tmp_path / "missing.png")
+    images = [train['image'][0], missing] + train['image'][1:].tolist()
+    objects = [box_tables['train'].label_array(0), np.zeros((0, 5))] + [box_tables['train'].label_array(index) for index in range(1, len(train))]
+    shards = PXL_dataset_shards(str(tmp_path / "shards") + "/")
+
+    report = shards.write(PXL_dataset_types.Object_Detection, {'train': pd.DataFrame({'image': images, 'objects': objects})})
+
+    assert [path for path, _ in report.failures] == [missing]
+    loaded_df_map, loaded_box_tables = shards.load_object_detection()
+    assert len(loaded_df_map['train']) == len(train)
+    assert np.array_equal(loaded_box_tables['train'].counts(), box_tables['train'].counts())
+    for shard_path, source_path in zip(loaded_df_map['train']['image'], train['image']):
+        assert bytes(read_file_bytes(shard_path)) == open(source_path, 'rb').read()
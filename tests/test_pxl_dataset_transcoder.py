@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from lib.pxl_dataset_codec import PXL_dataset_codec
+from lib.pxl_dataset_journal import PXL_dataset_journal
+from lib.pxl_dataset_transcoder import PXL_dataset_transcoder
+from lib.pxl_value_exception import PXL_value_exception
+
+
+def _write_source(path):
+    gradient = np.linspace(0, 255, 64 * 48 * 3).reshape(48, 64, 3)
+    noise = np.random.default_rng(0).integers(0, 64, (48, 64, 3))
+    Image.fromarray((gradient + noise).clip(0, 255).astype(np.uint8)).save(path)
+
+
+def test_resume_with_other_codec_settings_transcodes_again(tmp_path):
+    source = str(tmp_path / "image.png")
+    _write_source(source)
+    save_directory = str(tmp_path / "save") + "/"
+    (tmp_path / "save").mkdir()
+    target = save_directory + "image.jpg"
+
+    report = PXL_dataset_transcoder(PXL_dataset_codec('jpeg', quality=95)).run([source], [target], PXL_dataset_journal(save_directory))
+    assert report.transcoded == 1
+    high_quality = open(target, 'rb').read()
+
+    report = PXL_dataset_transcoder(PXL_dataset_codec('jpeg', quality=95)).run([source], [target], PXL_dataset_journal(save_directory))
+    assert report.transcoded == 0 and report.skipped == 1
+
+    report = PXL_dataset_transcoder(PXL_dataset_codec('jpeg', quality=20)).run([source], [target], PXL_dataset_journal(save_directory))
+    assert report.transcoded == 1 and report.skipped == 0
+    assert open(target, 'rb').read() != high_quality
+
+
+def test_jpeg_quality_above_95_is_rejected():
+    assert PXL_dataset_codec('jpeg', quality=95).quality == 95
+    assert PXL_dataset_codec('webp', quality=100).quality == 100
+    with pytest.raises(PXL_value_exception):
+        PXL_dataset_codec('jpeg', quality=96)
+
+
+def test_resumed_copies_are_not_counted_as_passed_through(tmp_path):
+    sources = [str(tmp_path / "image.png"), str(tmp_path / "other.png")]
+    for source in sources:
+        _write_source(source)
+    save_directory = str(tmp_path / "save") + "/"
+    (tmp_path / "save").mkdir()
+    targets = [save_directory + "image.png", save_directory + "other.png"]
+
+    report = PXL_dataset_transcoder(PXL_dataset_codec('png')).run(sources, targets, PXL_dataset_journal(save_directory))
+    assert report.passed_through == 2 and report.written == 2
+
+    report = PXL_dataset_transcoder(PXL_dataset_codec('png')).run(sources, targets, PXL_dataset_journal(save_directory))
+    assert report.passed_through == 0 and report.skipped == 2 and report.seconds_saved == 0
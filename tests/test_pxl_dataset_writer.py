@@ -0,0 +1,37 @@
+import os
+import stat
+
+import numpy as np
+from PIL import Image
+
+from lib.pxl_dataset_writer import PXL_dataset_writer, write_file_atomic
+
+
+def test_failed_tasks_leave_no_partial_files(tmp_path):
+    source = str(tmp_path / "source.png")
+    Image.fromarray(np.zeros((8, 8, 3), dtype=np.uint8)).save(source)
+    target_directory = tmp_path / "target"
+    target_directory.mkdir()
+    tasks = [
+        ("copy", source, str(target_directory / "copy.png")),
+        ("transcode", source, str(target_directory / "transcode.jpg")),
+        ("transcode", b"not an image", str(target_directory / "broken.jpg")),
+        ("copy", str(tmp_path / "missing.png"), str(target_directory / "missing.png"))
+    ]
+    report = PXL_dataset_writer(max_workers=2).run(tasks)
+
+    assert report.written == 2 and len(report.failures) == 2
+    assert sorted(os.listdir(target_directory)) == ["copy.png", "transcode.jpg"]
+    with Image.open(str(target_directory / "transcode.jpg")) as image:
+        assert image.format == 'JPEG'
+
+
+def test_write_file_atomic_uses_the_default_permissions(tmp_path):
+    umask = os.umask(0o022)
+    os.umask(umask)
+    target = str(tmp_path / "labels.txt")
+    write_file_atomic(target, "0 0.5 0.5 0.1 0.1\n")
+
+    assert open(target).read() == "0 0.5 0.5 0.1 0.1\n"
+    assert stat.S_IMODE(os.stat(target).st_mode) == 0o666 & ~umask
+    assert os.listdir(str(tmp_path)) == ["labels.txt"]